@@ -3,11 +3,6 @@ import uuid
 from pathlib import Path
 
 from kissllm.client import LLMClient
-from kissllm.mcp import (
-    SSEMCPConfig,
-    StdioMCPConfig,
-)
-from kissllm.mcp.manager import MCPManager
 from kissllm.tools import ToolManager
 
 from arox.agent_patterns.state import SimpleState
@@ -56,6 +51,10 @@ class LLMBaseAgent:
             config.agent.mcp_servers if hasattr(config.agent, "mcp_servers") else None
         )
         if self.mcp_servers:
+            # The MCP client and its dependencies are only loaded when used
+            from kissllm.mcp import SSEMCPConfig, StdioMCPConfig
+            from kissllm.mcp.manager import MCPManager
+
             mcp_configs = []
             for server_name, server_conf_dict in self.mcp_servers.items():
                 if "command" in server_conf_dict:
@@ -91,6 +90,7 @@ class LLMBaseAgent:
 
     async def llm_node(self, input_content: str):
         await self._run_before_hooks(input_content)
+        await self.state.prepare_prompt(input_content)
         messages, _ = self.state.assemble_prompt(input_content)
         self.model_params["stream"] = True
         await LLMClient(
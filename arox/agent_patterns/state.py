@@ -6,6 +6,7 @@ from kissllm.client import DefaultResponseHandler
 from kissllm.stream import CompletionStream
 
 from arox.utils import xml_wrap
+from arox.utils.io import content_store
 
 logger = logging.getLogger(__name__)
 
@@ -80,16 +81,17 @@ class ChatFiles:
         for fname in files:
             p = fname if fname.is_absolute() else self.workspace / fname
             try:
-                with open(p, "r") as f:
-                    content = f.read()
-                    fpaths.append(fname)
-                    logger.debug(f"Adding content from {fname}")
-                    file_content = (
-                        f"\n====FILE: {fname}====\n{content}\n\n{file_content}"
-                    )
+                content = content_store.read_text(p)
             except FileNotFoundError:
                 print(f"File not found: {p}")
                 continue
+            if content is None:
+                print(f"Skipping {p}, it is not valid UTF-8")
+                continue
+
+            fpaths.append(fname)
+            logger.debug(f"Adding content from {fname}")
+            file_content = f"\n====FILE: {fname}====\n{content}\n\n{file_content}"
 
         self.clear_pending()
         return file_content, fpaths
@@ -122,6 +124,9 @@ class SimpleState:
             items.append(("user_instruction", user_input))
         return items
 
+    async def prepare_prompt(self, user_input: str):
+        """Compute, off the event loop, what the next assemble_prompt needs."""
+
     def assemble_prompt(self, user_input: str):
         messages = self.messages
         items = self._get_message_items(user_input)
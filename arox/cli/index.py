@@ -0,0 +1,61 @@
+"""Prebuild the repo map index of a workspace, or share it as an artifact.
+
+The workspace defaults to the working directory.
+
+    arox-index [--workspace DIR] build [--workers N]
+    arox-index [--workspace DIR] export FILE [--workers N]
+    arox-index [--workspace DIR] import FILE
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from arox.codebase import index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workspace", default=".", help="Workspace directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="fill the tags cache")
+    build.add_argument("--workers", type=int, help="tags extraction processes")
+
+    export = subparsers.add_parser("export", help="build, then write an artifact")
+    export.add_argument("file")
+    export.add_argument("--workers", type=int, help="tags extraction processes")
+
+    import_ = subparsers.add_parser("import", help="load an artifact")
+    import_.add_argument("file")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    file = os.path.abspath(args.file) if "file" in args else None
+    # The tags cache is keyed by paths relative to the workspace
+    os.chdir(args.workspace)
+    workspace = os.getcwd()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        metrics = index.build_index(workspace, args.workers)
+        print(f"Tags cache {metrics.summary()}")
+    elif args.command == "export":
+        num_blobs = index.export_index(workspace, file, args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Exported the tags of {num_blobs} files to {file} in {elapsed:.1f}s")
+    else:
+        try:
+            num_files = index.import_index(workspace, file)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        elapsed = time.perf_counter() - start
+        print(f"Imported the tags of {num_files} files from {file} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""A background process keeping the repo map of a workspace warm.
+
+Without it, every arox-coder session opens the tags cache, lists the tracked
+files and ranks the repo again from scratch. With the `repo_map_daemon` option
+the session attaches to a daemon serving the ProjectManager of the workspace
+over a Unix socket instead, and starts it if it isn't running. The daemon keeps
+the RepoMap with its caches and last ranks, the tracked files and the file
+watcher between sessions, and exits after `idle_timeout` seconds without
+clients.
+
+Requests are JSON lines `{"method": ..., "params": {...}}`, naming a
+ProjectManager method or property and its arguments, answered with
+`{"result": ...}` or `{"error": ...}`. Paths are relative to the workspace,
+which is the working directory of the daemon.
+
+    python -m arox.codebase.daemon WORKSPACE [--options JSON] [--stop]
+"""
+
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from arox.utils.text_edit import TextEdit
+
+from . import project
+from .metrics import MapMetrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds without clients before the daemon exits
+IDLE_TIMEOUT = 3600
+
+# Seconds to wait for a new daemon to answer, and for a quick request
+START_TIMEOUT = 10
+REQUEST_TIMEOUT = 10
+
+# Bound on the size of one request or response, which may hold file contents
+MAX_MESSAGE_SIZE = 2**28
+
+# ProjectManager methods run in a thread, as they may wait for a build or git
+BLOCKING_METHODS = ("get_tracked_files", "get_repo_map", "file_edited")
+# ... and the ones run in the event loop
+LOOP_METHODS = (
+    "get_map_tokens",
+    "get_repo_map_async",
+    "start_repo_map",
+    "repo_map_status",
+    "cancel_repo_map",
+    "cache_stats",
+)
+PROPERTIES = ("building", "last_good_map", "last_metrics")
+
+
+class DaemonError(Exception):
+    """Raised by a request the daemon failed to handle."""
+
+
+def socket_path(workspace) -> Path:
+    """Return the path of the socket of the daemon of `workspace`."""
+    root = Path(workspace).absolute()
+    digest = hashlib.sha1(str(root).encode()).hexdigest()[:16]
+    # Unix socket paths are limited to about a hundred chars, so they can't
+    # be under the workspace.
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return Path(runtime_dir) / f"arox-{os.getuid()}" / f"{digest}.sock"
+
+
+def check_socket_dir(path):
+    """Create the directory of the socket `path` if missing.
+
+    Raises DaemonError unless it is a directory only the user can access, as
+    another user could otherwise serve their own repo map on the socket.
+    """
+    directory = Path(path).parent
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(st.st_mode)
+        or st.st_uid != os.getuid()
+        or stat.S_IMODE(st.st_mode) != 0o700
+    ):
+        raise DaemonError(f"{directory} is not a directory private to the user")
+
+
+def open_private(path, flags):
+    """Open `path` without following symlinks, creating it only readable by
+    the user."""
+    fd = os.open(path, flags | os.O_CREAT | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600)
+    return os.fdopen(fd, "ab" if flags & os.O_APPEND else "w")
+
+
+def encode_edits(edits):
+    if edits is None:
+        return None
+    return [edit._asdict() for edit in edits]
+
+
+def decode_edits(edits):
+    if edits is None:
+        return None
+    return [
+        TextEdit(**{k: tuple(v) if isinstance(v, list) else v for k, v in edit.items()})
+        for edit in edits
+    ]
+
+
+class DaemonServer:
+    """Serves the ProjectManager of `workspace`, created with `options`."""
+
+    def __init__(self, workspace, idle_timeout=IDLE_TIMEOUT, **options):
+        self.workspace = Path(workspace).absolute()
+        self.path = socket_path(self.workspace)
+        self.idle_timeout = idle_timeout
+        self.project_manager = project.ProjectManager(str(self.workspace), **options)
+        self._clients = 0
+        self._last_active = time.monotonic()
+        self._stopped = None
+
+    async def serve(self):
+        """Serve until shut down or idle.
+
+        Returns False right away if another daemon serves the workspace.
+        """
+        check_socket_dir(self.path)
+        # Held for the lifetime of the daemon, so two daemons starting at the
+        # same time don't replace each other's socket.
+        lock = open_private(self.path.with_suffix(".lock"), os.O_WRONLY)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+
+        try:
+            # Left by a daemon that was killed
+            self.path.unlink(missing_ok=True)
+            self._stopped = asyncio.Event()
+            server = await asyncio.start_unix_server(
+                self._handle, path=str(self.path), limit=MAX_MESSAGE_SIZE
+            )
+            os.chmod(self.path, 0o600)
+            logger.info(f"Serving {self.workspace} on {self.path}")
+            async with server:
+                await self._wait_until_idle()
+        finally:
+            self.path.unlink(missing_ok=True)
+            lock.close()
+        return True
+
+    async def _wait_until_idle(self):
+        while not self._stopped.is_set():
+            timeout = self.idle_timeout
+            if timeout is not None and not self._clients:
+                idle = time.monotonic() - self._last_active
+                if idle >= timeout:
+                    logger.info(f"No clients for {idle:.0f}s, exiting")
+                    return
+                timeout -= idle
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def stop(self):
+        """Stop serving, from the event loop of the daemon."""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _handle(self, reader, writer):
+        self._clients += 1
+        try:
+            while line := await reader.readline():
+                response = await self.dispatch(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # ValueError if a line is over the limit
+            logger.warning(f"Dropped a client: {e}")
+        except asyncio.CancelledError:
+            # Shutting down with the client still connected
+            pass
+        finally:
+            self._clients -= 1
+            self._last_active = time.monotonic()
+            writer.close()
+
+    async def dispatch(self, line):
+        try:
+            request = json.loads(line)
+            result = await self.call(request["method"], request.get("params") or {})
+            return {"result": result}
+        except Exception as e:
+            logger.debug("Request failed", exc_info=True)
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    async def call(self, method, params):
+        pm = self.project_manager
+        if method == "ping":
+            return {"pid": os.getpid(), "workspace": str(self.workspace)}
+        if method == "shutdown":
+            self.stop()
+            return None
+        if method in PROPERTIES:
+            result = getattr(pm, method)
+            if isinstance(result, MapMetrics):
+                result = result.to_dict()
+            return result
+        if method == "file_edited":
+            params["edits"] = decode_edits(params.get("edits"))
+        if method in BLOCKING_METHODS:
+            return await asyncio.to_thread(getattr(pm, method), **params)
+        if method in LOOP_METHODS:
+            result = getattr(pm, method)(**params)
+            if asyncio.iscoroutine(result):
+                result = await result
+            if asyncio.isfuture(result):
+                # start_repo_map, the client doesn't wait for the build
+                result = None
+            return result
+        raise ValueError(f"Unknown method {method}")
+
+
+class DaemonClient:
+    """Sends requests to the daemon listening on `path`, one connection per
+    request."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @staticmethod
+    def _request(method, params):
+        return json.dumps({"method": method, "params": params}).encode() + b"\n"
+
+    @staticmethod
+    def _result(line):
+        if not line:
+            raise ConnectionError("The repo map daemon closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["result"]
+
+    def call(self, method, params=None, timeout=REQUEST_TIMEOUT):
+        """Return the result of `method`. Raises OSError if the daemon can't
+        be reached, and DaemonError if the request failed."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(self.path))
+            sock.sendall(self._request(method, params or {}))
+            with sock.makefile("rb") as f:
+                line = f.readline(MAX_MESSAGE_SIZE)
+        return self._result(line)
+
+    async def acall(self, method, params=None):
+        """Like `call`, without blocking the event loop or a timeout."""
+        reader, writer = await asyncio.open_unix_connection(
+            str(self.path), limit=MAX_MESSAGE_SIZE
+        )
+        try:
+            writer.write(self._request(method, params or {}))
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            writer.close()
+        return self._result(line)
+
+
+def start_daemon(workspace, **options):
+    """Start the daemon of `workspace` in the background."""
+    root = Path(workspace).absolute()
+    path = socket_path(root)
+    check_socket_dir(path)
+    # The daemon runs in the workspace, it must still import this arox
+    package_root = str(Path(__file__).absolute().parents[2])
+    pythonpath = os.environ.get("PYTHONPATH")
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([package_root, pythonpath])
+        if pythonpath
+        else package_root,
+    )
+    with open_private(path.with_suffix(".log"), os.O_WRONLY | os.O_APPEND) as log:
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "arox.codebase.daemon",
+                str(root),
+                "--options",
+                json.dumps(options),
+            ],
+            cwd=root,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            # Outlives the session that started it
+            start_new_session=True,
+        )
+
+
+def connect(workspace, start=True, timeout=START_TIMEOUT, **options):
+    """Return a client of the daemon of `workspace`, starting it with
+    `options` if it isn't running and `start` is set. Returns None if the
+    daemon doesn't answer or its socket isn't private to the user."""
+    path = socket_path(workspace)
+    try:
+        check_socket_dir(path)
+    except (DaemonError, OSError) as e:
+        logger.warning(f"Not using the repo map daemon: {e}")
+        return None
+    client = DaemonClient(path)
+    try:
+        client.call("ping")
+        return client
+    except OSError:
+        if not start:
+            return None
+
+    start_daemon(workspace, **options)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        try:
+            client.call("ping")
+            return client
+        except OSError:
+            pass
+    return None
+
+
+class RemoteProjectManager:
+    """A ProjectManager of `workspace` living in its daemon.
+
+    Has the same interface as ProjectManager, and falls back to a local one if
+    the daemon can't be reached. A running daemon keeps the options it was
+    started with.
+    """
+
+    def __init__(self, workspace, start_daemon=True, **options):
+        self.workspace = workspace
+        self.options = options
+        self.local = None
+        self.client = connect(workspace, start=start_daemon, **options)
+        if self.client is None:
+            logger.warning("Repo map daemon not available, building the map here")
+            self.local = project.ProjectManager(workspace, **options)
+
+    def _fallback(self, error):
+        logger.warning(f"Lost the repo map daemon, building the map here: {error}")
+        self.local = project.ProjectManager(self.workspace, **self.options)
+
+    def _call(self, method, params=None, timeout=REQUEST_TIMEOUT):
+        if self.local is None:
+            try:
+                return self.client.call(method, params, timeout)
+            except OSError as e:
+                self._fallback(e)
+        if method in PROPERTIES:
+            return getattr(self.local, method)
+        return getattr(self.local, method)(**(params or {}))
+
+    async def _acall(self, method, params):
+        if self.local is None:
+            try:
+                return await self.client.acall(method, params)
+            except OSError as e:
+                self._fallback(e)
+        return await getattr(self.local, method)(**params)
+
+    def get_tracked_files(self):
+        return self._call("get_tracked_files")
+
+    def get_map_tokens(
+        self, chat_files_p, conversation_tokens=0, max_context_window=None
+    ):
+        return self._call(
+            "get_map_tokens",
+            {
+                "chat_files_p": [str(f) for f in chat_files_p],
+                "conversation_tokens": conversation_tokens,
+                "max_context_window": max_context_window,
+            },
+        )
+
+    def get_repo_map(self, chat_files_p, map_tokens=None):
+        params = {
+            "chat_files_p": [str(f) for f in chat_files_p],
+            "map_tokens": map_tokens,
+        }
+        # Builds have no time limit
+        return self._call("get_repo_map", params, timeout=None)
+
+    def start_repo_map(self, chat_files_p, map_tokens=None):
+        params = {
+            "chat_files_p": [str(f) for f in chat_files_p],
+            "map_tokens": map_tokens,
+        }
+        self._call("start_repo_map", params)
+
+    async def get_repo_map_async(self, chat_files_p, map_tokens=None, timeout=None):
+        params = {
+            "chat_files_p": [str(f) for f in chat_files_p],
+            "map_tokens": map_tokens,
+            "timeout": timeout,
+        }
+        return await self._acall("get_repo_map_async", params)
+
+    @property
+    def building(self):
+        return self._call("building")
+
+    @property
+    def last_good_map(self):
+        return self._call("last_good_map")
+
+    @property
+    def last_metrics(self):
+        metrics = self._call("last_metrics")
+        if isinstance(metrics, dict):
+            metrics = MapMetrics.from_dict(metrics)
+        return metrics
+
+    def repo_map_status(self):
+        status = self._call("repo_map_status")
+        if self.local is None:
+            status += " (daemon)"
+        return status
+
+    def cancel_repo_map(self):
+        self._call("cancel_repo_map")
+
+    def file_edited(self, path, old_content, new_content, edits):
+        if self.local is None:
+            params = {
+                "path": str(path),
+                "old_content": old_content,
+                "new_content": new_content,
+                "edits": encode_edits(edits),
+            }
+            try:
+                self.client.call("file_edited", params)
+                return
+            except OSError as e:
+                self._fallback(e)
+        self.local.file_edited(path, old_content, new_content, edits)
+
+    def cache_stats(self):
+        return self._call("cache_stats")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workspace")
+    parser.add_argument(
+        "--options", default="{}", help="ProjectManager options, as JSON"
+    )
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument(
+        "--stop", action="store_true", help="stop the daemon of the workspace"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    if args.stop:
+        client = connect(args.workspace, start=False)
+        if client is not None:
+            client.call("shutdown")
+        return
+
+    server = DaemonServer(
+        args.workspace, idle_timeout=args.idle_timeout, **json.loads(args.options)
+    )
+    if not asyncio.run(server.serve()):
+        logger.info(f"A daemon already serves {server.workspace}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Prebuilt tags caches, shareable between checkouts as a single artifact.
+
+`build_index` fills the tags cache of a workspace ahead of its first repo map,
+extracting the tags of its tracked files in parallel. `export_index` writes the
+tags of those files to a compressed artifact keyed by their git blob ids, and
+`import_index` loads the ones matching the files of another checkout into its
+tags cache. An artifact built in CI on main thus spares fresh clones and
+containers the cold scan of their first map build.
+
+The artifact is a gzip-compressed JSON lines file: a header, then one
+`[blob id, language, names, name ids, lines, kinds]` line per distinct file
+content and language, the arrays of the FileTags record base64-encoded.
+
+Like ProjectManager, these expect the working directory to be the workspace,
+as the tags cache is keyed by paths relative to it.
+"""
+
+import base64
+import gzip
+import json
+import sys
+from pathlib import Path
+
+from . import project, repomap
+from .metrics import MapMetrics
+from .tags import FileTags
+
+# Bumped when the layout of the artifact changes
+INDEX_FORMAT = 2
+
+
+def index_header():
+    return {
+        "format": INDEX_FORMAT,
+        # Records are only valid for the tags cache version that made them
+        "tags_cache": Path(repomap.RepoMap.TAGS_CACHE_DIR).name,
+        # The arrays of the records are in native byte order
+        "byteorder": sys.byteorder,
+    }
+
+
+def open_repo_map(workspace, workers=None):
+    """Return the tracked files of `workspace` as (fname, rel_fname), and its
+    RepoMap, versioning clean files by their blob id."""
+    pm = project.ProjectManager(workspace, map_workers=workers)
+    rm = pm.repo_map
+    rm.index_blob_ids = pm.get_index_blob_ids()
+    files = [(fname, rm.get_rel_fname(fname)) for fname in pm.get_tracked_files()]
+    return files, rm
+
+
+def get_record_key(rm, fname, rel_fname):
+    """Return the (blob id, language) of `fname`, which its tags depend on, or
+    None if it has no blob id."""
+    blob_id = rm.get_blob_id(fname, rel_fname)
+    if blob_id is None:
+        return None
+    try:
+        return blob_id, repomap.get_file_lang(fname)
+    except OSError:
+        return None
+
+
+def get_all_tags(rm, files):
+    """Return the FileTags of `files`, extracting the missing ones, and the
+    metrics of doing so."""
+    metrics = rm.metrics = MapMetrics()
+    cache_stats_before = {
+        layer: stats.copy() for layer, stats in rm.cache_stats.items()
+    }
+    with rm.lock:
+        all_tags = rm.get_tags_bulk(files)
+    metrics.counts["files"] = len(files)
+    metrics.finish(cache_stats_before, rm.cache_stats)
+    return all_tags, metrics
+
+
+def build_index(workspace, workers=None):
+    """Fill the tags cache of `workspace` with the tags of its tracked files,
+    extracted in `workers` processes. Returns the MapMetrics of the scan."""
+    files, rm = open_repo_map(workspace, workers)
+    _all_tags, metrics = get_all_tags(rm, files)
+    return metrics
+
+
+def export_index(workspace, path, workers=None):
+    """Write the tags of the tracked files of `workspace` to the artifact
+    `path`, building the missing ones first. Returns the number of distinct
+    file contents and languages written."""
+    files, rm = open_repo_map(workspace, workers)
+    all_tags, _metrics = get_all_tags(rm, files)
+
+    written = set()
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(index_header()) + "\n")
+        for fname, rel_fname in files:
+            key = get_record_key(rm, fname, rel_fname)
+            if key is None or key in written:
+                continue
+            names, name_ids, lines, kinds = all_tags[fname].to_record()
+            line = [*key, list(names)]
+            line += [
+                base64.b64encode(data).decode() for data in (name_ids, lines, kinds)
+            ]
+            f.write(json.dumps(line) + "\n")
+            written.add(key)
+    return len(written)
+
+
+def import_index(workspace, path):
+    """Load the tags of the tracked files of `workspace` whose content is in
+    the artifact `path` into its tags cache.
+
+    Returns the number of files imported. Raises ValueError if the artifact
+    was made for another tags cache version or platform, or is corrupt.
+    """
+    files, rm = open_repo_map(workspace)
+    # (blob id, language) -> [(fname, version)] of the files with that
+    # content, parsed as that language
+    wanted = {}
+    for fname, rel_fname in files:
+        version = rm.get_file_version(fname, rel_fname)
+        key = get_record_key(rm, fname, rel_fname)
+        if version is not None and key is not None:
+            wanted.setdefault(key, []).append((fname, version))
+
+    entries = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "null")
+        if header != index_header():
+            raise ValueError(
+                f"{path} is not an index of this arox version and platform: {header}"
+            )
+        for line in f:
+            blob_id, lang, names, *arrays = json.loads(line)
+            if (blob_id, lang) not in wanted:
+                continue
+            name_ids, lines, kinds = (base64.b64decode(data) for data in arrays)
+            data = (tuple(names), name_ids, lines, kinds)
+            # Checks the record is consistent before storing it
+            try:
+                FileTags.from_record(None, None, data).check()
+            except ValueError as e:
+                raise ValueError(f"{path} has a corrupt record for {blob_id}: {e}")
+            for fname, version in wanted[blob_id, lang]:
+                entries[fname] = {"version": version, "data": data}
+
+    with rm.lock:
+        try:
+            rm.update_tags_cache(entries)
+        except repomap.SQLITE_ERRORS as e:
+            rm.tags_cache_error(e)
+            rm.update_tags_cache(entries)
+    return len(entries)
@@ -0,0 +1,155 @@
+"""Find the tree-sitter language of a source file.
+
+Files are identified by their name, with a table of the file name patterns
+pygments knows, built once per process from its static lexer mapping. Only
+the names claimed by several languages, like `*.h`, need pygments to analyse
+the file content, and files without a known name fall back to their shebang.
+"""
+
+import fnmatch
+import os
+
+# tree-sitter language -> pygments lexer alias, when they differ
+LEXER_ALIASES = {
+    "ocaml_interface": "ocaml",
+}
+
+# File name patterns mapped to another language than the pygments lexer
+# matching them.
+PATTERN_OVERRIDES = {
+    "*.mli": "ocaml_interface",
+}
+
+# Interpreter named in a shebang -> tree-sitter language
+SHEBANG_INTERPRETERS = {
+    "python": "python",
+    "python2": "python",
+    "python3": "python",
+    "ruby": "ruby",
+    "node": "javascript",
+    "lua": "lua",
+    "elixir": "elixir",
+    "racket": "racket",
+    "Rscript": "r",
+}
+
+# Pattern matching several languages, only pygments can tell them apart.
+AMBIGUOUS = object()
+
+
+class LanguageTable:
+    """File name patterns mapped to the language of the tags query to use,
+    None for files with no tags query."""
+
+    def __init__(self, patterns, tags_langs):
+        self.tags_langs = tags_langs
+        # File extensions and names, looked up directly
+        self.suffixes = {}
+        self.names = {}
+        # Patterns that need fnmatch
+        self.globs = []
+        for pattern, lang in patterns.items():
+            if any(char in pattern for char in "*?["):
+                suffix = pattern[1:]
+                if pattern.startswith("*.") and not any(
+                    char in suffix for char in "*?["
+                ):
+                    self.suffixes[suffix] = lang
+                else:
+                    self.globs.append((pattern, lang))
+            else:
+                self.names[pattern] = lang
+
+    @classmethod
+    def from_pygments(cls, tags_langs):
+        """Build the table of the pygments lexers for `tags_langs`."""
+        from pygments.lexers._mapping import LEXERS
+
+        patterns = {}
+        for _module, name, aliases, filenames, _mimetypes in LEXERS.values():
+            lang = lexer_to_lang(name, aliases, tags_langs)
+            for pattern in filenames:
+                pattern_lang = PATTERN_OVERRIDES.get(pattern, lang)
+                if pattern in patterns and patterns[pattern] != pattern_lang:
+                    patterns[pattern] = AMBIGUOUS
+                else:
+                    patterns[pattern] = pattern_lang
+        return cls(patterns, tags_langs)
+
+    def get_lang(self, fname, code):
+        """Return the language of `fname`, None if it has no tags query."""
+        langs = self.match(fname)
+        if not langs:
+            return shebang_lang(code)
+        if len(langs) == 1 and AMBIGUOUS not in langs:
+            return langs.pop()
+        return guess_lang(fname, code, self.tags_langs)
+
+    def get_name_lang(self, fname):
+        """Return the language of `fname` if its name alone tells it, else
+        AMBIGUOUS."""
+        langs = self.match(fname)
+        if len(langs) == 1 and AMBIGUOUS not in langs:
+            return langs.pop()
+        return AMBIGUOUS
+
+    def match(self, fname):
+        """Return the set of languages whose patterns match `fname`."""
+        basename = os.path.basename(fname)
+        langs = set()
+        if basename in self.names:
+            langs.add(self.names[basename])
+
+        # Every extension, so "*.rs.in" and "*.in" both match "lib.rs.in"
+        start = basename.find(".")
+        while start != -1:
+            suffix = basename[start:]
+            if suffix in self.suffixes:
+                langs.add(self.suffixes[suffix])
+            start = basename.find(".", start + 1)
+
+        for pattern, lang in self.globs:
+            if fnmatch.fnmatch(basename, pattern):
+                langs.add(lang)
+        return langs
+
+
+def lexer_to_lang(name, aliases, tags_langs):
+    """Return the language in `tags_langs` of a pygments lexer, or None."""
+    if name.lower() in tags_langs:
+        return name.lower()
+    for alias in aliases:
+        if alias in tags_langs:
+            return alias
+    return None
+
+
+def shebang_lang(code):
+    """Return the language of the interpreter in the shebang of `code`."""
+    if not code.startswith("#!"):
+        return None
+    words = code.split("\n", 1)[0][2:].split()
+    if words and os.path.basename(words[0]) == "env":
+        words = [word for word in words[1:] if not word.startswith("-")]
+    if not words:
+        return None
+    return SHEBANG_INTERPRETERS.get(os.path.basename(words[0]))
+
+
+def guess_lang(fname, code, tags_langs):
+    """Return the language of `fname` as pygments guesses it from `code`."""
+    import pygments.util
+    from pygments.lexers import guess_lexer_for_filename
+
+    try:
+        lexer = guess_lexer_for_filename(fname, code)
+    except pygments.util.ClassNotFound:
+        return None
+    return lexer_to_lang(lexer.name, lexer.aliases, tags_langs)
+
+
+def get_lexer(lang):
+    """Return a pygments lexer for `lang`."""
+    from pygments.lexers import get_lexer_by_name
+
+    return get_lexer_by_name(LEXER_ALIASES.get(lang, lang))
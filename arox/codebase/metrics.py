@@ -0,0 +1,114 @@
+"""Timings and counts of repo map builds.
+
+RepoMap records a `MapMetrics` for each map it is asked for: the time spent in
+each phase of the build, how many files and tags went through them, and the
+hits and misses of its caches meanwhile. Recording them only takes a few clock
+reads per phase, so they are always on, and handed to the listeners added with
+`RepoMap.add_metrics_listener`.
+"""
+
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# The phases of a build, in order:
+# - files: getting the version of each file
+# - cache: reading and writing the tags caches
+# - parse: extracting the tags of the files missing from the caches
+# - graph: updating the tag graph
+# - rank: ranking it
+# - budget: selecting the ranked tags that fit in the map
+# - render: rendering them
+PHASES = ("files", "cache", "parse", "graph", "rank", "budget", "render")
+
+
+class MapMetrics:
+    """The metrics of one repo map."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Seconds from the start to `finish`
+        self.total = None
+        # phase -> seconds spent in it
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        # e.g. "files", "parsed_files", "loaded_tags", "map_tags", "map_tokens"
+        self.counts = Counter()
+        # cache layer -> Counter of "hits", "misses" and "evictions" meanwhile
+        self.cache_stats = {}
+        # Whether the map was returned from the map cache, without a build
+        self.cached = False
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the block to phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def finish(self, cache_stats_before, cache_stats):
+        """Stop the clock, and record how the `cache_stats` of the RepoMap
+        changed since `cache_stats_before`."""
+        self.total = time.perf_counter() - self.start
+        self.cache_stats = {}
+        for layer, stats in cache_stats.items():
+            delta = stats - cache_stats_before.get(layer, Counter())
+            if delta:
+                self.cache_stats[layer] = delta
+
+    def hit_ratios(self):
+        """Return the share of lookups of each cache layer that hit."""
+        ratios = {}
+        for layer, stats in self.cache_stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            if lookups:
+                ratios[layer] = stats["hits"] / lookups
+        return ratios
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "cached": self.cached,
+            "phases": dict(self.phases),
+            "counts": dict(self.counts),
+            "cache_stats": {
+                layer: dict(stats) for layer, stats in self.cache_stats.items()
+            },
+            "hit_ratios": self.hit_ratios(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the metrics `to_dict` returned, e.g. sent by the daemon."""
+        metrics = cls()
+        metrics.total = data["total"]
+        metrics.cached = data["cached"]
+        metrics.phases = dict(data["phases"])
+        metrics.counts = Counter(data["counts"])
+        metrics.cache_stats = {
+            layer: Counter(stats) for layer, stats in data["cache_stats"].items()
+        }
+        return metrics
+
+    def summary(self):
+        """Describe the metrics in one line, for logs."""
+        if self.cached:
+            return f"from the map cache in {self.total:.3f}s"
+        phases = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in self.phases.items() if seconds
+        )
+        counts = ", ".join(
+            f"{num} {name.replace('_', ' ')}"
+            for name, num in self.counts.items()
+            if num
+        )
+        ratios = ", ".join(
+            f"{layer} {ratio:.0%}" for layer, ratio in self.hit_ratios().items()
+        )
+        summary = f"built in {self.total:.3f}s ({phases})"
+        if counts:
+            summary += f", {counts}"
+        if ratios:
+            summary += f", cache hits: {ratios}"
+        return summary
@@ -1,39 +1,336 @@
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import git
+from arox.utils.git import get_index_blob_ids
 
-from . import repomap
+from . import repomap, watcher
 
 logger = logging.getLogger(__name__)
 
+# One RepoMap per workspace, shared by every ProjectManager of the process, so
+# its caches stay warm for the whole session and across agents.
+_repo_maps: dict[Path, repomap.RepoMap] = {}
+_repo_maps_lock = threading.Lock()
+
+# Map builds of get_repo_map_async run here, one at a time, rather than in the
+# default executor of the event loop.
+_map_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arox-repo-map")
+
+
+def get_shared_repo_map(workspace, **repo_map_options) -> repomap.RepoMap:
+    """Return the RepoMap of `workspace`, creating it with `repo_map_options`
+    on first use."""
+    root = Path(workspace).absolute()
+    with _repo_maps_lock:
+        rm = _repo_maps.get(root)
+        if rm is None:
+            rm = repomap.RepoMap(root=str(root), **repo_map_options)
+            _repo_maps[root] = rm
+    return rm
+
+
+# Like the repo maps, one watcher per workspace
+_watchers: dict[Path, watcher.Watcher | None] = {}
+
+
+def get_shared_watcher(workspace, backend="auto") -> watcher.Watcher | None:
+    """Return the watcher of `workspace`, starting it on first use."""
+    root = Path(workspace).absolute()
+    if root not in _watchers:
+        _watchers[root] = watcher.create_watcher(root, backend)
+    return _watchers[root]
+
 
 class ProjectManager:
-    def __init__(self, worksapce):
+    """The files of a workspace and its repo map.
+
+    With a `file_watcher` backend (see `watcher.create_watcher`), the tracked
+    files, their index blob ids and the last repo map are kept until the
+    watcher reports a change they depend on, so that asking for them again
+    without changes doesn't look at the files.
+
+    `get_repo_map_async` builds the map in a thread, so the event loop keeps
+    running meanwhile.
+    """
+
+    def __init__(self, worksapce, file_watcher="off", **repo_map_options):
         self.workspace = worksapce
+        self.repo_map_options = repo_map_options
+
+        self.changes = None
+        self.watcher = get_shared_watcher(worksapce, file_watcher)
+        if self.watcher is not None:
+            self.changes = self.watcher.subscribe()
+        self._tracked_files = None
+        self._tracked_set = frozenset()
+        self._index_blob_ids = None
+        # (chat files, map tokens, repo map) of the last get_repo_map
+        self._last_map = None
+        # Incremented when _last_map is invalidated, so that a build running
+        # meanwhile doesn't store an outdated map.
+        self._generation = 0
+        self._lock = threading.RLock()
+
+        self.last_good_map = None
+        # ((chat files, map tokens), future, cancel token) of the last
+        # start_repo_map
+        self._build = None
+        # Seconds the last build started by start_repo_map took to run
+        self._build_time = None
+        # MapMetrics of the last map the repo map built for this manager
+        self.last_metrics = None
+
+    @property
+    def repo_map(self) -> repomap.RepoMap:
+        return get_shared_repo_map(self.workspace, **self.repo_map_options)
+
+    def update(self):
+        """Forget what depends on the files the watcher saw changing, or on
+        every file without a watcher."""
+        changes = self.changes.take() if self.changes is not None else None
+        rm = _repo_maps.get(Path(self.workspace).absolute())
+        if changes is None:
+            self._generation += 1
+            self._tracked_files = None
+            self._index_blob_ids = None
+            self._last_map = None
+            if rm is not None:
+                if self.changes is not None:
+                    rm.files_changed()
+                else:
+                    # The RepoMap outlives this manager, its cached maps may
+                    # be of files changed since
+                    rm.map_cache.clear()
+            return
+        if not changes:
+            return
 
-    def get_repo_map(self, chat_files_p: list[Path]) -> str:
-        rm = repomap.RepoMap(root=self.workspace)
-        other_files = self.calcute_other_files(chat_files_p)
+        self._generation += 1
+        if watcher.GIT_INDEX in changes:
+            self._tracked_files = None
+            self._index_blob_ids = None
+            self._last_map = None
+        if self._index_blob_ids:
+            for path in changes:
+                self._index_blob_ids.pop(path, None)
+        if rm is not None:
+            rm.files_changed(changes)
+        if self._last_map is not None:
+            chat_files = self._last_map[0]
+            if any(p in self._tracked_set or p in chat_files for p in changes):
+                self._last_map = None
+
+    def get_map_tokens(
+        self, chat_files_p: list[Path], conversation_tokens=0, max_context_window=None
+    ) -> int:
+        """Return the token budget of the repo map, see RepoMap.get_map_tokens."""
+        return self.repo_map.get_map_tokens(
+            chat_files_p, conversation_tokens, max_context_window
+        )
+
+    def get_repo_map(
+        self, chat_files_p: list[Path], map_tokens=None, cancelled=None
+    ) -> str:
+        """Build the repo map, within `map_tokens` if given. The build stops
+        once the threading.Event `cancelled` is set."""
         chat_files = [str(f) for f in chat_files_p]
+        with self._lock:
+            self.update()
+            if self._last_map is not None and self._last_map[:2] == (
+                chat_files,
+                map_tokens,
+            ):
+                return self._last_map[2]
+            generation = self._generation
+            other_files = self.calcute_other_files(chat_files_p)
+            index_blob_ids = self.get_index_blob_ids()
+
         logger.debug(
             f"Files to generate repomap: \n"
             f"chat files: {chat_files}\n"
             f"other files: {other_files}"
         )
-        res = rm.get_repo_map(chat_files, other_files)
-        return res or ""
+        rm = self.repo_map
+        with rm.lock:
+            if self.changes is not None and rm.mtimes is None:
+                # The watcher reports the changes from now on
+                rm.files_changed()
+            # Files clean in the git index are versioned by their blob id, so
+            # the repo map only has to stat the dirty ones.
+            rm.index_blob_ids = index_blob_ids
+            res = rm.get_repo_map(
+                chat_files,
+                other_files,
+                max_map_tokens=map_tokens,
+                cancelled=cancelled,
+            )
+            res = res or ""
+            metrics = rm.last_metrics
+
+        if metrics is not None:
+            self.last_metrics = metrics
+            logger.info(f"Repo map {metrics.summary()}")
+
+        with self._lock:
+            self.last_good_map = res
+            if self.watcher is not None:
+                self.watcher.watch_paths(self._tracked_set.union(chat_files))
+                if generation == self._generation:
+                    self._last_map = (chat_files, map_tokens, res)
+        return res
+
+    def start_repo_map(
+        self, chat_files_p: list[Path], map_tokens=None
+    ) -> asyncio.Future:
+        """Start building the repo map in a thread, and return the future of
+        its result. A build already running for the same arguments is reused.
+
+        Must be called from the event loop.
+        """
+        key = (list(chat_files_p), map_tokens)
+        if self._build is not None:
+            build_key, future, _cancelled = self._build
+            if not future.done() and build_key == key:
+                return future
+
+        loop = asyncio.get_running_loop()
+        # Set by cancel_repo_map, even before the build gets to the repo map
+        cancelled = threading.Event()
+        future = loop.run_in_executor(_map_executor, self._run_build, *key, cancelled)
+        future.add_done_callback(_log_build_error)
+        self._build = (key, future, cancelled)
+        return future
+
+    def _run_build(self, chat_files, map_tokens, cancelled):
+        start = time.perf_counter()
+        res = self.get_repo_map(chat_files, map_tokens, cancelled)
+        self._build_time = time.perf_counter() - start
+        return res
+
+    @property
+    def building(self) -> bool:
+        """Whether a build started by start_repo_map is running."""
+        return self._build is not None and not self._build[1].done()
+
+    async def get_repo_map_async(
+        self, chat_files_p: list[Path], map_tokens=None, timeout=None
+    ) -> str | None:
+        """Build the repo map without blocking the event loop.
+
+        If the build is cancelled or takes more than `timeout` seconds, the
+        last map built is returned instead, None if there is none. A build
+        timing out goes on in the background and warms the caches. Errors of
+        the build are raised.
+        """
+        future = self.start_repo_map(chat_files_p, map_tokens)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except TimeoutError:
+            logger.info(f"Repo map not ready after {timeout}s, using the last one")
+        except repomap.MapBuildCancelled:
+            logger.info("Repo map build cancelled, using the last one")
+        return self.last_good_map
+
+    def repo_map_status(self) -> str:
+        """Describe the last build started by start_repo_map."""
+        if self._build is None:
+            return "not built yet"
+        future = self._build[1]
+        if not future.done():
+            rm = _repo_maps.get(Path(self.workspace).absolute())
+            progress = rm.build_progress if rm is not None else None
+            if progress is None:
+                return "building"
+            phase, done, total = progress
+            return f"building, {phase} {done}/{total}"
+        if future.cancelled() or isinstance(
+            future.exception(), repomap.MapBuildCancelled
+        ):
+            return "cancelled"
+        if future.exception() is not None:
+            return f"failed: {future.exception()}"
+        return f"ready, built in {self._build_time:.1f}s"
+
+    def cancel_repo_map(self):
+        """Stop the build started by start_repo_map, if it is running."""
+        if self.building:
+            self._build[2].set()
+
+    def file_edited(self, path, old_content, new_content, edits):
+        """FileEdit listener, updates the tags of edited files if the repo map
+        is in use."""
+        rm = _repo_maps.get(Path(self.workspace).absolute())
+        if rm is None:
+            return
+
+        # Name the file like get_repo_map does, relative to the workspace
+        p = Path(path)
+        workspace = Path(self.workspace).absolute()
+        if p.is_absolute() and p.is_relative_to(workspace):
+            p = p.relative_to(workspace)
+        # Don't wait for a build running in a thread, the next one will see
+        # the change anyway.
+        if rm.lock.acquire(blocking=False):
+            try:
+                rm.file_edited(str(p), old_content, new_content, edits)
+            finally:
+                rm.lock.release()
+        # Don't wait for the watcher to see the change
+        with self._lock:
+            if self._index_blob_ids:
+                self._index_blob_ids.pop(p.as_posix(), None)
+            self._generation += 1
+            self._last_map = None
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        """Hits and misses of each RepoMap cache layer, if it was used."""
+        rm = _repo_maps.get(Path(self.workspace).absolute())
+        if rm is None:
+            return {}
+        return {layer: dict(stats) for layer, stats in rm.cache_stats.items() if stats}
 
     def calcute_other_files(self, chat_files):
         tracked_files = set(self.get_tracked_files())
         other_files = tracked_files - set(chat_files)
         return list(other_files)
 
+    def get_index_blob_ids(self):
+        with self._lock:
+            if self._index_blob_ids is None:
+                import git
+
+                try:
+                    repo = git.Repo(self.workspace)
+                    self._index_blob_ids = get_index_blob_ids(repo)
+                except (git.InvalidGitRepositoryError, git.GitCommandError) as e:
+                    logger.warning(f"Failed to read git index: {e}")
+                    return {}
+            return self._index_blob_ids
+
     def get_tracked_files(self):
-        try:
-            repo = git.Repo(self.workspace)
-            tracked_files = repo.git.ls_files().splitlines()
-            return sorted(tracked_files)
-        except (git.InvalidGitRepositoryError, git.GitCommandError) as e:
-            logger.warning(f"Failed to get git tracked files: {e}")
-            return []
+        with self._lock:
+            self.update()
+            if self._tracked_files is None:
+                import git
+
+                try:
+                    repo = git.Repo(self.workspace)
+                    tracked_files = repo.git.ls_files().splitlines()
+                except (git.InvalidGitRepositoryError, git.GitCommandError) as e:
+                    logger.warning(f"Failed to get git tracked files: {e}")
+                    return []
+                self._tracked_files = sorted(tracked_files)
+                self._tracked_set = frozenset(tracked_files)
+            return self._tracked_files
+
+
+def _log_build_error(future):
+    if future.cancelled():
+        return
+    e = future.exception()
+    if e is not None and not isinstance(e, repomap.MapBuildCancelled):
+        logger.error("Failed to build the repo map", exc_info=e)
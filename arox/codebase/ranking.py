@@ -0,0 +1,492 @@
+"""PageRank backends for RepoMap.
+
+The repo map ranks files with PageRank over a graph where an edge goes from a
+file referencing an identifier to each file defining it. The rank of each
+file is then split across its out edges to rank individual definitions.
+
+Two interchangeable backends are provided: `rank_sparse`, a vectorized power
+iteration over a CSR matrix, and `rank_networkx`, which builds a
+`networkx.MultiDiGraph` and uses `networkx.pagerank`. `RankedTags` turns their
+ranks into the ordered tags of the repo map.
+"""
+
+import heapq
+import math
+from collections import Counter, defaultdict
+
+# Entries selected by the first pass of iter_largest, doubled on each pass.
+RANKED_CHUNK = 256
+
+
+class RankGraph:
+    """Weighted edges between files, each labelled with an identifier.
+
+    Nodes and identifiers are interned to integer ids, so the edges can be
+    turned into arrays without walking Python objects again. Removed edges are
+    only marked dead, so the graph can be updated in place.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = {}
+        self.idents = []
+        self.ident_ids = {}
+        self.src = []
+        self.dst = []
+        self.weight = []
+        self.ident = []
+        self.alive = []
+        self.num_dead = 0
+        # ident -> multiplier applied to the weight of its edges when ranking
+        self.ident_scale = {}
+
+    def __len__(self):
+        return len(self.src) - self.num_dead
+
+    def _node_id(self, node):
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = self.node_ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return node_id
+
+    def _ident_id(self, ident):
+        ident_id = self.ident_ids.get(ident)
+        if ident_id is None:
+            ident_id = self.ident_ids[ident] = len(self.idents)
+            self.idents.append(ident)
+        return ident_id
+
+    def add_edge(self, src, dst, weight, ident):
+        """Add an edge and return its index."""
+        self.src.append(self._node_id(src))
+        self.dst.append(self._node_id(dst))
+        self.weight.append(weight)
+        self.ident.append(self._ident_id(ident))
+        self.alive.append(True)
+        return len(self.src) - 1
+
+    def remove_edge(self, index):
+        self.alive[index] = False
+        self.num_dead += 1
+
+    def edges(self):
+        """Yield (src, dst, weight, ident) for every live edge."""
+        nodes = self.nodes
+        idents = self.idents
+        scale = self.ident_scale
+        for src, dst, weight, ident, alive in zip(
+            self.src, self.dst, self.weight, self.ident, self.alive
+        ):
+            if alive:
+                ident = idents[ident]
+                yield nodes[src], nodes[dst], weight * scale.get(ident, 1), ident
+
+    def arrays(self):
+        """Return (nodes, src, dst, weight, ident) for the live edges.
+
+        `nodes` only holds the nodes that have a live edge, `src` and `dst`
+        index into it and `ident` indexes into `self.idents`.
+        """
+        import numpy as np
+
+        alive = np.asarray(self.alive, dtype=bool)
+        src = np.asarray(self.src, dtype=np.intp)[alive]
+        dst = np.asarray(self.dst, dtype=np.intp)[alive]
+        weight = np.asarray(self.weight, dtype=float)[alive]
+        ident = np.asarray(self.ident, dtype=np.intp)[alive]
+
+        if self.ident_scale:
+            scale = np.ones(len(self.idents))
+            for name, mul in self.ident_scale.items():
+                if name in self.ident_ids:
+                    scale[self.ident_ids[name]] = mul
+            weight = weight * scale[ident]
+
+        used, inverse = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        src, dst = inverse[: len(src)], inverse[len(src) :]
+        nodes = [self.nodes[node_id] for node_id in used.tolist()]
+        return nodes, src, dst, weight, ident
+
+
+class TagGraph:
+    """The defines and references of a set of files, and their RankGraph.
+
+    Files are added, replaced and removed one at a time, and only the edges of
+    the identifiers they define or reference are rebuilt, so keeping the graph
+    up to date costs time proportional to what changed.
+    """
+
+    def __init__(self):
+        # rel_fname -> version of the file the tags were extracted from
+        self.file_versions = {}
+        self.file_defines = {}
+        self.file_references = {}
+        self.defines = defaultdict(set)
+        self.references = defaultdict(Counter)
+        self.definitions = defaultdict(set)
+        self.graph = RankGraph()
+        self._ident_edges = {}
+        self._dirty_idents = set()
+
+    def update_file(self, rel_fname, version, tags):
+        """Set the FileTags of `rel_fname`, extracted from `version` of it."""
+        self.remove_file(rel_fname)
+
+        file_defines = set()
+        for tag in tags.definitions():
+            file_defines.add(tag.name)
+            self.definitions[(rel_fname, tag.name)].add(tag)
+        file_references = tags.reference_counts()
+
+        for ident in file_defines:
+            self.defines[ident].add(rel_fname)
+        for ident, num_refs in file_references.items():
+            self.references[ident][rel_fname] = num_refs
+
+        self.file_versions[rel_fname] = version
+        self.file_defines[rel_fname] = file_defines
+        self.file_references[rel_fname] = file_references
+        self._dirty_idents.update(file_defines)
+        self._dirty_idents.update(file_references)
+
+    def remove_file(self, rel_fname):
+        if rel_fname not in self.file_versions:
+            return
+
+        del self.file_versions[rel_fname]
+        file_defines = self.file_defines.pop(rel_fname)
+        file_references = self.file_references.pop(rel_fname)
+
+        for ident in file_defines:
+            self.defines[ident].discard(rel_fname)
+            if not self.defines[ident]:
+                del self.defines[ident]
+            del self.definitions[(rel_fname, ident)]
+        for ident in file_references:
+            del self.references[ident][rel_fname]
+            if not self.references[ident]:
+                del self.references[ident]
+
+        self._dirty_idents.update(file_defines)
+        self._dirty_idents.update(file_references)
+
+    def rank_graph(self, mentioned_idents=()):
+        """Return the RankGraph of the current files, weighted for the
+        mentioned identifiers."""
+        if not self.references:
+            return self._defines_only_graph(mentioned_idents)
+
+        graph = self.graph
+        if graph.num_dead > len(graph):
+            # Start from a fresh graph once dead edges dominate
+            self.graph = graph = RankGraph()
+            self._ident_edges.clear()
+            self._dirty_idents.update(self.defines)
+
+        for ident in self._dirty_idents:
+            for index in self._ident_edges.pop(ident, ()):
+                graph.remove_edge(index)
+            if ident in self.defines:
+                self._ident_edges[ident] = [
+                    graph.add_edge(src, dst, weight, ident)
+                    for src, dst, weight in self._ident_edges_for(ident)
+                ]
+        self._dirty_idents.clear()
+
+        graph.ident_scale = {
+            ident: 10 / ident_mul(ident)
+            for ident in mentioned_idents
+            if ident in self.defines and ident in self.references
+        }
+        return graph
+
+    def _ident_edges_for(self, ident):
+        definers = self.defines[ident]
+
+        # Add a small self-edge for every definition that has no references
+        # Helps with tree-sitter 0.23.2 with ruby, where "def greet(name)"
+        # isn't counted as a def AND a ref. tree-sitter 0.24.0 does.
+        if ident not in self.references:
+            for definer in definers:
+                yield definer, definer, 0.1
+            return
+
+        mul = ident_mul(ident)
+        for referencer, num_refs in self.references[ident].items():
+            for definer in definers:
+                # scale down so high freq (low value) mentions don't dominate
+                num_refs = math.sqrt(num_refs)
+
+                yield referencer, definer, mul * num_refs
+
+    def _defines_only_graph(self, mentioned_idents):
+        # Without any references, every definer references its own
+        # definitions and those of the same ident in other files.
+        graph = RankGraph()
+        for ident, definers in self.defines.items():
+            mul = 10 if ident in mentioned_idents else ident_mul(ident)
+            for referencer in definers:
+                for definer in definers:
+                    graph.add_edge(referencer, definer, mul, ident)
+        return graph
+
+
+def ident_mul(ident):
+    """Weight multiplier for references to `ident`."""
+    if ident.startswith("_"):
+        return 0.1
+    return 1
+
+
+def rank_sparse(
+    graph, personalization=None, nstart=None, alpha=0.85, max_iter=100, tol=1.0e-6
+):
+    """Rank `graph` with a power iteration over its CSR adjacency matrix.
+
+    `personalization` maps nodes to weights, it is also used for dangling
+    nodes, like RepoMap does with networkx. Raises ZeroDivisionError if it
+    gives zero weight to every node of the graph, as networkx does. `nstart`
+    maps nodes to starting ranks, typically the result of a previous run on a
+    similar graph.
+
+    Returns (ranked, ranked_definitions): the rank of each node, and the rank
+    of each (node, ident) definition.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    nodes, src, dst, weight, ident = graph.arrays()
+    num_nodes = len(nodes)
+    if num_nodes == 0:
+        return {}, {}
+
+    # Parallel edges are summed when converting to CSR, like networkx does for
+    # a MultiDiGraph.
+    adjacency = sparse.csr_array(
+        (weight, (src, dst)), shape=(num_nodes, num_nodes), dtype=float
+    )
+    out_weight = np.bincount(src, weights=weight, minlength=num_nodes)
+    is_dangling = out_weight == 0
+    inv_out_weight = np.zeros(num_nodes)
+    inv_out_weight[~is_dangling] = 1.0 / out_weight[~is_dangling]
+    transition = sparse.diags_array(inv_out_weight) @ adjacency
+
+    if personalization:
+        p = np.array([personalization.get(n, 0) for n in nodes], dtype=float)
+        if p.sum() == 0:
+            raise ZeroDivisionError("personalization has no weight on the graph")
+        p /= p.sum()
+    else:
+        p = np.repeat(1.0 / num_nodes, num_nodes)
+
+    x = None
+    if nstart:
+        x = np.array([nstart.get(n, 0) for n in nodes], dtype=float)
+        x = x / x.sum() if x.sum() > 0 else None
+    if x is None:
+        x = np.repeat(1.0 / num_nodes, num_nodes)
+
+    for _ in range(max_iter):
+        last_x = x
+        x = alpha * (x @ transition + x[is_dangling].sum() * p) + (1 - alpha) * p
+        if np.abs(x - last_x).sum() < num_nodes * tol:
+            break
+
+    ranked = dict(zip(nodes, x.tolist()))
+
+    # Distribute the rank from each source node across all of its out edges,
+    # proportionally to their weight.
+    num_idents = len(graph.idents)
+    edge_rank = x[src] * weight * inv_out_weight[src]
+    keys, inverse = np.unique(dst * num_idents + ident, return_inverse=True)
+    definition_ranks = np.bincount(inverse, weights=edge_rank)
+
+    ranked_definitions = {
+        (nodes[key // num_idents], graph.idents[key % num_idents]): rank
+        for key, rank in zip(keys.tolist(), definition_ranks.tolist())
+    }
+
+    return ranked, ranked_definitions
+
+
+def rank_networkx(graph, personalization=None, nstart=None):
+    """Rank `graph` with networkx. Same interface as `rank_sparse`."""
+    import networkx as nx
+
+    G = nx.MultiDiGraph()
+    for src, dst, weight, ident in graph.edges():
+        G.add_edge(src, dst, weight=weight, ident=ident)
+
+    if personalization:
+        pers_args = dict(personalization=personalization, dangling=personalization)
+    else:
+        pers_args = dict()
+
+    if nstart:
+        nstart = {node: nstart[node] for node in G if node in nstart}
+        if sum(nstart.values()) > 0:
+            pers_args["nstart"] = nstart
+
+    ranked = nx.pagerank(G, weight="weight", **pers_args)
+
+    # distribute the rank from each source node, across all of its out edges
+    ranked_definitions = defaultdict(float)
+    for src in G.nodes:
+        src_rank = ranked[src]
+        total_weight = sum(
+            data["weight"] for _src, _dst, data in G.out_edges(src, data=True)
+        )
+        for _src, dst, data in G.out_edges(src, data=True):
+            data["rank"] = src_rank * data["weight"] / total_weight
+            ident = data["ident"]
+            ranked_definitions[(dst, ident)] += data["rank"]
+
+    return ranked, ranked_definitions
+
+
+RANK_BACKENDS = {
+    "sparse": rank_sparse,
+    "networkx": rank_networkx,
+}
+
+
+def get_rank_backend(name="auto"):
+    """Return the ranking function for `name`.
+
+    "auto" picks the sparse backend, falling back to networkx if scipy is not
+    available.
+    """
+    if name == "auto":
+        try:
+            import scipy.sparse  # noqa: F401
+        except ImportError:
+            return rank_networkx
+        return rank_sparse
+    return RANK_BACKENDS[name]
+
+
+def iter_largest(items, chunk=RANKED_CHUNK):
+    """Yield `items` from the largest, like iterating over them sorted in
+    reverse, but only selecting as many as are consumed.
+
+    Items are selected with heapq.nlargest in chunks of growing size, each
+    pass only looking at the items left from the previous one.
+    """
+    remaining = items
+    while remaining:
+        top = heapq.nlargest(chunk, remaining)
+        yield from top
+        if len(top) < chunk:
+            return
+        smallest = top[-1]
+        # Items equal to the smallest selected one may not all have been
+        # selected
+        ties = top.count(smallest)
+        next_remaining = []
+        for item in remaining:
+            if item < smallest:
+                next_remaining.append(item)
+            elif not item > smallest:
+                if ties:
+                    ties -= 1
+                else:
+                    next_remaining.append(item)
+        remaining = next_remaining
+        chunk *= 2
+
+
+class RankedTags:
+    """The tags of the repo map, highest ranked first.
+
+    First the definitions of each ranked (file, ident), then the files with no
+    ranked definition by rank, then the other files, as 1-tuples. The ranking
+    is materialized as far as the tags are indexed or iterated, so taking the
+    prefix that fits in the map doesn't sort every definition of the repo.
+    """
+
+    def __init__(
+        self, ranked, ranked_definitions, definitions, chat_rel_fnames, rel_fnames
+    ):
+        self.definitions = definitions
+        ranked_defs = [
+            (rank, key)
+            for key, rank in ranked_definitions.items()
+            if key[0] not in chat_rel_fnames and definitions.get(key)
+        ]
+        included = set(key[0] for _rank, key in ranked_defs)
+        ranked_files = [
+            (rank, node) for node, rank in ranked.items() if node not in included
+        ]
+        other_files = set(rel_fnames).difference(ranked)
+
+        self._len = (
+            sum(len(definitions[key]) for _rank, key in ranked_defs)
+            + len(ranked_files)
+            + len(other_files)
+        )
+        self._ranked_defs = ranked_defs
+        self._tags = []
+        self._pending = self._iter_tags(ranked_defs, ranked_files, other_files)
+        # rel_fname -> its tags in rank order, built on first use
+        self._file_tags = None
+
+    def _iter_tags(self, ranked_defs, ranked_files, other_files):
+        for _rank, key in iter_largest(ranked_defs):
+            yield from self.definitions[key]
+        for _rank, node in iter_largest(ranked_files):
+            yield (node,)
+        for fname in other_files:
+            yield (fname,)
+
+    def _materialize(self, stop=None):
+        tags = self._tags
+        if stop is None:
+            tags.extend(self._pending)
+            return
+        while len(tags) < stop:
+            tag = next(self._pending, None)
+            if tag is None:
+                break
+            tags.append(tag)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            stop = index.stop
+            if stop is None or stop < 0 or (index.start or 0) < 0:
+                stop = None
+            self._materialize(stop)
+        elif index >= 0:
+            self._materialize(index + 1)
+        else:
+            self._materialize()
+        return self._tags[index]
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index == len(self._tags):
+                self._materialize(index + 1)
+                if index == len(self._tags):
+                    return
+            yield self._tags[index]
+            index += 1
+
+    def file_tags(self, rel_fname):
+        """Return the tags of `rel_fname`, in the order they are ranked."""
+        if self._file_tags is None:
+            by_file = defaultdict(list)
+            for rank, key in self._ranked_defs:
+                by_file[key[0]].append((rank, key))
+            self._file_tags = by_file
+        ranked_defs = self._file_tags.get(rel_fname)
+        if not ranked_defs:
+            return [(rel_fname,)]
+        return [
+            tag
+            for _rank, key in sorted(ranked_defs, reverse=True)
+            for tag in self.definitions[key]
+        ]
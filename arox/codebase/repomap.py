@@ -1,40 +1,86 @@
 # The design and code are from: https://github.com/Aider-AI/aider/blob/main/aider/repomap.py
-import math
+import contextlib
+import logging
 import os
 import shutil
 import sqlite3
+import stat
 import sys
+import threading
 import time
 import warnings
 from collections import Counter, defaultdict, namedtuple
 from pathlib import Path
 
-import pygments
-from diskcache import Cache
-from grep_ast import TreeContext
-from pygments.lexers import guess_lexer_for_filename
-from pygments.token import Token
-from tqdm import tqdm
-from tree_sitter_language_pack import get_language, get_parser
+from arox.codebase.languages import AMBIGUOUS, LanguageTable, get_lexer
+from arox.codebase.metrics import MapMetrics
+from arox.codebase.ranking import RankedTags, TagGraph, get_rank_backend
+from arox.codebase.tags import FileTags, Tag
+from arox.utils.cache import LRUCache
+from arox.utils.git import git_blob_id
+from arox.utils.io import content_store, read_text
+from arox.utils.tokens import get_token_counter
 
-from arox.utils.io import read_text
+logger = logging.getLogger(__name__)
 
 # tree_sitter is throwing a FutureWarning
 warnings.simplefilter("ignore", category=FutureWarning)
 
-Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
-
 SQLITE_ERRORS = (sqlite3.OperationalError, sqlite3.DatabaseError, OSError)
 
+# Default size bound of the user-level tags cache, in bytes.
+GLOBAL_TAGS_CACHE_SIZE = 2**30
+
+# Keys per query when reading the tags cache in bulk, well below SQLite's
+# limit on query parameters.
+BULK_READ_SIZE = 500
+
+# Default memory budgets of the rendering caches, in bytes.
+TREE_CONTEXT_CACHE_SIZE = 256 * 2**20
+TREE_CACHE_SIZE = 32 * 2**20
+
+# Rough memory footprint of a TreeContext per character of source, measured on
+# Python files.
+TREE_CONTEXT_BYTES_PER_CHAR = 150
+
+# Files whose parse tree is kept after an edit, for the next one to reparse
+# incrementally.
+PARSE_TREE_CACHE_FILES = 64
+
+# Renders of the repo map allowed to correct the estimated token budget.
+MAX_BUDGET_PASSES = 4
+
+# Without an explicit map_tokens, the map gets this share of the context
+# window, within MIN_MAP_TOKENS and MAX_MAP_TOKENS.
+MAP_TOKENS_SHARE = 1 / 8
+MIN_MAP_TOKENS = 1024
+MAX_MAP_TOKENS = 4096
+
+# Tokens of the context window kept for the reply and the rest of the prompt.
+CONTEXT_WINDOW_PADDING = 4096
+
+# Budgets are rounded down to a multiple of this, so that a conversation
+# growing a little doesn't change the budget and invalidate the map.
+MAP_TOKENS_STEP = 256
+
+# Below this many cache misses, the cost of starting worker processes outweighs
+# the parallel speedup.
+PARALLEL_SCAN_THRESHOLD = 100
+
+
+class MapBuildCancelled(Exception):
+    """Raised by a map build stopped with RepoMap.cancel."""
+
 
 class RepoMap:
-    TAGS_CACHE_DIR = ".arox/.tags.cache"
+    TAGS_CACHE_DIR = ".arox/.tags.cache.v2"
+    GLOBAL_TAGS_CACHE_DIR = Path.home() / ".arox" / "tags.cache.v2"
 
     warned_files = set()
 
     def __init__(
         self,
-        map_tokens=1024,
+        map_tokens=None,
         root=None,
         main_model=None,
         repo_content_prefix=None,
@@ -42,17 +88,51 @@ class RepoMap:
         max_context_window=None,
         map_mul_no_files=8,
         refresh="auto",
+        map_workers=None,
+        rank_backend="auto",
+        global_tags_cache=False,
+        global_tags_cache_size=GLOBAL_TAGS_CACHE_SIZE,
+        tree_context_cache_size=None,
+        tree_cache_size=None,
     ):
         self.verbose = verbose
         self.refresh = refresh
+        self.rank_backend = rank_backend
+
+        if map_workers is None:
+            map_workers = os.cpu_count() or 1
+        self.map_workers = map_workers
 
         if not root:
             root = os.getcwd()
         self.root = root
 
         self.load_tags_cache()
+        self.GLOBAL_TAGS_CACHE = None
+        if global_tags_cache:
+            self.load_global_tags_cache(global_tags_cache_size)
         self.cache_threshold = 0.95
 
+        # rel_fname -> git blob id, for files whose content matches the git
+        # index. Used as the version of those files instead of their mtime, so
+        # they are never stat-ed or hashed.
+        self.index_blob_ids = {}
+        # rel_fname -> mtime of the other files. Only kept once files_changed
+        # is called, by a user watching the files for changes.
+        self.mtimes = None
+        # Incremented by files_changed, a build only stores what it computed
+        # if no file changed meanwhile.
+        self.files_generation = 0
+        self._mtimes_lock = threading.Lock()
+
+        # Held while building a map or updating tags, maps may be built in a
+        # thread. Builds stop at their next checkpoint once `cancelled`, the
+        # cancel token of the running build, is set.
+        self.lock = threading.RLock()
+        self.cancelled = threading.Event()
+        # (phase, done, total) of the running build, None between builds
+        self.build_progress = None
+
         self.max_map_tokens = map_tokens
         self.map_mul_no_files = map_mul_no_files
         self.max_context_window = max_context_window
@@ -60,20 +140,88 @@ class RepoMap:
         self.repo_content_prefix = repo_content_prefix
 
         self.main_model = main_model
+        self.token_counter = get_token_counter(main_model)
+
+        # cache layer -> Counter of "hits", "misses" and "evictions"
+        self.cache_stats = defaultdict(Counter)
 
-        self.tree_cache = {}
-        self.tree_context_cache = {}
+        # Both are kept across map builds, their keys include the file version
+        self.tree_cache = LRUCache(
+            tree_cache_size or TREE_CACHE_SIZE, stats=self.cache_stats["tree"]
+        )
+        self.tree_context_cache = LRUCache(
+            tree_context_cache_size or TREE_CONTEXT_CACHE_SIZE,
+            sizeof=tree_context_size,
+            stats=self.cache_stats["tree_context"],
+        )
+        # fname -> ParsedFile of the files edited through file_edited
+        self.parsed_files = LRUCache(PARSE_TREE_CACHE_FILES, sizeof=lambda _: 1)
         self.map_cache = {}
         self.map_processing_time = 0
         self.last_map = None
 
+        # The metrics of the map being built, and of the last get_repo_map,
+        # None if it built nothing
+        self.metrics = MapMetrics()
+        self.last_metrics = None
+        self.metrics_listeners = []
+
+        self.tag_graph = TagGraph()
+        self.last_ranked = None
+
         if self.verbose:
             print(f"RepoMap initialized with map_mul_no_files: {self.map_mul_no_files}")
 
-    def token_count(self, text):
-        len_text = len(text)
-        est_tokens = len_text // 4
-        return est_tokens
+    def token_count(self, text, kind=None):
+        return self.token_counter.count(text, kind)
+
+    def add_metrics_listener(self, listener):
+        """Call `listener` with the MapMetrics of every map asked for.
+
+        Listeners are called from the thread building the map.
+        """
+        self.metrics_listeners.append(listener)
+
+    def report_metrics(self, metrics, cache_stats_before):
+        metrics.finish(cache_stats_before, self.cache_stats)
+        self.last_metrics = metrics
+        if self.verbose:
+            print(f"Repo-map {metrics.summary()}")
+        for listener in self.metrics_listeners:
+            try:
+                listener(metrics)
+            except Exception:
+                logger.exception("Repo map metrics listener failed")
+
+    def get_map_tokens(
+        self, chat_files, conversation_tokens=0, max_context_window=None
+    ):
+        """Return the token budget of a map.
+
+        That is `max_map_tokens`, derived from the context window if unset.
+        When the context window is known, it is multiplied by
+        `map_mul_no_files` if no file is in the chat, and bounded by what the
+        window has left once `conversation_tokens` are used.
+        """
+        max_context_window = max_context_window or self.max_context_window
+        map_tokens = self.max_map_tokens
+        if map_tokens is None:
+            if not max_context_window:
+                map_tokens = MIN_MAP_TOKENS
+            else:
+                map_tokens = int(max_context_window * MAP_TOKENS_SHARE)
+                map_tokens = min(max(map_tokens, MIN_MAP_TOKENS), MAX_MAP_TOKENS)
+        if map_tokens <= 0:
+            return 0
+
+        if max_context_window:
+            if not chat_files:
+                # With no files in the chat, give a bigger view of the repo
+                map_tokens = int(map_tokens * self.map_mul_no_files)
+            available = max_context_window - conversation_tokens
+            map_tokens = min(map_tokens, available - CONTEXT_WINDOW_PADDING)
+            map_tokens = map_tokens // MAP_TOKENS_STEP * MAP_TOKENS_STEP
+        return max(0, map_tokens)
 
     def get_repo_map(
         self,
@@ -82,8 +230,18 @@ class RepoMap:
         mentioned_fnames=None,
         mentioned_idents=None,
         force_refresh=False,
+        max_map_tokens=None,
+        cancelled=None,
     ):
-        if self.max_map_tokens <= 0:
+        """Build the map of `other_files` for `chat_files`.
+
+        `cancelled` is a threading.Event stopping the build once set, so that
+        the caller can cancel it before it even starts. `cancel` sets it too.
+        """
+        self.last_metrics = None
+        if max_map_tokens is None:
+            max_map_tokens = self.get_map_tokens(chat_files)
+        if max_map_tokens <= 0:
             return
         if not other_files:
             return
@@ -92,8 +250,7 @@ class RepoMap:
         if not mentioned_idents:
             mentioned_idents = set()
 
-        max_map_tokens = self.max_map_tokens
-
+        self.cancelled = threading.Event() if cancelled is None else cancelled
         try:
             files_listing = self.get_ranked_tags_map(
                 chat_files,
@@ -107,6 +264,9 @@ class RepoMap:
             print("Disabling repo map, git repo too large?")
             self.max_map_tokens = 0
             return
+        finally:
+            # Cancelling between builds has no effect
+            self.cancelled = threading.Event()
 
         if not files_listing:
             return
@@ -148,6 +308,8 @@ class RepoMap:
 
         path = Path(self.root) / self.TAGS_CACHE_DIR
 
+        from diskcache import Cache
+
         # Try to recreate the cache
         try:
             # Delete existing cache dir
@@ -179,6 +341,8 @@ class RepoMap:
         self.TAGS_CACHE = dict()
 
     def load_tags_cache(self):
+        from diskcache import Cache
+
         path = Path(self.root) / self.TAGS_CACHE_DIR
         try:
             self.TAGS_CACHE = Cache(path)
@@ -188,16 +352,132 @@ class RepoMap:
     def save_tags_cache(self):
         pass
 
+    def load_global_tags_cache(self, size_limit):
+        """Open the user-level tags cache, shared by every checkout.
+
+        It is keyed by the git blob id of the file content, so identical files
+        are only parsed once across worktrees, clones and branches.
+        """
+        from diskcache import Cache
+
+        try:
+            self.GLOBAL_TAGS_CACHE = Cache(
+                self.GLOBAL_TAGS_CACHE_DIR,
+                size_limit=size_limit,
+                eviction_policy="least-recently-used",
+            )
+        except SQLITE_ERRORS as e:
+            self.global_tags_cache_error(e)
+
+    def global_tags_cache_error(self, original_error):
+        print(
+            "WARNING: "
+            f"Unable to use global tags cache at {self.GLOBAL_TAGS_CACHE_DIR}, "
+            "disabling it"
+        )
+        if self.verbose:
+            print(f"WARNING: Global tags cache error: {str(original_error)}")
+        self.GLOBAL_TAGS_CACHE = None
+
+    def get_blob_id(self, fname, rel_fname):
+        blob_id = self.index_blob_ids.get(rel_fname)
+        if blob_id:
+            return blob_id
+        try:
+            return git_blob_id(Path(fname).read_bytes())
+        except OSError:
+            return None
+
     def get_mtime(self, fname):
         try:
             return os.path.getmtime(fname)
         except FileNotFoundError:
             print(f"WARNING: File not found error: {fname}")
 
+    def get_file_version(self, fname, rel_fname):
+        """Return what identifies the current content of `fname`.
+
+        That is its blob id if the git index reports it as clean, else its
+        mtime. None if it is not a regular file.
+        """
+        blob_id = self.index_blob_ids.get(rel_fname)
+        if blob_id:
+            return blob_id
+        mtimes = self.mtimes
+        if mtimes is not None:
+            mtime = mtimes.get(rel_fname)
+            if mtime is not None:
+                return mtime
+        generation = self.files_generation
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        if mtimes is not None:
+            with self._mtimes_lock:
+                if generation == self.files_generation:
+                    mtimes[rel_fname] = st.st_mtime
+        return st.st_mtime
+
+    def files_changed(self, rel_fnames=None):
+        """Forget the versions of `rel_fnames`, or of every file if None.
+
+        Once called, the mtimes of files are remembered instead of checked on
+        every build, so the caller must report each file that changes.
+        """
+        with self._mtimes_lock:
+            self.files_generation += 1
+            if rel_fnames is None or self.mtimes is None:
+                self.mtimes = {}
+            else:
+                for rel_fname in rel_fnames:
+                    self.mtimes.pop(rel_fname, None)
+        self.map_cache.clear()
+
+    def cancel(self):
+        """Stop the running map build, if any. Tags extracted so far are kept
+        in the cache."""
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise MapBuildCancelled()
+
+    def content_blob_ids(self, files):
+        """Return the blob id of each (fname, rel_fname, version) in `files`
+        versioned by mtime, in a git checkout.
+
+        They are stored along the tags of those files, which then still match
+        once the file is committed or staged unchanged, and versioned by its
+        blob id instead. Taken before parsing, so a blob id is never stored
+        with the tags of an older content.
+        """
+        if not self.index_blob_ids:
+            return {}
+        blob_ids = {}
+        for fname, rel_fname, version in files:
+            if not isinstance(version, str):
+                blob_id = self.get_blob_id(fname, rel_fname)
+                if blob_id:
+                    blob_ids[fname] = blob_id
+        return blob_ids
+
+    @staticmethod
+    def entry_matches(entry, version):
+        """Whether the tags cache `entry` holds the tags of `version`."""
+        if entry is None:
+            return False
+        if entry.get("version") == version:
+            return True
+        # A blob id, of the content the entry was versioned by mtime for
+        return isinstance(version, str) and entry.get("blob_id") == version
+
     def get_tags(self, fname, rel_fname):
-        # Check if the file is in the cache and if the modification time has not changed
-        file_mtime = self.get_mtime(fname)
-        if file_mtime is None:
+        # Check if the file is in the cache and if its version has not changed
+        file_version = self.get_file_version(fname, rel_fname)
+        if file_version is None:
             return []
 
         cache_key = fname
@@ -207,99 +487,263 @@ class RepoMap:
             self.tags_cache_error(e)
             val = self.TAGS_CACHE.get(cache_key)
 
-        if val is not None and val.get("mtime") == file_mtime:
+        if self.entry_matches(val, file_version):
             try:
-                return self.TAGS_CACHE[cache_key]["data"]
+                data = self.TAGS_CACHE[cache_key]["data"]
             except SQLITE_ERRORS as e:
                 self.tags_cache_error(e)
-                return self.TAGS_CACHE[cache_key]["data"]
+                data = self.TAGS_CACHE[cache_key]["data"]
+            return list(FileTags.from_record(fname, rel_fname, data))
 
         # miss!
-        data = list(self.get_tags_raw(fname, rel_fname))
+        content_ids = self.content_blob_ids([(fname, rel_fname, file_version)])
+        tags = list(self.get_tags_raw(fname, rel_fname))
+        data = FileTags.from_tags(fname, rel_fname, tags).to_record()
+        entry = {"version": file_version, "data": data}
+        if fname in content_ids:
+            entry["blob_id"] = content_ids[fname]
 
         # Update the cache
         try:
-            self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
+            self.TAGS_CACHE[cache_key] = entry
             self.save_tags_cache()
         except SQLITE_ERRORS as e:
             self.tags_cache_error(e)
-            self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
-
-        return data
-
-    def get_tags_raw(self, fname, rel_fname):
-        code = read_text(fname)
-        if not code:
+            self.TAGS_CACHE[cache_key] = entry
+
+        return tags
+
+    def file_edited(self, fname, old_code, new_code, edits=None):
+        """Update the cached tags of `fname` after an edit from `old_code` to
+        `new_code`.
+
+        `edits` are the TextEdits that made it, or None if unknown. The parse
+        tree of the file is kept, so its next edit only reparses and queries
+        again the lines that changed.
+        """
+        rel_fname = self.get_rel_fname(fname)
+        # The file is no longer clean in the git index
+        self.index_blob_ids.pop(rel_fname, None)
+        if self.mtimes is not None:
+            self.files_changed([rel_fname])
+        else:
+            self.map_cache.clear()
+        version = self.get_file_version(fname, rel_fname)
+        if version is None:
             return
 
-        try:
-            lexer = guess_lexer_for_filename(fname, code)
-            lang = lexer.name.lower()
-        except pygments.util.ClassNotFound:
+        previous = self.parsed_files.pop(fname)
+        if previous is not None and previous.code != old_code:
+            previous = None
+        parsed = parse_file_tags(fname, rel_fname, new_code, previous, edits)
+        if parsed is None:
             return
+        self.parsed_files[fname] = parsed
 
+        entry = {"version": version, "data": parsed.file_tags.to_record()}
+        if self.index_blob_ids and not isinstance(version, str):
+            # See content_blob_ids
+            entry["blob_id"] = git_blob_id(new_code.encode("utf-8"))
+        entries = {fname: entry}
         try:
-            language = get_language(lang)
-            parser = get_parser(lang)
-        except Exception as err:
-            print(f"Skipping file {fname}: {err}")
-            return
+            self.update_tags_cache(entries)
+        except SQLITE_ERRORS as e:
+            self.tags_cache_error(e)
+            self.update_tags_cache(entries)
+
+    def get_tags_bulk(self, files, progress=None, versions=None):
+        """Return the FileTags of each (fname, rel_fname) in `files`, keyed by
+        fname.
+
+        `versions` maps fnames to their version when it is already known. Cache
+        misses are extracted in a pool of `map_workers` processes and
+        written back to the tags cache in a single transaction.
+        """
+        all_tags = {}
+        file_versions = []
+        for fname, rel_fname in files:
+            if progress:
+                progress()
 
-        query_scm = get_scm_fname(lang)
-        if not query_scm.exists():
-            return
-        query_scm = read_text(query_scm)
+            if versions and fname in versions:
+                file_version = versions[fname]
+            else:
+                file_version = self.get_file_version(fname, rel_fname)
+            if file_version is None:
+                all_tags[fname] = FileTags(fname, rel_fname)
+                continue
+            file_versions.append((fname, rel_fname, file_version))
 
-        tree = parser.parse(bytes(code, "utf-8"))
+        start = time.perf_counter()
+        metrics = self.metrics
+        with metrics.phase("cache"):
+            keys = [fname for fname, _rel_fname, _file_version in file_versions]
+            try:
+                cached = cache_get_many(self.TAGS_CACHE, keys)
+            except SQLITE_ERRORS as e:
+                self.tags_cache_error(e)
+                cached = cache_get_many(self.TAGS_CACHE, keys)
+
+            misses = []
+            for fname, rel_fname, file_version in file_versions:
+                val = cached.get(fname)
+                if self.entry_matches(val, file_version):
+                    all_tags[fname] = FileTags.from_record(
+                        fname, rel_fname, val["data"]
+                    )
+                    self.cache_stats["tags"]["hits"] += 1
+                else:
+                    misses.append((fname, rel_fname, file_version))
+                    self.cache_stats["tags"]["misses"] += 1
+        self.build_progress = (
+            "tags",
+            len(file_versions) - len(misses),
+            len(file_versions),
+        )
+
+        if self.verbose and file_versions:
+            print(
+                f"Tags cache: {len(file_versions) - len(misses)} of "
+                f"{len(file_versions)} files loaded in "
+                f"{time.perf_counter() - start:.3f}s"
+            )
+
+        entries = {}
+        global_keys = {}
+        with metrics.phase("cache"):
+            if misses and self.GLOBAL_TAGS_CACHE is not None:
+                try:
+                    misses = self.get_global_tags(
+                        misses, all_tags, entries, global_keys
+                    )
+                except SQLITE_ERRORS as e:
+                    self.global_tags_cache_error(e)
+
+        if misses:
+            metrics.counts["parsed_files"] += len(misses)
+            with metrics.phase("parse"):
+                content_ids = self.content_blob_ids(misses)
+                self.extract_missing_tags(misses, all_tags, entries)
+                for fname, blob_id in content_ids.items():
+                    if fname in entries:
+                        entries[fname]["blob_id"] = blob_id
+
+        with metrics.phase("cache"):
+            try:
+                self.update_tags_cache(entries)
+            except SQLITE_ERRORS as e:
+                self.tags_cache_error(e)
+                self.update_tags_cache(entries)
+        self.check_cancelled()
+
+        if global_keys and self.GLOBAL_TAGS_CACHE is not None:
+            try:
+                with metrics.phase("cache"):
+                    self.update_global_tags_cache(
+                        {key: all_tags[fname] for fname, key in global_keys.items()}
+                    )
+            except SQLITE_ERRORS as e:
+                self.global_tags_cache_error(e)
 
-        # Run the tags queries
-        query = language.query(query_scm)
-        captures = query.captures(tree.root_node)
+        metrics.counts["loaded_tags"] += sum(len(tags) for tags in all_tags.values())
+        return all_tags
 
-        saw = set()
-        all_nodes = []
-        for tag, nodes in captures.items():
-            all_nodes += [(node, tag) for node in nodes]
+    def get_global_tags(self, misses, all_tags, entries, global_keys):
+        """Look `misses` up in the global tags cache.
 
-        for node, tag in all_nodes:
-            if tag.startswith("name.definition."):
-                kind = "def"
-            elif tag.startswith("name.reference."):
-                kind = "ref"
-            else:
+        Hits are added to `all_tags` and `entries`, the (language, blob id)
+        key of each miss is added to `global_keys`. Returns the remaining
+        misses.
+        """
+        remaining = []
+        for fname, rel_fname, file_version in misses:
+            blob_id = self.get_blob_id(fname, rel_fname)
+            try:
+                # The same content has other tags in another language
+                key = (get_file_lang(fname), blob_id)
+            except OSError:
+                blob_id = None
+            if blob_id is None:
+                remaining.append((fname, rel_fname, file_version))
                 continue
 
-            saw.add(kind)
+            val = self.GLOBAL_TAGS_CACHE.get(key)
+            if val is None:
+                remaining.append((fname, rel_fname, file_version))
+                global_keys[fname] = key
+                self.cache_stats["global_tags"]["misses"] += 1
+                continue
 
-            result = Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=node.text.decode("utf-8"),
-                kind=kind,
-                line=node.start_point[0],
-            )
+            all_tags[fname] = FileTags.from_record(fname, rel_fname, val)
+            entries[fname] = {"version": file_version, "data": val}
+            self.cache_stats["global_tags"]["hits"] += 1
 
-            yield result
+        return remaining
 
-        if "ref" in saw:
-            return
-        if "def" not in saw:
+    def extract_missing_tags(self, misses, all_tags, entries):
+        records = self.extract_tags([(fname, rel) for fname, rel, _ in misses])
+        extracted = records
+        if len(misses) > PARALLEL_SCAN_THRESHOLD:
+            from tqdm import tqdm
+
+            print(
+                "Initial repo scan can be slow in larger repos, but only happens once."
+            )
+            extracted = tqdm(records, total=len(misses), desc="Scanning repo")
+
+        phase, done, total = self.build_progress or ("tags", 0, len(misses))
+        for (fname, rel_fname, file_version), data in zip(misses, extracted):
+            all_tags[fname] = FileTags.from_record(fname, rel_fname, data)
+            entries[fname] = {"version": file_version, "data": data}
+            done += 1
+            self.build_progress = (phase, done, total)
+            if self.cancelled.is_set():
+                # The caller saves what was extracted, then stops
+                records.close()
+                break
+
+    def extract_tags(self, files):
+        """Yield the FileTags record of each (fname, rel_fname) in `files`, in
+        order."""
+        workers = min(self.map_workers, len(files))
+        if workers <= 1 or len(files) < PARALLEL_SCAN_THRESHOLD:
+            for fname, rel_fname in files:
+                if self.verbose:
+                    print(f"Processing {fname}")
+                tags = self.get_tags_raw(fname, rel_fname)
+                yield FileTags.from_tags(fname, rel_fname, tags).to_record()
             return
 
-        # We saw defs, without any refs
-        # Some tags files only provide defs (cpp, for example)
-        # Use pygments to backfill refs
-        tokens = list(lexer.get_tokens(code))
-        tokens = [token[1] for token in tokens if token[0] in Token.Name]
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
 
-        for token in tokens:
-            yield Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=token,
-                kind="ref",
-                line=-1,
-            )
+        # Workers are spawned rather than forked, the map may be built from a
+        # thread of a process that also runs an event loop.
+        chunksize = max(1, min(64, len(files) // (workers * 4)))
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            yield from executor.map(_extract_tags, files, chunksize=chunksize)
+        finally:
+            # Don't wait for the remaining files if the caller stopped early
+            executor.shutdown(cancel_futures=True)
+
+    def update_tags_cache(self, entries):
+        transact = getattr(self.TAGS_CACHE, "transact", contextlib.nullcontext)
+        with transact():
+            for key, val in entries.items():
+                self.TAGS_CACHE[key] = val
+
+    def update_global_tags_cache(self, tags_by_key):
+        # Records hold no file names, the same blob can be checked out at
+        # different paths in the same language.
+        with self.GLOBAL_TAGS_CACHE.transact():
+            for key, data in tags_by_key.items():
+                self.GLOBAL_TAGS_CACHE[key] = data.to_record()
+
+    def get_tags_raw(self, fname, rel_fname):
+        return get_tags_raw(fname, rel_fname)
 
     def get_ranked_tags(
         self,
@@ -309,12 +753,6 @@ class RepoMap:
         mentioned_idents,
         progress=None,
     ):
-        import networkx as nx
-
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
-
         personalization = dict()
 
         fnames = set(chat_fnames).union(set(other_fnames))
@@ -326,160 +764,83 @@ class RepoMap:
         # https://networkx.org/documentation/stable/_modules/networkx/algorithms/link_analysis/pagerank_alg.html#pagerank
         personalize = 100 / len(fnames)
 
+        # Files the git index reports as clean are versioned by their blob id
+        # and not stat-ed at all, only the other ones are.
+        metrics = self.metrics
+        with metrics.phase("files"):
+            files = []
+            versions = {}
+            for fname in fnames:
+                rel_fname = self.get_rel_fname(fname)
+                version = self.get_file_version(fname, rel_fname)
+
+                if version is None:
+                    if fname not in self.warned_files:
+                        print(f"WARNING: Repo-map can't include {fname}")
+                        print(
+                            "Has it been deleted from the file system but not from git?"
+                        )
+                        self.warned_files.add(fname)
+                    continue
+
+                versions[fname] = version
+
+                if fname in chat_fnames:
+                    personalization[rel_fname] = personalize
+                    chat_rel_fnames.add(rel_fname)
+
+                if rel_fname in mentioned_fnames:
+                    personalization[rel_fname] = personalize
+
+                files.append((fname, rel_fname))
+
+        # Only re-read the tags of files that changed since the last call, and
+        # apply them to the graph as per-file deltas.
+        tag_graph = self.tag_graph
+        changed = [
+            (fname, rel_fname)
+            for fname, rel_fname in files
+            if tag_graph.file_versions.get(rel_fname) != versions[fname]
+        ]
+        self.cache_stats["tag_graph"]["hits"] += len(files) - len(changed)
+        self.cache_stats["tag_graph"]["misses"] += len(changed)
+        metrics.counts["files"] += len(files)
+        metrics.counts["changed_files"] += len(changed)
+
+        all_tags = self.get_tags_bulk(changed, progress, versions)
+        with metrics.phase("graph"):
+            for fname, rel_fname in changed:
+                tag_graph.update_file(rel_fname, versions[fname], all_tags[fname])
+
+            rel_fnames = set(rel_fname for _fname, rel_fname in files)
+            for rel_fname in set(tag_graph.file_versions) - rel_fnames:
+                tag_graph.remove_file(rel_fname)
+
+        self.build_progress = ("ranking", 0, 1)
+        with metrics.phase("graph"):
+            G = tag_graph.rank_graph(mentioned_idents)
+            definitions = tag_graph.definitions
+
+        # Start from the previous ranks, they are close to the new ones when
+        # only a few files changed.
+        rank = get_rank_backend(self.rank_backend)
         try:
-            cache_size = len(self.TAGS_CACHE)
-        except SQLITE_ERRORS as e:
-            self.tags_cache_error(e)
-            cache_size = len(self.TAGS_CACHE)
-
-        if len(fnames) - cache_size > 100:
-            print(
-                "Initial repo scan can be slow in larger repos, but only happens once."
-            )
-            fnames = tqdm(fnames, desc="Scanning repo")
-            showing_bar = True
-        else:
-            showing_bar = False
-
-        for fname in fnames:
-            if self.verbose:
-                print(f"Processing {fname}")
-            if progress and not showing_bar:
-                progress()
-
-            try:
-                file_ok = Path(fname).is_file()
-            except OSError:
-                file_ok = False
-
-            if not file_ok:
-                if fname not in self.warned_files:
-                    print(f"WARNING: Repo-map can't include {fname}")
-                    print("Has it been deleted from the file system but not from git?")
-                    self.warned_files.add(fname)
-                continue
-
-            # dump(fname)
-            rel_fname = self.get_rel_fname(fname)
-
-            if fname in chat_fnames:
-                personalization[rel_fname] = personalize
-                chat_rel_fnames.add(rel_fname)
-
-            if rel_fname in mentioned_fnames:
-                personalization[rel_fname] = personalize
-
-            tags = list(self.get_tags(fname, rel_fname))
-            if tags is None:
-                continue
-
-            for tag in tags:
-                if tag.kind == "def":
-                    defines[tag.name].add(rel_fname)
-                    key = (rel_fname, tag.name)
-                    definitions[key].add(tag)
-
-                elif tag.kind == "ref":
-                    references[tag.name].append(rel_fname)
-
-        if not references:
-            references = dict((k, list(v)) for k, v in defines.items())
-
-        idents = set(defines.keys()).intersection(set(references.keys()))
-
-        G = nx.MultiDiGraph()
-
-        # Add a small self-edge for every definition that has no references
-        # Helps with tree-sitter 0.23.2 with ruby, where "def greet(name)"
-        # isn't counted as a def AND a ref. tree-sitter 0.24.0 does.
-        for ident in defines.keys():
-            if ident in references:
-                continue
-            for definer in defines[ident]:
-                G.add_edge(definer, definer, weight=0.1, ident=ident)
-
-        for ident in idents:
-            if progress:
-                progress()
-
-            definers = defines[ident]
-            if ident in mentioned_idents:
-                mul = 10
-            elif ident.startswith("_"):
-                mul = 0.1
-            else:
-                mul = 1
-
-            for referencer, num_refs in Counter(references[ident]).items():
-                for definer in definers:
-                    # scale down so high freq (low value) mentions don't dominate
-                    num_refs = math.sqrt(num_refs)
-
-                    G.add_edge(referencer, definer, weight=mul * num_refs, ident=ident)
-
-        if not references:
-            pass
-
-        if personalization:
-            pers_args = dict(personalization=personalization, dangling=personalization)
-        else:
-            pers_args = dict()
-
-        try:
-            ranked = nx.pagerank(G, weight="weight", **pers_args)
+            with metrics.phase("rank"):
+                ranked, ranked_definitions = rank(G, personalization, self.last_ranked)
         except ZeroDivisionError:
             # Issue #1536
             try:
-                ranked = nx.pagerank(G, weight="weight")
+                with metrics.phase("rank"):
+                    ranked, ranked_definitions = rank(G, nstart=self.last_ranked)
             except ZeroDivisionError:
                 return []
+        self.last_ranked = ranked
+        metrics.counts["definitions"] += len(definitions)
 
-        # distribute the rank from each source node, across all of its out edges
-        ranked_definitions = defaultdict(float)
-        for src in G.nodes:
-            if progress:
-                progress()
-
-            src_rank = ranked[src]
-            total_weight = sum(
-                data["weight"] for _src, _dst, data in G.out_edges(src, data=True)
-            )
-            # dump(src, src_rank, total_weight)
-            for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
-                ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
-
-        ranked_tags = []
-        ranked_definitions = sorted(
-            ranked_definitions.items(), reverse=True, key=lambda x: (x[1], x[0])
-        )
-
-        for (fname, ident), rank in ranked_definitions:
-            # print(f"{rank:.03f} {fname} {ident}")
-            if fname in chat_rel_fnames:
-                continue
-            ranked_tags += list(definitions.get((fname, ident), []))
-
-        rel_other_fnames_without_tags = set(
-            self.get_rel_fname(fname) for fname in other_fnames
-        )
-
-        fnames_already_included = set(rt[0] for rt in ranked_tags)
-
-        top_rank = sorted(
-            [(rank, node) for (node, rank) in ranked.items()], reverse=True
+        rel_other_fnames = set(self.get_rel_fname(fname) for fname in other_fnames)
+        return RankedTags(
+            ranked, ranked_definitions, definitions, chat_rel_fnames, rel_other_fnames
         )
-        for rank, fname in top_rank:
-            if fname in rel_other_fnames_without_tags:
-                rel_other_fnames_without_tags.remove(fname)
-            if fname not in fnames_already_included:
-                ranked_tags.append((fname,))
-
-        for fname in rel_other_fnames_without_tags:
-            ranked_tags.append((fname,))
-
-        return ranked_tags
 
     def get_ranked_tags_map(
         self,
@@ -504,9 +865,16 @@ class RepoMap:
             ]
         cache_key = tuple(cache_key)
 
+        metrics = self.metrics = MapMetrics()
+        cache_stats_before = {
+            layer: Counter(stats) for layer, stats in self.cache_stats.items()
+        }
+
         use_cache = False
         if not force_refresh:
             if self.refresh == "manual" and self.last_map:
+                metrics.cached = True
+                self.report_metrics(metrics, cache_stats_before)
                 return self.last_map
 
             if self.refresh == "always":
@@ -518,23 +886,34 @@ class RepoMap:
 
             # Check if the result is in the cache
             if use_cache and cache_key in self.map_cache:
+                self.cache_stats["map"]["hits"] += 1
+                metrics.cached = True
+                self.report_metrics(metrics, cache_stats_before)
                 return self.map_cache[cache_key]
 
+        self.cache_stats["map"]["misses"] += 1
+
         # If not in cache or force_refresh is True, generate the map
+        generation = self.files_generation
         start_time = time.time()
-        result = self.get_ranked_tags_map_uncached(
-            chat_fnames,
-            other_fnames,
-            max_map_tokens,
-            mentioned_fnames,
-            mentioned_idents,
-        )
+        try:
+            result = self.get_ranked_tags_map_uncached(
+                chat_fnames,
+                other_fnames,
+                max_map_tokens,
+                mentioned_fnames,
+                mentioned_idents,
+            )
+        finally:
+            self.build_progress = None
         end_time = time.time()
         self.map_processing_time = end_time - start_time
 
-        # Store the result in the cache
-        self.map_cache[cache_key] = result
+        # Store the result in the cache, unless files changed while building it
+        if generation == self.files_generation:
+            self.map_cache[cache_key] = result
         self.last_map = result
+        self.report_metrics(metrics, cache_stats_before)
 
         return result
 
@@ -549,7 +928,7 @@ class RepoMap:
         if not other_fnames:
             other_fnames = list()
         if not max_map_tokens:
-            max_map_tokens = self.max_map_tokens
+            max_map_tokens = self.get_map_tokens(chat_fnames)
         if not mentioned_fnames:
             mentioned_fnames = set()
         if not mentioned_idents:
@@ -561,59 +940,105 @@ class RepoMap:
             mentioned_fnames,
             mentioned_idents,
         )
-
-        num_tags = len(ranked_tags)
-        lower_bound = 0
-        upper_bound = num_tags
-        best_tree = None
-        best_tree_tokens = 0
+        self.check_cancelled()
+        self.build_progress = ("rendering", 0, MAX_BUDGET_PASSES)
 
         chat_rel_fnames = set(self.get_rel_fname(fname) for fname in chat_fnames)
 
-        self.tree_cache = dict()
-
-        middle = min(int(max_map_tokens // 25), num_tags)
-        while lower_bound <= upper_bound:
-            # dump(lower_bound, middle, upper_bound)
+        metrics = self.metrics
+        with metrics.phase("budget"):
+            num_tags = self.budget_ranked_tags(
+                ranked_tags, chat_rel_fnames, max_map_tokens
+            )
 
-            tree = self.to_tree(ranked_tags[:middle], chat_rel_fnames)
-            num_tokens = self.token_count(tree)
+        # The estimate is usually close, correct it from the actual size of
+        # the rendered map for a bounded number of passes.
+        best_tree = None
+        best_tree_tokens = 0
+        ok_err = 0.15
+        for budget_pass in range(MAX_BUDGET_PASSES):
+            self.check_cancelled()
+            self.build_progress = ("rendering", budget_pass, MAX_BUDGET_PASSES)
+            metrics.counts["render_passes"] += 1
+            with metrics.phase("render"):
+                tree = self.to_tree(ranked_tags[:num_tags], chat_rel_fnames)
+                num_tokens = self.token_count(tree, "repo_map")
 
             pct_err = abs(num_tokens - max_map_tokens) / max_map_tokens
-            ok_err = 0.15
             if (
                 num_tokens <= max_map_tokens and num_tokens > best_tree_tokens
             ) or pct_err < ok_err:
                 best_tree = tree
                 best_tree_tokens = num_tokens
+                metrics.counts["map_tags"] = num_tags
+                metrics.counts["map_tokens"] = num_tokens
 
                 if pct_err < ok_err:
                     break
 
-            if num_tokens < max_map_tokens:
-                lower_bound = middle + 1
-            else:
-                upper_bound = middle - 1
+            if num_tokens <= max_map_tokens and num_tags == len(ranked_tags):
+                break
 
-            middle = int((lower_bound + upper_bound) // 2)
+            scaled = int(num_tags * max_map_tokens / max(num_tokens, 1))
+            scaled = min(scaled, len(ranked_tags))
+            if scaled == num_tags:
+                break
+            num_tags = scaled
 
         return best_tree
 
-    tree_cache = dict()
+    def budget_ranked_tags(self, ranked_tags, chat_rel_fnames, max_map_tokens):
+        """Return how many of `ranked_tags` are estimated to fit in
+        `max_map_tokens`.
+
+        The first tag of a file costs the tokens of the file rendered with it
+        alone, its other tags share what rendering them all adds to that. The
+        cut-off is the longest prefix of the ranking whose cumulative cost
+        fits, so only files within it are rendered, at most twice.
+        """
+        first_costs = {}
+        other_costs = {}
+        total = 0
+        for num_tags, tag in enumerate(ranked_tags):
+            rel_fname = tag[0]
+            if rel_fname in chat_rel_fnames:
+                continue
+
+            tags = ranked_tags.file_tags(rel_fname)
+            # Files of a language have a similar ratio of chars per token
+            kind = os.path.splitext(rel_fname)[1]
+            if rel_fname not in first_costs:
+                tree = self.to_tree(tags[:1], chat_rel_fnames)
+                first_costs[rel_fname] = self.token_count(tree, kind)
+                total += first_costs[rel_fname]
+            else:
+                if rel_fname not in other_costs:
+                    tree = self.to_tree(tags, chat_rel_fnames)
+                    other_tokens = self.token_count(tree, kind)
+                    other_tokens -= first_costs[rel_fname]
+                    other_costs[rel_fname] = other_tokens / (len(tags) - 1)
+                total += other_costs[rel_fname]
+
+            if total > max_map_tokens:
+                return num_tags
+
+        return len(ranked_tags)
 
     def render_tree(self, abs_fname, rel_fname, lois):
-        mtime = self.get_mtime(abs_fname)
-        key = (rel_fname, tuple(sorted(lois)), mtime)
+        version = self.get_file_version(abs_fname, rel_fname)
+        key = (rel_fname, tuple(sorted(lois)), version)
 
-        if key in self.tree_cache:
-            return self.tree_cache[key]
+        res = self.tree_cache.get(key)
+        if res is not None:
+            return res
 
-        if (
-            rel_fname not in self.tree_context_cache
-            or self.tree_context_cache[rel_fname]["mtime"] != mtime
-        ):
-            with open(str(abs_fname), "r") as f:
-                code = f.read()
+        context = self.tree_context_cache.get((rel_fname, version))
+        if context is None:
+            from grep_ast import TreeContext
+
+            code = content_store.read_text(abs_fname)
+            if code is None:
+                return ""
 
             if not code.endswith("\n"):
                 code += "\n"
@@ -631,9 +1056,8 @@ class RepoMap:
                 # header_max=30,
                 show_top_of_file_parent_scope=False,
             )
-            self.tree_context_cache[rel_fname] = {"context": context, "mtime": mtime}
+            self.tree_context_cache[(rel_fname, version)] = context
 
-        context = self.tree_context_cache[rel_fname]["context"]
         context.lines_of_interest = set()
         context.add_lines_of_interest(lois)
         context.add_context()
@@ -680,6 +1104,314 @@ class RepoMap:
         return output
 
 
+def get_tags_raw(fname, rel_fname):
+    yield from extract_file_tags(fname, rel_fname)
+
+
+def extract_file_tags(fname, rel_fname):
+    """Return the FileTags of `fname`."""
+    code = content_store.read_text(fname)
+    parsed = parse_file_tags(fname, rel_fname, code) if code else None
+    if parsed is None:
+        return FileTags(fname, rel_fname)
+    return parsed.file_tags
+
+
+def get_file_lang(fname):
+    """Return the language `fname` is parsed as, reading it only if its name
+    doesn't tell. Raises OSError if it can't be read."""
+    table = get_language_table()
+    lang = table.get_name_lang(fname)
+    if lang is AMBIGUOUS:
+        code = content_store.read_text(fname)
+        lang = table.get_lang(fname, code) if code else None
+    return lang
+
+
+# A parsed source file and its tags
+ParsedFile = namedtuple("ParsedFile", "lang code tree file_tags")
+
+
+def parse_file_tags(fname, rel_fname, code, previous=None, edits=None):
+    """Parse `code`, the content of `fname`, and return its ParsedFile.
+
+    If `previous` is the ParsedFile of the content `edits` were applied to,
+    its tree is reparsed incrementally and only the lines that changed are
+    queried again. Returns None if there is no tags query for the language.
+    """
+    lang = get_language_table().get_lang(fname, code)
+    if not lang:
+        return
+
+    try:
+        tags_language = get_tags_language(lang)
+    except Exception as err:
+        print(f"Skipping file {fname}: {err}")
+        return
+
+    if not tags_language:
+        return
+    parser, query = tags_language
+
+    # Refs backfilled from pygments have no line, they can't be updated
+    # per line.
+    incremental = (
+        previous is not None
+        and edits is not None
+        and previous.lang == lang
+        and -1 not in previous.file_tags.lines
+    )
+    if not incremental:
+        tree = parser.parse(bytes(code, "utf-8"))
+        tags = get_tree_tags(fname, rel_fname, code, lang, query, tree)
+        return ParsedFile(lang, code, tree, FileTags.from_tags(fname, rel_fname, tags))
+
+    old_tree = previous.tree
+    # Error recovery may restructure nodes away from the edit without
+    # reporting them in changed_ranges, and recovers differently than a full
+    # parse, so trees with syntax errors are parsed again from scratch.
+    had_error = old_tree.root_node.has_error
+    for edit in edits:
+        old_tree.edit(**edit._asdict())
+    tree = parser.parse(bytes(code, "utf-8"), old_tree)
+    if had_error or tree.root_node.has_error:
+        return parse_file_tags(fname, rel_fname, code)
+
+    # Lines first..last of the new code replace first..last - delta of the
+    # old one, the lines around them are the same.
+    old_lines = previous.code.split("\n")
+    new_lines = code.split("\n")
+    first = 0
+    while (
+        first < min(len(old_lines), len(new_lines))
+        and old_lines[first] == new_lines[first]
+    ):
+        first += 1
+    num_same_after = 0
+    while (
+        num_same_after < min(len(old_lines), len(new_lines)) - first
+        and old_lines[-1 - num_same_after] == new_lines[-1 - num_same_after]
+    ):
+        num_same_after += 1
+    last = len(new_lines) - num_same_after - 1
+    # Also re-query the nodes whose syntax changed outside of those lines.
+    for changed in old_tree.changed_ranges(tree):
+        first = min(first, changed.start_point.row)
+        last = max(last, changed.end_point.row)
+    delta = len(new_lines) - len(old_lines)
+
+    tags = [tag for tag in previous.file_tags if tag.line < first]
+    if first <= last:
+        point_range = ((first, 0), (last + 1, 0))
+        tags += [
+            tag
+            for tag in query_tags(query, tree, fname, rel_fname, point_range)
+            if first <= tag.line <= last
+        ]
+    tags += [
+        tag._replace(line=tag.line + delta)
+        for tag in previous.file_tags
+        if tag.line > last - delta
+    ]
+
+    if not any(tag.kind == "ref" for tag in tags):
+        # The file may need the refs backfill now
+        tags = get_tree_tags(fname, rel_fname, code, lang, query, tree)
+    return ParsedFile(lang, code, tree, FileTags.from_tags(fname, rel_fname, tags))
+
+
+def get_tree_tags(fname, rel_fname, code, lang, query, tree):
+    """Return the tags of `tree`, parsed from `code`."""
+    tags = list(query_tags(query, tree, fname, rel_fname))
+
+    saw = set(tag.kind for tag in tags)
+    if "ref" in saw:
+        return tags
+    if "def" not in saw:
+        return tags
+
+    # We saw defs, without any refs
+    # Some tags files only provide defs (cpp, for example)
+    # Use pygments to backfill refs
+    import pygments.util
+    from pygments.token import Token
+
+    try:
+        lexer = get_lexer(lang)
+    except pygments.util.ClassNotFound:
+        return tags
+    tokens = list(lexer.get_tokens(code))
+    tokens = [token[1] for token in tokens if token[0] in Token.Name]
+
+    for token in tokens:
+        tags.append(
+            Tag(
+                rel_fname=rel_fname,
+                fname=fname,
+                name=token,
+                kind="ref",
+                line=-1,
+            )
+        )
+    return tags
+
+
+# Queries are shared, setting the range of one must not leak to other threads
+_query_lock = threading.Lock()
+
+# Point range of a query that isn't limited to part of the tree
+FULL_POINT_RANGE = ((0, 0), (2**32 - 1, 2**32 - 1))
+
+
+def query_tags(query, tree, fname, rel_fname, point_range=None):
+    """Yield the def and ref tags `query` captures in `tree`, only around
+    `point_range` if given."""
+    # Run the tags queries
+    with _query_lock:
+        if point_range:
+            query.set_point_range(point_range)
+        try:
+            captures = query.captures(tree.root_node)
+        finally:
+            if point_range:
+                query.set_point_range(FULL_POINT_RANGE)
+
+    all_nodes = []
+    for tag, nodes in captures.items():
+        all_nodes += [(node, tag) for node in nodes]
+
+    for node, tag in all_nodes:
+        if tag.startswith("name.definition."):
+            kind = "def"
+        elif tag.startswith("name.reference."):
+            kind = "ref"
+        else:
+            continue
+
+        yield Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=node.text.decode("utf-8"),
+            kind=kind,
+            line=node.start_point[0],
+        )
+
+
+# lang -> (parser, query), None if there is no tags query for lang, or the
+# exception raised while loading it. Filled lazily, once per process.
+_tags_languages = {}
+
+
+def get_tags_language(lang):
+    """Return the parser and compiled tags query for `lang`.
+
+    Both are loaded on first use and shared by every later call in the process.
+    Returns None if there is no tags query for `lang`, and re-raises the
+    loading error if tree-sitter doesn't support it.
+    """
+    if lang not in _tags_languages:
+        from tree_sitter_language_pack import get_language, get_parser
+
+        try:
+            language = get_language(lang)
+            parser = get_parser(lang)
+        except Exception as err:
+            _tags_languages[lang] = err
+            raise
+
+        query_scm = get_scm_fname(lang)
+        if query_scm.exists():
+            _tags_languages[lang] = (parser, language.query(read_text(query_scm)))
+        else:
+            _tags_languages[lang] = None
+
+    tags_language = _tags_languages[lang]
+    if isinstance(tags_language, Exception):
+        raise tags_language
+    return tags_language
+
+
+def cache_get_many(cache, keys):
+    """Return the values of the `keys` found in `cache`, keyed by key.
+
+    diskcache has no bulk read, so a Cache that doesn't track reads is queried
+    directly, `BULK_READ_SIZE` string keys at a time. That relies on internals
+    of diskcache, the keys are read one by one if they changed.
+    """
+    from diskcache import Cache
+
+    try:
+        from diskcache.core import EVICTION_POLICY
+
+        bulk = (
+            isinstance(cache, Cache)
+            and not cache.statistics
+            and EVICTION_POLICY[cache.eviction_policy]["get"] is None
+            and callable(getattr(cache, "_sql", None))
+            and callable(getattr(getattr(cache, "disk", None), "fetch", None))
+        )
+    except (ImportError, KeyError, TypeError):
+        bulk = False
+    if bulk:
+        try:
+            return _cache_select_many(cache, keys)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.debug(f"Bulk read of the cache failed, reading keys: {e}")
+
+    values = {}
+    for key in keys:
+        value = cache.get(key)
+        if value is not None:
+            values[key] = value
+    return values
+
+
+def _cache_select_many(cache, keys):
+    """Read the `keys` of a diskcache Cache from its Cache table."""
+    values = {}
+    now = time.time()
+    for start in range(0, len(keys), BULK_READ_SIZE):
+        chunk = keys[start : start + BULK_READ_SIZE]
+        select = (
+            "SELECT key, mode, filename, value FROM Cache"
+            f" WHERE key IN ({','.join('?' * len(chunk))}) AND raw = 1"
+            " AND (expire_time IS NULL OR expire_time > ?)"
+        )
+        for key, mode, filename, db_value in cache._sql(select, (*chunk, now)):
+            try:
+                values[key] = cache.disk.fetch(mode, filename, db_value, False)
+            except IOError:
+                # Deleted since the query, like Cache.get treat it as missing
+                continue
+    return values
+
+
+def tree_context_size(context):
+    """Estimate the memory used by a TreeContext, in bytes."""
+    return TREE_CONTEXT_BYTES_PER_CHAR * sum(len(line) for line in context.lines)
+
+
+_language_table = None
+
+
+def get_language_table():
+    """Return the LanguageTable of the languages with a tags query, built on
+    first use."""
+    global _language_table
+    if _language_table is None:
+        tags_langs = {
+            path.name.removesuffix("-tags.scm")
+            for path in get_scm_dir().glob("*-tags.scm")
+        }
+        _language_table = LanguageTable.from_pygments(tags_langs)
+    return _language_table
+
+
+def _extract_tags(file):
+    fname, rel_fname = file
+    return extract_file_tags(fname, rel_fname).to_record()
+
+
 def find_src_files(directory):
     if not os.path.isdir(directory):
         return [directory]
@@ -691,16 +1423,14 @@ def find_src_files(directory):
     return src_files
 
 
-def get_scm_fname(lang):
+def get_scm_dir():
     import arox
 
-    path = (
-        Path(arox.__file__).parent
-        / "resources"
-        / "tree-sitter-language-pack"
-        / f"{lang}-tags.scm"
-    )
-    return path
+    return Path(arox.__file__).parent / "resources" / "tree-sitter-language-pack"
+
+
+def get_scm_fname(lang):
+    return get_scm_dir() / f"{lang}-tags.scm"
 
 
 if __name__ == "__main__":
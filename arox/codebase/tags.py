@@ -0,0 +1,101 @@
+"""Tags of source files, in a compact form for caching.
+
+A file typically has thousands of tags sharing a few hundred names. FileTags
+keeps them as columns: a table of the distinct names of the file, and arrays of
+name ids, lines and kinds, so that they are pickled as a few flat buffers
+rather than one tuple per tag, and don't repeat the file names.
+"""
+
+from array import array
+from collections import Counter, namedtuple
+
+Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
+
+KINDS = ("def", "ref")
+KIND_IDS = {kind: kind_id for kind_id, kind in enumerate(KINDS)}
+DEF, REF = range(len(KINDS))
+
+
+class FileTags:
+    """The tags of one file."""
+
+    __slots__ = ("fname", "rel_fname", "names", "name_ids", "lines", "kinds")
+
+    def __init__(
+        self, fname, rel_fname, names=(), name_ids=None, lines=None, kinds=b""
+    ):
+        self.fname = fname
+        self.rel_fname = rel_fname
+        self.names = names
+        self.name_ids = array("i") if name_ids is None else name_ids
+        self.lines = array("i") if lines is None else lines
+        self.kinds = kinds
+
+    @classmethod
+    def from_tags(cls, fname, rel_fname, tags):
+        names = {}
+        name_ids = array("i")
+        lines = array("i")
+        kinds = bytearray()
+        for tag in tags:
+            name_ids.append(names.setdefault(tag.name, len(names)))
+            lines.append(tag.line)
+            kinds.append(KIND_IDS[tag.kind])
+        return cls(fname, rel_fname, tuple(names), name_ids, lines, bytes(kinds))
+
+    @classmethod
+    def from_record(cls, fname, rel_fname, record):
+        """Load the tags of `fname` from a record made by `to_record`."""
+        names, name_ids, lines, kinds = record
+        return cls(
+            fname, rel_fname, names, array("i", name_ids), array("i", lines), kinds
+        )
+
+    def check(self):
+        """Raise ValueError unless the arrays of the tags are consistent,
+        e.g. for a record that wasn't made by this version."""
+        if not len(self.name_ids) == len(self.lines) == len(self.kinds):
+            raise ValueError("tags arrays of different lengths")
+        if not all(isinstance(name, str) for name in self.names):
+            raise ValueError("tag names must be strings")
+        if self.name_ids and (
+            min(self.name_ids) < 0 or max(self.name_ids) >= len(self.names)
+        ):
+            raise ValueError("tag name ids out of range")
+        if self.kinds and max(self.kinds) >= len(KINDS):
+            raise ValueError("unknown tag kinds")
+
+    def to_record(self):
+        """Return the tags as a tuple of plain values, without the file names.
+
+        Records are what the tags caches store, so a record can be loaded
+        for any file with the same content.
+        """
+        return (
+            self.names,
+            self.name_ids.tobytes(),
+            self.lines.tobytes(),
+            self.kinds,
+        )
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        names = self.names
+        for name_id, line, kind in zip(self.name_ids, self.lines, self.kinds):
+            yield Tag(self.rel_fname, self.fname, line, names[name_id], KINDS[kind])
+
+    def definitions(self):
+        """Yield the Tag of each definition."""
+        names = self.names
+        for name_id, line, kind in zip(self.name_ids, self.lines, self.kinds):
+            if kind == DEF:
+                yield Tag(self.rel_fname, self.fname, line, names[name_id], "def")
+
+    def reference_counts(self):
+        """Return a Counter of the names referenced by the file."""
+        counts = Counter(
+            name_id for name_id, kind in zip(self.name_ids, self.kinds) if kind == REF
+        )
+        return Counter({self.names[name_id]: num for name_id, num in counts.items()})
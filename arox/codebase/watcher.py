@@ -0,0 +1,248 @@
+"""Background watching of the files of a workspace.
+
+A watcher records the paths that changed under a workspace, so that whoever
+depends on those files can ask what changed since they last looked instead of
+checking every file again. `WatchdogWatcher` is notified by the OS (inotify on
+Linux) through the optional `watchdog` package, `PollingWatcher` is the
+fallback and periodically stats the paths it was asked to watch.
+
+Paths are reported relative to the workspace, as posix strings.
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two scans of PollingWatcher
+POLL_INTERVAL = 2.0
+
+# The git index, the list of tracked files and their blob ids depend on it
+GIT_INDEX = ".git/index"
+
+# Changes under these directories are ignored, apart from GIT_INDEX. .arox
+# holds the tags cache, which is written on every map build.
+IGNORED_DIRS = (".git", ".arox")
+
+# Event types not implying a change of content
+IGNORED_EVENTS = ("opened", "closed_no_write")
+
+
+class ChangeSet:
+    """The paths changed since the last `take`, for one consumer."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = set()
+        # Nothing is known of the changes before the first take
+        self._complete = False
+
+    def add(self, path):
+        with self._lock:
+            self._paths.add(path)
+
+    def reset(self):
+        """Mark the changes as unknown, e.g. after events were lost."""
+        with self._lock:
+            self._paths = set()
+            self._complete = False
+
+    def take(self):
+        """Return the set of paths changed since the last call, or None if
+        they are unknown and any file may have changed."""
+        with self._lock:
+            paths = self._paths if self._complete else None
+            self._paths = set()
+            self._complete = True
+        return paths
+
+
+class Watcher:
+    """Dispatches the changes under `root` to the change sets of its
+    subscribers."""
+
+    def __init__(self, root):
+        self.root = Path(root).absolute()
+        self._lock = threading.Lock()
+        self._change_sets = []
+
+    def subscribe(self) -> ChangeSet:
+        change_set = ChangeSet()
+        with self._lock:
+            self._change_sets.append(change_set)
+        return change_set
+
+    def watch_paths(self, paths):
+        """Set the paths that matter to the subscribers. Watchers notified by
+        the OS see every path and ignore this."""
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def path_changed(self, path):
+        """Report a change of `path`, absolute or relative to the root."""
+        path = Path(path)
+        if path.is_absolute():
+            if not path.is_relative_to(self.root):
+                return
+            path = path.relative_to(self.root)
+        rel_path = path.as_posix()
+        if path.parts and path.parts[0] in IGNORED_DIRS and rel_path != GIT_INDEX:
+            return
+
+        with self._lock:
+            change_sets = list(self._change_sets)
+        for change_set in change_sets:
+            change_set.add(rel_path)
+
+    def changes_lost(self):
+        """Report that changes may have been missed."""
+        with self._lock:
+            change_sets = list(self._change_sets)
+        for change_set in change_sets:
+            change_set.reset()
+
+
+class WatchdogWatcher(Watcher):
+    """Watches the whole tree of the root with watchdog. Raises ImportError if
+    watchdog isn't installed, and OSError if the OS can't watch that many
+    directories."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.observer = None
+
+    def start(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in IGNORED_EVENTS:
+                    return
+                if event.is_directory:
+                    # Moving or deleting a directory changes the files in it
+                    # with a single event.
+                    if event.event_type in ("moved", "deleted"):
+                        if not watcher.is_ignored(event.src_path):
+                            watcher.changes_lost()
+                    return
+                watcher.path_changed(event.src_path)
+                if getattr(event, "dest_path", ""):
+                    watcher.path_changed(event.dest_path)
+
+        observer = Observer()
+        observer.daemon = True
+        observer.schedule(Handler(), str(self.root), recursive=True)
+        observer.start()
+        self.observer = observer
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def is_ignored(self, path):
+        path = Path(path)
+        if not path.is_relative_to(self.root):
+            return True
+        parts = path.relative_to(self.root).parts
+        return bool(parts) and parts[0] in IGNORED_DIRS
+
+
+class PollingWatcher(Watcher):
+    """Stats the watched paths every `interval` seconds in a background thread,
+    and reports those whose mtime or size changed."""
+
+    def __init__(self, root, interval=POLL_INTERVAL):
+        super().__init__(root)
+        self.interval = interval
+        self._paths = {GIT_INDEX}
+        # rel path -> (mtime_ns, size) at the last scan, None if missing
+        self._snapshot = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def watch_paths(self, paths):
+        paths = set(paths)
+        paths.add(GIT_INDEX)
+        self._paths = paths
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="arox-file-poller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Failed to poll the workspace files")
+                self.changes_lost()
+
+    def scan(self):
+        snapshot = {}
+        for path in self._paths:
+            try:
+                st = os.stat(self.root / path)
+                snapshot[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                snapshot[path] = None
+
+        previous = self._snapshot
+        self._snapshot = snapshot
+        for path, signature in snapshot.items():
+            # Paths seen for the first time are reported too, they may have
+            # changed between the subscriber reading them and this scan.
+            if path not in previous or previous[path] != signature:
+                self.path_changed(path)
+
+
+def create_watcher(root, backend="auto", poll_interval=POLL_INTERVAL):
+    """Create and start a watcher of `root`.
+
+    `backend` is "watchdog", "poll", "auto" for watchdog if it is installed
+    (the `watch` extra) and no watcher otherwise, or "off" to return None.
+    Polling stats every watched file, which costs more than checking them
+    once per map on large repos, so it is never picked by "auto".
+    """
+    if backend == "off":
+        return None
+    if backend not in ("auto", "watchdog", "poll"):
+        raise ValueError(f"Unknown file watcher: {backend}")
+
+    if backend != "poll":
+        watcher = WatchdogWatcher(root)
+        try:
+            watcher.start()
+            return watcher
+        except ImportError:
+            if backend == "auto":
+                return None
+            logger.warning("watchdog is not installed, polling files instead")
+        except OSError as e:
+            if backend == "auto":
+                logger.warning(f"Failed to watch {root}: {e}")
+                return None
+            logger.warning(f"Failed to watch {root}, polling files instead: {e}")
+
+    watcher = PollingWatcher(root, poll_interval)
+    watcher.start()
+    return watcher
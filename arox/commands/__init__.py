@@ -2,7 +2,6 @@ import json
 import logging
 import re
 
-import yaml
 from prompt_toolkit.completion import Completer, Completion
 
 logger = logging.getLogger(__name__)
@@ -218,6 +217,8 @@ class ListToolCommand(Command):
             print("No tools registered.")
             return
 
+        import yaml
+
         print("Registered Tools:")
         print(yaml.safe_dump(tool_specs))
 
@@ -240,6 +241,43 @@ class InfoCommand(Command):
         else:
             print("\nNo chat files currently loaded.")
 
+        project_manager = getattr(self.agent.state, "project_manager", None)
+        if project_manager:
+            print(f"\nRepo map: {project_manager.repo_map_status()}")
+            if project_manager.last_metrics is not None:
+                print(f"Last map {project_manager.last_metrics.summary()}")
+        cache_stats = project_manager.cache_stats() if project_manager else None
+        if cache_stats:
+            print("\nRepo map cache hits:")
+            for layer, stats in cache_stats.items():
+                hits = stats.get("hits", 0)
+                total = hits + stats.get("misses", 0)
+                line = f"  - {layer}: {hits}/{total}"
+                if total:
+                    line += f" ({hits / total:.0%})"
+                if stats.get("evictions"):
+                    line += f", {stats['evictions']} evicted"
+                print(line)
+
+
+class RepoMapCommand(Command):
+    command = "map"
+    description = "Show the repo map build, or cancel it - /map [cancel]"
+
+    def execute(self, name: str, arg: str):
+        project_manager = getattr(self.agent.state, "project_manager", None)
+        if not project_manager:
+            print("No repo map.")
+            return
+        if arg.strip() == "cancel":
+            if not project_manager.building:
+                print("No repo map build running.")
+                return
+            project_manager.cancel_repo_map()
+            print("Cancelling the repo map build, the last map is used meanwhile.")
+            return
+        print(f"Repo map: {project_manager.repo_map_status()}")
+
 
 class ResetCommand(Command):
     command = "reset"
@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import logging
 import sys
+import time
 from pathlib import Path
 
 from kissllm.tools import LocalToolManager
@@ -15,6 +16,7 @@ from arox.compose.git_commit import GitCommitAgent
 from arox.config import TomlConfigParser
 from arox.tools import file_edit, search_reading
 from arox.utils import run_command, user_input_generator
+from arox.utils.importtime import format_import_time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,7 +31,13 @@ class CoderComposer:
             help="Dump default config to specified file and exit.",
             default="",
         )
+        parser.add_argument(
+            "--profile-startup",
+            help="Print the import time of each package and the setup time.",
+            action="store_true",
+        )
         args, unknown_args = parser.parse_known_args()
+        self.profile_startup = args.profile_startup
         cli_configs = config.parse_dot_config(unknown_args)
 
         default_agent_config = Path(__file__).parent / "config.toml"
@@ -66,6 +74,9 @@ class CoderComposer:
         )
         sr_tool = search_reading.SearchReading(coder_agent.state)
         sr_tool.register_tools(local_tool_manager)
+        file_edit_tool.add_edit_listener(coder_agent.state.project_manager.file_edited)
+        # Committing changes the blob ids of files, rebuild while the LLM runs
+        git_commit_agent.add_commit_listener(coder_agent.state.prewarm_repo_map)
 
         coder_commands = [
             commands.FileCommand(coder_agent),
@@ -74,6 +85,7 @@ class CoderComposer:
             commands.ListToolCommand(coder_agent),
             commands.ResetCommand(coder_agent),
             commands.InfoCommand(coder_agent),
+            commands.RepoMapCommand(coder_agent),
             commands.CommitCommand(coder_agent),
         ]
         coder_agent.register_commands(coder_commands)
@@ -108,6 +120,8 @@ class CoderComposer:
 
     async def run(self):
         logger.debug("Starting coder agent")
+        # Warm up the repo map while the user types the first prompt
+        self.coder_agent.state.prewarm_repo_map()
         await self.coder_agent.start(
             user_input_generator(
                 completer=CommandCompleter(self.coder_agent.command_manager)
@@ -116,7 +130,13 @@ class CoderComposer:
 
 
 def main():
-    asyncio.run(CoderComposer().run())
+    start = time.perf_counter()
+    composer = CoderComposer()
+    if composer.profile_startup:
+        setup_time = time.perf_counter() - start
+        print(format_import_time("arox.compose.coder.main"))
+        print(f"Set up the agents in {setup_time:.2f}s")
+    asyncio.run(composer.run())
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@ import logging
 
 from arox.agent_patterns.state import SimpleState
 from arox.codebase import project
+from arox.config import get_context_window
+from arox.utils.tokens import get_token_counter
 
 logger = logging.getLogger(__name__)
 
@@ -9,8 +11,76 @@ logger = logging.getLogger(__name__)
 class CoderState(SimpleState):
     def __init__(self, agent):
         super().__init__(agent)
-        self.project_manager = project.ProjectManager(self.workspace)
+        if self.agent.agent_config.get("repo_map_daemon", False):
+            # Keeps the repo map warm across sessions. Needs Unix sockets.
+            from arox.codebase import daemon
+
+            manager_cls = daemon.RemoteProjectManager
+        else:
+            manager_cls = project.ProjectManager
+        self.project_manager = manager_cls(
+            self.workspace,
+            file_watcher=self.agent.agent_config.get("file_watcher", "auto"),
+            map_workers=self.agent.agent_config.get("repo_map_workers"),
+            global_tags_cache=self.agent.agent_config.get(
+                "repo_map_global_cache", False
+            ),
+            tree_context_cache_size=self.agent.agent_config.get(
+                "repo_map_tree_context_cache_size"
+            ),
+            tree_cache_size=self.agent.agent_config.get("repo_map_tree_cache_size"),
+            main_model=self.agent.provider_model,
+            map_tokens=self.agent.agent_config.get("repo_map_tokens"),
+            map_mul_no_files=self.agent.agent_config.get("repo_map_mul_no_files", 8),
+        )
         self.chat_files.set_candidate_generator(self.project_manager.get_tracked_files)
+        # Repo map built by prepare_prompt, for the next _get_message_items
+        self.prepared_repo_map = None
+        self.repo_map_prepared = False
+
+    def wants_repo_map(self):
+        return self.agent.agent_config.get("repo_map") and not self.message_meta.get(
+            "repo_map"
+        )
+
+    def prewarm_repo_map(self, *args):
+        """Start building the repo map in the background, so that it is ready
+        by the next prompt. Takes and ignores listener arguments.
+
+        Nothing is built once the map was sent, as it isn't sent again.
+        """
+        if self.wants_repo_map() and self.agent.agent_config.get(
+            "repo_map_prewarm", True
+        ):
+            self.project_manager.start_repo_map(
+                self.chat_files.list(), self.repo_map_tokens()
+            )
+
+    def repo_map_tokens(self):
+        """Return the budget of the repo map, for the context window of the
+        current model and the size of the conversation so far."""
+        max_context_window = get_context_window(
+            self.agent.provider_model,
+            self.agent.agent_config.get("max_context_window"),
+        )
+        # Counts are cached per message, only new ones are tokenized
+        token_counter = get_token_counter(self.agent.provider_model)
+        conversation_tokens = sum(
+            token_counter.count(str(m.get("content") or "")) for m in self.messages
+        )
+        return self.project_manager.get_map_tokens(
+            self.chat_files.list(), conversation_tokens, max_context_window
+        )
+
+    async def prepare_prompt(self, user_input):
+        await super().prepare_prompt(user_input)
+        if self.wants_repo_map():
+            self.prepared_repo_map = await self.project_manager.get_repo_map_async(
+                self.chat_files.list(),
+                self.repo_map_tokens(),
+                timeout=self.agent.agent_config.get("repo_map_timeout"),
+            )
+            self.repo_map_prepared = True
 
     def _get_message_items(self, user_input):
         items = super()._get_message_items(user_input)
@@ -18,13 +88,27 @@ class CoderState(SimpleState):
             insert_index = 1
         else:
             insert_index = 0
-        if self.agent.agent_config.get("repo_map") and not self.message_meta.get(
-            "repo_map"
-        ):
-            chat_files = self.chat_files.list()
-            repo_map = self.project_manager.get_repo_map(chat_files)
-            items.insert(insert_index, ("repo_map", repo_map))
-            self.message_meta["repo_map"] = True
+        if self.wants_repo_map():
+            if self.repo_map_prepared:
+                repo_map = self.prepared_repo_map
+                self.prepared_repo_map = None
+                self.repo_map_prepared = False
+            elif self.project_manager.building:
+                # Don't block the event loop, try again with the next message
+                repo_map = None
+            else:
+                # Reached without prepare_prompt, e.g. after a tool call. The
+                # map isn't built here on the event loop: the last one is
+                # sent, or one is started for the next message.
+                repo_map = self.project_manager.last_good_map
+                if repo_map is None:
+                    self.project_manager.start_repo_map(
+                        self.chat_files.list(), self.repo_map_tokens()
+                    )
+            # None if the map wasn't ready in time
+            if repo_map is not None:
+                items.insert(insert_index, ("repo_map", repo_map))
+                self.message_meta["repo_map"] = True
         if not self.message_meta.get("file_list"):
             file_list = "\n".join(self.project_manager.get_tracked_files())
             items.insert(insert_index, ("file_list", file_list))
@@ -1,9 +1,10 @@
+import logging
 from typing import Optional
 
-import git
-
 from arox.agent_patterns.llm_base import LLMBaseAgent
 
+logger = logging.getLogger(__name__)
+
 
 class GitCommitAgent(LLMBaseAgent):
     """
@@ -12,6 +13,11 @@ class GitCommitAgent(LLMBaseAgent):
 
     def __init__(self, name: str, config_parser=None, local_tool_manager=None):
         super().__init__(name, config_parser, local_tool_manager)
+        self.commit_listeners = []
+
+    def add_commit_listener(self, listener):
+        """Call `listener(commit)` after each commit."""
+        self.commit_listeners.append(listener)
 
     async def generate_commit_message(self, diff: Optional[str] = None) -> str:
         """
@@ -24,6 +30,8 @@ class GitCommitAgent(LLMBaseAgent):
             str: The generated commit message.
         """
         if diff is None:
+            import git
+
             # Fetch the current changes using git diff
             try:
                 repo = git.Repo(search_parent_directories=True)
@@ -66,6 +74,8 @@ class GitCommitAgent(LLMBaseAgent):
         if message is None:
             message = await self.generate_commit_message()
 
+        import git
+
         try:
             repo = git.Repo(search_parent_directories=True)
 
@@ -75,6 +85,11 @@ class GitCommitAgent(LLMBaseAgent):
             else:
                 commit = repo.index.commit(message)
 
+            for listener in self.commit_listeners:
+                try:
+                    listener(commit)
+                except Exception:
+                    logger.exception(f"Commit listener failed for {commit.hexsha}")
             return f"Committed {commit.hexsha}"
         except git.InvalidGitRepositoryError:
             return "Error: Not a git repository"
@@ -89,6 +104,8 @@ class GitCommitAgent(LLMBaseAgent):
         Returns:
             str: The output of the git commit command or an error message.
         """
+        import git
+
         try:
             repo = git.Repo(search_parent_directories=True)
 
@@ -5,6 +5,50 @@ import tomli
 
 from arox.utils import deep_merge
 
+# Context windows of known model families, matched by the longest prefix of the
+# model name without its provider. The max_context_window option of an agent
+# takes precedence.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 400000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+    "claude": 200000,
+    "gemini": 1048576,
+    "deepseek": 128000,
+    "mistral-large": 128000,
+    "llama-3.1": 128000,
+    "llama-3.3": 128000,
+}
+
+
+def get_context_window(model, configured=None) -> Optional[int]:
+    """Return the context window of `model` in tokens, None if unknown.
+
+    `configured` is the max_context_window option: a number of tokens, or a
+    table of them keyed by model name or by prefix of the name without its
+    provider, overriding MODEL_CONTEXT_WINDOWS.
+    """
+    if configured is not None and not isinstance(configured, dict):
+        return configured
+    if not model:
+        return None
+    configured = configured or {}
+    if model in configured:
+        return configured[model]
+    windows = {**MODEL_CONTEXT_WINDOWS, **configured}
+    # Providers prefix the model name, e.g. "openai/gpt-4o"
+    name = model.rsplit("/", 1)[-1].lower()
+    prefixes = [prefix for prefix in windows if name.startswith(prefix.lower())]
+    if not prefixes:
+        return None
+    return windows[max(prefixes, key=len)]
+
 
 def parse_dot_config(cli_args: list[str]) -> dict:
     """Parse arbitrary configs in dot notation to a nested dictionary.
@@ -4,6 +4,7 @@ from pathlib import Path
 
 from arox.agent_patterns.llm_base import LLMBaseAgent
 from arox.utils import xml_wrap
+from arox.utils.text_edit import text_edit
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +12,34 @@ logger = logging.getLogger(__name__)
 class FileEdit:
     def __init__(self, diff_agent: LLMBaseAgent):
         self.diff_agent = diff_agent
+        self.edit_listeners = []
+
+    def add_edit_listener(self, listener):
+        """Call `listener(path, old_content, new_content, edits)` after each
+        change to a file.
+
+        `old_content` is None for new files and ones that aren't UTF-8 text,
+        `edits` is the list of TextEdit
+        turning `old_content` into `new_content`, or None if unknown.
+        """
+        self.edit_listeners.append(listener)
+
+    def _old_content(self, file_path):
+        """Return the content of `file_path` for the listeners, None if there
+        are none or it can't be read as text."""
+        if not self.edit_listeners or not file_path.exists():
+            return None
+        try:
+            return file_path.read_text()
+        except (UnicodeDecodeError, OSError):
+            return None
+
+    def _notify_edit(self, path, old_content, new_content, edits):
+        for listener in self.edit_listeners:
+            try:
+                listener(path, old_content, new_content, edits)
+            except Exception:
+                logger.exception(f"Edit listener failed for {path}")
 
     def register_tools(self, manager):
         manager.register(self.write_to_file)
@@ -57,10 +86,12 @@ class FileEdit:
         try:
             file_path = Path(path)
             file_path.parent.mkdir(parents=True, exist_ok=True)
+            original_content = self._old_content(file_path)
             if self._match_placeholder(content):
                 original_content = file_path.read_text()
                 content = await self._apply_smart_diff(original_content, content)
             file_path.write_text(content)
+            self._notify_edit(file_path, original_content, content, None)
             return f"Successfully wrote to {file_path}"
         except Exception as e:
             return f"Error writing to file: {str(e)}"
@@ -105,6 +136,7 @@ class FileEdit:
 
             orig_content = file_path.read_text()
             content = orig_content
+            edits = []
 
             diff_lines = diff.splitlines()
             s_start = s_end = r_start = r_end = 0
@@ -119,6 +151,7 @@ class FileEdit:
                     if not all([s_start, s_end, r_start, r_end]):
                         # Indicates incorrect format
                         content = await self._apply_smart_diff(orig_content, diff)
+                        edits = None
                         break
 
                     search_part = "\n".join(diff_lines[s_start:s_end])
@@ -129,16 +162,19 @@ class FileEdit:
                     m, start_pos, end_pos = self._find_with_placeholder(
                         content, search_part
                     )
-                    if m:
-                        content = content[:start_pos] + replace_part + content[end_pos:]
-                    else:
-                        if search_part in content:
-                            content = content.replace(search_part, replace_part, 1)
-                        else:
-                            content = await self._apply_smart_diff(orig_content, diff)
-                            break
+                    if not m:
+                        start_pos = content.find(search_part)
+                        end_pos = start_pos + len(search_part)
+                    if start_pos == -1:
+                        content = await self._apply_smart_diff(orig_content, diff)
+                        edits = None
+                        break
+
+                    edits.append(text_edit(content, start_pos, end_pos, replace_part))
+                    content = content[:start_pos] + replace_part + content[end_pos:]
 
             file_path.write_text(content)
+            self._notify_edit(file_path, orig_content, content, edits)
             return f"Successfully updated {file_path}"
         except Exception as e:
             return f"Error replacing in file: {str(e)}"
@@ -1,10 +1,3 @@
-import yaml
-from prompt_toolkit import PromptSession
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.key_binding.key_bindings import KeyBindings
-
-
 def deep_merge(source, overrides):
     """Deep merge two dictionaries, with overrides taking precedence"""
     for key, value in overrides.items():
@@ -19,11 +12,18 @@ def parse_dict(value: str) -> dict:
     """Parse a string of key=value pairs into a dictionary"""
     if not value.strip():
         return {}
+    import yaml
+
     return dict(yaml.safe_load(value))
 
 
 async def user_input_generator(completer=None, input=None, output=None):
     """Async generator that yields user input"""
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.key_binding.key_bindings import KeyBindings
+
     history = FileHistory(".arox_history")
     kb = KeyBindings()
 
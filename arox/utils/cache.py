@@ -0,0 +1,58 @@
+import sys
+from collections import Counter, OrderedDict
+
+
+class LRUCache:
+    """A mapping bounded by the total size of its values.
+
+    Past `max_size`, the least recently used entries are evicted. `sizeof`
+    returns the size of a value, its memory footprint in bytes by default.
+    Hits, misses and evictions are counted in `stats`.
+    """
+
+    def __init__(self, max_size, sizeof=sys.getsizeof, stats=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.stats = Counter() if stats is None else stats
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _key, (_value, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.stats["evictions"] += 1
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
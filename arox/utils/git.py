@@ -1,18 +1,48 @@
+import hashlib
 import logging
 import os
 import subprocess
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Generator, Optional
+from typing import TYPE_CHECKING, Any, Dict, Generator, Optional
 from urllib.parse import urlparse
 
-import git
+if TYPE_CHECKING:
+    import git
 
 logger = logging.getLogger(__name__)
 
 # Default directory to store cloned repositories
 DEFAULT_CLONE_DIR = Path.home() / ".cache" / "arox" / "mcp_clones"
 
+# Index modes of regular files. Symlinks and submodules have other modes.
+REGULAR_FILE_MODES = ("100644", "100755")
+
+
+def git_blob_id(data: bytes) -> str:
+    """Return the id git gives to a blob with `data` as content."""
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def get_index_blob_ids(repo: "git.Repo") -> Dict[str, str]:
+    """Return the blob id of each tracked regular file whose work tree content
+    matches the index, keyed by its path relative to the repository root."""
+    blob_ids = {}
+    for entry in repo.git.ls_files("-s", "-z").split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        mode, blob_id, _stage = info.split()
+        if mode in REGULAR_FILE_MODES:
+            blob_ids[path] = blob_id
+
+    # Files that differ from the index, as git sees it from its stat cache
+    for path in repo.git.diff_files("--name-only", "-z").split("\0"):
+        blob_ids.pop(path, None)
+
+    return blob_ids
+
 
 def get_repo_name_from_url(url: str) -> str:
     """Extracts a repository name from a Git URL."""
@@ -109,6 +139,8 @@ def clone_or_update_repo(
         RuntimeError: If git commands fail.
         ImportError: If gitpython is not installed.
     """
+    import git
+
     if target_base_dir is None:
         target_base_dir = DEFAULT_CLONE_DIR
 
@@ -0,0 +1,52 @@
+"""Import time breakdown of a module, as reported by `python -X importtime`."""
+
+import subprocess
+import sys
+from collections import Counter
+
+# Packages of arox are reported separately, other ones as a whole
+OWN_PACKAGE = "arox"
+
+
+def measure_import_time(module):
+    """Import `module` in a new interpreter, and return the (name, self us,
+    cumulative us) of every module it imported, in import order."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # The header
+            continue
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def package_of(name):
+    parts = name.split(".")
+    if parts[0] == OWN_PACKAGE:
+        return ".".join(parts[:2])
+    return parts[0]
+
+
+def format_import_time(module, top=15):
+    """Return the import time of `module`, and the share of the packages
+    taking the most of it."""
+    rows = measure_import_time(module)
+    if not rows:
+        return f"Failed to import {module}"
+    total = sum(self_us for _name, self_us, _cumulative_us in rows)
+    by_package = Counter()
+    for name, self_us, _cumulative_us in rows:
+        by_package[package_of(name)] += self_us
+
+    lines = [f"Importing {module} took {total / 1000:.0f}ms:"]
+    for package, us in by_package.most_common(top):
+        lines.append(f"  {package:<32} {us / 1000:7.1f}ms {us / total:4.0%}")
+    return "\n".join(lines)
@@ -1,6 +1,72 @@
+import mmap
+import os
+import threading
+
+from arox.utils.cache import LRUCache
+
+# Default memory budget of the content store, in bytes.
+CONTENT_STORE_SIZE = 64 * 2**20
+
+# Files at least this large are decoded straight from a memory map, without
+# first reading them into a bytes buffer.
+MMAP_THRESHOLD = 2**20
+
+
 def read_text(filepath):
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             return f.read()
     except UnicodeDecodeError:
         return None
+
+
+class ContentStore:
+    """Decoded file contents, read once per version of each file.
+
+    Entries are validated by the mtime and size of the file, and evicted least
+    recently used first past `max_size` bytes. Like `read_text`, contents are
+    decoded as UTF-8 with universal newlines, and None is returned for files
+    that aren't valid UTF-8.
+    """
+
+    def __init__(self, max_size=CONTENT_STORE_SIZE, mmap_threshold=MMAP_THRESHOLD):
+        self.mmap_threshold = mmap_threshold
+        self.cache = LRUCache(max_size)
+        # Held around the cache, which map builds running in a thread and
+        # the event loop both use. Files are read without it.
+        self._lock = threading.Lock()
+
+    def read_text(self, filepath):
+        """Return the content of `filepath`. Raises OSError if it can't be
+        read."""
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            content = self.cache.get(key)
+        if content is None:
+            try:
+                content = self._read(path, st.st_size)
+            except UnicodeDecodeError:
+                return None
+            with self._lock:
+                self.cache[key] = content
+        return content
+
+    def _read(self, path, size):
+        with open(path, "rb") as f:
+            if size >= self.mmap_threshold:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    content = str(data, "utf-8")
+            else:
+                content = f.read().decode("utf-8")
+
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        return content
+
+
+# Shared by everything reading source files in the process, so a file used by
+# both the repo map and the chat is only read once.
+content_store = ContentStore()
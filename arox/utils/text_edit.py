@@ -0,0 +1,32 @@
+"""Replacements in text files, as tree-sitter's Tree.edit takes them."""
+
+from collections import namedtuple
+
+# One replacement in a file, in UTF-8 byte offsets and (row, column) points, as
+# tree-sitter's Tree.edit takes it.
+TextEdit = namedtuple(
+    "TextEdit",
+    "start_byte old_end_byte new_end_byte start_point old_end_point new_end_point",
+)
+
+
+def _position(text: str) -> tuple[int, tuple[int, int]]:
+    """Return the byte offset and point of the end of `text`."""
+    line_start = text.rfind("\n") + 1
+    column = len(text[line_start:].encode())
+    return len(text.encode()), (text.count("\n"), column)
+
+
+def text_edit(content: str, start: int, end: int, replacement: str) -> TextEdit:
+    """Return the TextEdit replacing content[start:end] with `replacement`."""
+    start_byte, start_point = _position(content[:start])
+    old_end_byte, old_end_point = _position(content[:end])
+    new_end_byte, new_end_point = _position(content[:start] + replacement)
+    return TextEdit(
+        start_byte,
+        old_end_byte,
+        new_end_byte,
+        start_point,
+        old_end_point,
+        new_end_point,
+    )
@@ -0,0 +1,165 @@
+"""Token counting.
+
+`TokenCounter` counts tokens with the tokenizer of the model when tiktoken is
+installed (the `tokens` extra) and knows the model. The texts it tokenizes
+calibrate a ratio of chars per token for each kind of text (e.g. the language
+of a source file), from which long texts of a calibrated kind are estimated
+rather than tokenized. Without a tokenizer, every count is estimated from a
+default ratio.
+"""
+
+import logging
+import random
+import threading
+
+from arox.utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Chars per token of ASCII text until calibrated, measured on source code.
+CHARS_PER_TOKEN = 4.0
+
+# Tokens per non-ASCII char, e.g. in CJK comments. Such chars are rarely
+# merged with others.
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+
+# Texts longer than this many chars are estimated, from the calibrated ratio
+# of their kind or else from a sample of their lines.
+SAMPLE_THRESHOLD = 20000
+SAMPLE_LINES = 200
+
+# ASCII chars a kind of text must have had tokenized before its ratio is used.
+CALIBRATION_CHARS = 2**16
+
+# Total chars of the texts whose count is cached, per TokenCounter.
+TOKEN_CACHE_CHARS = 2**26
+
+
+def get_encoding(model):
+    """Return the tiktoken encoding of `model`, or None if it isn't available
+    locally."""
+    if not model:
+        return None
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    # Providers prefix the model name, e.g. "openai/gpt-4o"
+    name = model.rsplit("/", 1)[-1]
+    try:
+        return tiktoken.encoding_for_model(name)
+    except (KeyError, ValueError):
+        # Unknown model
+        return None
+    except OSError as e:
+        # The encoding is downloaded on first use
+        logger.warning(f"Failed to load the tokenizer of {model}: {e}")
+        return None
+
+
+def non_ascii_chars(text):
+    """Return about how many chars of `text` aren't ASCII."""
+    if text.isascii():
+        return 0
+    # They take 2 to 4 bytes in UTF-8, 3 for CJK
+    return (len(text.encode("utf-8", "surrogatepass")) - len(text)) // 2
+
+
+class TokenCounter:
+    """Counts the tokens of texts for one model, caching the count of each
+    text."""
+
+    def __init__(self, model=None, cache_size=TOKEN_CACHE_CHARS):
+        self.model = model
+        self.encoding = get_encoding(model)
+        # (text, kind) -> (tokens, chars), keyed by the text itself so that
+        # texts with the same hash don't share a count
+        self.cache = LRUCache(cache_size, sizeof=lambda entry: entry[1])
+        # Counters are shared by map builds running in a thread
+        self._lock = threading.Lock()
+        # kind -> [ASCII chars, tokens] of the texts tokenized
+        self.samples = {}
+
+    @property
+    def exact(self):
+        """Whether counts come from the tokenizer of the model."""
+        return self.encoding is not None
+
+    def count(self, text, kind=None):
+        """Return the number of tokens of `text`.
+
+        `kind` groups texts with a similar ratio of chars per token, e.g. the
+        language of a source file.
+        """
+        if not text:
+            return 0
+        key = (text, kind)
+        with self._lock:
+            entry = self.cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if self.encoding is None:
+            num_tokens = self.estimate(text, kind)
+        elif len(text) <= SAMPLE_THRESHOLD:
+            num_tokens = self.tokenize(text, kind)
+        elif self.calibrated(kind):
+            num_tokens = self.estimate(text, kind)
+        else:
+            num_tokens = self.count_sampled(text, kind)
+        with self._lock:
+            self.cache[key] = (num_tokens, len(text))
+        return num_tokens
+
+    def estimate(self, text, kind=None):
+        """Return the estimated number of tokens of `text`."""
+        non_ascii = non_ascii_chars(text)
+        ascii_tokens = (len(text) - non_ascii) / self.chars_per_token(kind)
+        return int(ascii_tokens + non_ascii * NON_ASCII_TOKENS_PER_CHAR)
+
+    def calibrated(self, kind=None):
+        """Whether enough texts of `kind` were tokenized to estimate others."""
+        with self._lock:
+            sample = self.samples.get(kind)
+            return sample is not None and sample[0] >= CALIBRATION_CHARS
+
+    def chars_per_token(self, kind=None):
+        """Return the chars per token of ASCII text of `kind`."""
+        with self._lock:
+            sample = self.samples.get(kind)
+            if not sample or not sample[1]:
+                return CHARS_PER_TOKEN
+            return sample[0] / sample[1]
+
+    def tokenize(self, text, kind=None):
+        """Count the tokens of `text` with the tokenizer, and calibrate the
+        ratio of `kind` from it."""
+        num_tokens = len(self.encoding.encode(text, disallowed_special=()))
+        non_ascii = non_ascii_chars(text)
+        ascii_tokens = num_tokens - non_ascii * NON_ASCII_TOKENS_PER_CHAR
+        if ascii_tokens > 0:
+            with self._lock:
+                sample = self.samples.setdefault(kind, [0, 0])
+                sample[0] += len(text) - non_ascii
+                sample[1] += ascii_tokens
+        return num_tokens
+
+    def count_sampled(self, text, kind=None):
+        """Extrapolate the tokens of `text` from a sample of its lines."""
+        lines = text.splitlines(keepends=True)
+        if len(lines) <= SAMPLE_LINES:
+            return self.tokenize(text, kind)
+        # Seeded by the text, so that counting it again gives the same result
+        sample = "".join(random.Random(len(text)).sample(lines, SAMPLE_LINES))
+        return int(self.tokenize(sample, kind) * len(text) / len(sample))
+
+
+# One counter per model, shared by the repo map and the conversation
+_token_counters: dict[str | None, TokenCounter] = {}
+
+
+def get_token_counter(model=None) -> TokenCounter:
+    counter = _token_counters.get(model)
+    if counter is None:
+        counter = _token_counters[model] = TokenCounter(model)
+    return counter
@@ -0,0 +1,288 @@
+"""Time the phases of a RepoMap build, on synthetic repos or a local checkout.
+
+Synthetic repos mix Python, JavaScript and Go files, each defining `--defs`
+functions that each call `--refs` others, picked with a skew so that a few
+functions are called from everywhere. For each repo, reports as JSON the best
+time of each phase over `--repeat` runs, each with an empty tags cache:
+
+- cold_scan: extracting the tags of every file and writing the tags cache
+- warm_scan: reading them back from the tags cache in a new RepoMap
+- graph: building the tag graph
+- pagerank: ranking it
+- budgeting: selecting the ranked tags that fit in `--map-tokens`
+- render: rendering them
+
+along with the peak RSS of the process, and of the tags extraction workers.
+Each repo is benchmarked in its own process, so peaks aren't carried over.
+
+    python -m benchmarks.repomap [--files 1000 10000 100000] [--output FILE]
+    python -m benchmarks.repomap --repo PATH
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from arox.codebase import repomap
+from arox.codebase.ranking import RankedTags, TagGraph, get_rank_backend
+
+LANGUAGES = ("python", "javascript", "go")
+
+# Synthetic files per directory
+FILES_PER_DIR = 100
+
+# Chat files of the benchmarked map, their definitions are left out of it
+CHAT_FILES = 3
+
+
+def python_source(index, defs, calls):
+    lines = [f"class Module{index}:"]
+    for name, refs in zip(defs, calls):
+        lines += [f"    def {name}(self, x):", "        y = x"]
+        lines += [f"        y = {ref}(y)" for ref in refs]
+        lines += ["        return y", ""]
+    return "\n".join(lines)
+
+
+def javascript_source(index, defs, calls):
+    lines = [f"export class Module{index} {{"]
+    for name, refs in zip(defs, calls):
+        lines += [f"  {name}(x) {{", "    let y = x;"]
+        lines += [f"    y = {ref}(y);" for ref in refs]
+        lines += ["    return y;", "  }", ""]
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def go_source(index, defs, calls):
+    lines = [f"package pkg{index // FILES_PER_DIR}", ""]
+    for name, refs in zip(defs, calls):
+        lines += [f"func {name}(x int) int {{", "\ty := x"]
+        lines += [f"\ty = {ref}(y)" for ref in refs]
+        lines += ["\treturn y", "}", ""]
+    return "\n".join(lines)
+
+
+SOURCES = {
+    "python": (".py", python_source),
+    "javascript": (".js", javascript_source),
+    "go": (".go", go_source),
+}
+
+
+def generate_repo(root, num_files, defs=5, refs=4, languages=LANGUAGES, seed=0):
+    """Write `num_files` source files under `root`, and return their paths."""
+    rng = random.Random(seed)
+    num_names = num_files * defs
+    fnames = []
+    for index in range(num_files):
+        lang = languages[index % len(languages)]
+        ext, source = SOURCES[lang]
+        names = [f"func_{index * defs + i}" for i in range(defs)]
+        # Cubing a uniform sample skews calls towards the first functions
+        calls = [
+            [f"func_{int(num_names * rng.random() ** 3)}" for _ in range(refs)]
+            for _ in names
+        ]
+        fname = Path(root) / f"pkg{index // FILES_PER_DIR}" / f"mod{index}{ext}"
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        fname.write_text(source(index, names, calls))
+        fnames.append(str(fname))
+    return fnames
+
+
+def list_checkout(root):
+    """Return the files of a checkout, tracked ones if it is a git repo."""
+    try:
+        out = subprocess.run(
+            ["git", "ls-files", "-z"],
+            cwd=root,
+            capture_output=True,
+            check=True,
+        ).stdout
+        rel_fnames = [f for f in out.decode("utf-8").split("\0") if f]
+    except (OSError, subprocess.CalledProcessError):
+        return [f for f in repomap.find_src_files(root) if "/." not in f[len(root) :]]
+    return [os.path.join(root, f) for f in rel_fnames]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def build(root, fnames, cache_dir, args):
+    """Build the map of `fnames` once, and return the time of each phase."""
+    # An absolute cache dir, to keep it out of checkouts
+    repo_map_cls = type(
+        "BenchRepoMap", (repomap.RepoMap,), {"TAGS_CACHE_DIR": cache_dir}
+    )
+
+    def new_repo_map():
+        return repo_map_cls(
+            root=root, map_workers=args.workers, rank_backend=args.rank_backend
+        )
+
+    rm = new_repo_map()
+    files = [(fname, rm.get_rel_fname(fname)) for fname in fnames]
+    versions = {fname: rm.get_file_version(fname, rel) for fname, rel in files}
+    files = [(fname, rel) for fname, rel in files if versions[fname] is not None]
+    chat_rel_fnames = set(rel for _fname, rel in files[:CHAT_FILES])
+
+    times = {}
+
+    @contextlib.contextmanager
+    def phase(name):
+        start = time.perf_counter()
+        yield
+        times[name] = time.perf_counter() - start
+
+    with phase("cold_scan"):
+        rm.get_tags_bulk(files, versions=versions)
+    rm.TAGS_CACHE.close()
+
+    rm = new_repo_map()
+    with phase("warm_scan"):
+        all_tags = rm.get_tags_bulk(files, versions=versions)
+
+    with phase("graph"):
+        tag_graph = TagGraph()
+        for fname, rel_fname in files:
+            tag_graph.update_file(rel_fname, versions[fname], all_tags[fname])
+        graph = tag_graph.rank_graph()
+
+    with phase("pagerank"):
+        personalization = {rel: 100 / len(files) for rel in chat_rel_fnames}
+        rank = get_rank_backend(args.rank_backend)
+        try:
+            ranked, ranked_definitions = rank(graph, personalization)
+        except ZeroDivisionError:
+            # As in RepoMap.get_ranked_tags, when no chat file is in the graph
+            ranked, ranked_definitions = rank(graph)
+
+    with phase("budgeting"):
+        ranked_tags = RankedTags(
+            ranked,
+            ranked_definitions,
+            tag_graph.definitions,
+            chat_rel_fnames,
+            set(rel for _fname, rel in files) - chat_rel_fnames,
+        )
+        num_tags = rm.budget_ranked_tags(ranked_tags, chat_rel_fnames, args.map_tokens)
+
+    with phase("render"):
+        tree = rm.to_tree(ranked_tags[:num_tags], chat_rel_fnames)
+    rm.TAGS_CACHE.close()
+
+    stats = {
+        "files": len(files),
+        "tags": sum(len(tags) for tags in all_tags.values()),
+        "graph_edges": sum(1 for _ in graph.edges()),
+        "map_tags": num_tags,
+        "map_tokens": rm.token_count(tree),
+    }
+    return times, stats
+
+
+def run(repo, args):
+    """Benchmark the map of a checkout, or of a synthetic repo if `repo` is a
+    number of files."""
+    # The scan prints progress, which must not mix with the JSON output
+    with contextlib.redirect_stdout(sys.stderr), tempfile.TemporaryDirectory() as tmp:
+        if isinstance(repo, int):
+            root = os.path.join(tmp, "repo")
+            fnames = generate_repo(
+                root, repo, args.defs, args.refs, args.languages.split(",")
+            )
+        else:
+            root = str(Path(repo).absolute())
+            fnames = list_checkout(root)
+
+        best = {}
+        for i in range(args.repeat):
+            cache_dir = os.path.join(tmp, f"tags.cache.{i}")
+            times, stats = build(root, fnames, cache_dir, args)
+            for name, elapsed in times.items():
+                best[name] = min(best.get(name, elapsed), elapsed)
+
+    return {
+        "repo": repo if isinstance(repo, int) else root,
+        **stats,
+        "seconds": {name: round(elapsed, 4) for name, elapsed in best.items()},
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_workers_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def arox_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(repomap.__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", action="append", default=[], help="local checkout")
+    parser.add_argument("--files", type=int, nargs="+", default=None)
+    parser.add_argument("--defs", type=int, default=5, help="functions per file")
+    parser.add_argument("--refs", type=int, default=4, help="calls per function")
+    parser.add_argument("--languages", default=",".join(LANGUAGES))
+    parser.add_argument("--map-tokens", type=int, default=4096)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rank-backend", default="auto")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    repos = list(args.repo)
+    if args.files or not repos:
+        repos += args.files or [1000, 10000, 100000]
+
+    results = []
+    for repo in repos:
+        # A process per repo, for its peak RSS
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            result = executor.submit(run, repo, args).result()
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "arox_revision": arox_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
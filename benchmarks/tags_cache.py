@@ -0,0 +1,76 @@
+"""Warm load time of the RepoMap tags cache.
+
+Fills the tags cache of a temporary directory with synthetic entries, then
+compares reading them back one `Cache.get` per file against the batched
+`cache_get_many`, and times a warm `get_tags_bulk` on top of the latter.
+
+    python -m benchmarks.tags_cache [--files N] [--tags N] [--repeat N]
+"""
+
+import argparse
+import tempfile
+import time
+
+from arox.codebase import repomap
+from arox.codebase.tags import FileTags, Tag
+
+
+def make_record(index, num_tags):
+    tags = [
+        Tag("", "", line, f"name_{(index + line) % 997}", ("def", "ref")[line % 2])
+        for line in range(num_tags)
+    ]
+    return FileTags.from_tags("", "", tags).to_record()
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        rm = repomap.RepoMap(root=root, map_workers=1)
+        files = [(f"{root}/pkg/mod{i}.py", f"pkg/mod{i}.py") for i in range(args.files)]
+        versions = {fname: 1.0 for fname, _rel_fname in files}
+        rm.update_tags_cache(
+            {
+                fname: {"version": 1.0, "data": make_record(i, args.tags)}
+                for i, (fname, _rel_fname) in enumerate(files)
+            }
+        )
+        keys = [fname for fname, _rel_fname in files]
+
+        results = {
+            "per-key get": timed(
+                lambda: [rm.TAGS_CACHE.get(key) for key in keys], args.repeat
+            ),
+            "cache_get_many": timed(
+                lambda: repomap.cache_get_many(rm.TAGS_CACHE, keys), args.repeat
+            ),
+            "get_tags_bulk": timed(
+                lambda: rm.get_tags_bulk(files, versions=versions), args.repeat
+            ),
+        }
+        rm.TAGS_CACHE.close()
+
+    for label, elapsed in results.items():
+        print(
+            f"{label}: {args.files} files, {elapsed:.3f}s total, "
+            f"{elapsed / args.files * 1e6:.1f} us/file"
+        )
+
+
+if __name__ == "__main__":
+    main()
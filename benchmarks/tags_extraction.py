@@ -0,0 +1,55 @@
+"""Per-file cost of RepoMap tag extraction.
+
+Compares extracting tags with the per-process language registry (warm) against
+reloading the parser and recompiling the tags query for every file (cold),
+which is what get_tags_raw used to do.
+
+    python -m benchmarks.tags_extraction [directory] [--repeat N]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from arox.codebase import repomap
+
+
+def extract_all(fnames, root, cold):
+    start = time.perf_counter()
+    num_tags = 0
+    for fname in fnames:
+        if cold:
+            repomap._tags_languages.clear()
+        rel_fname = str(Path(fname).relative_to(root))
+        num_tags += sum(1 for _ in repomap.get_tags_raw(fname, rel_fname))
+    return time.perf_counter() - start, num_tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "directory", nargs="?", default=Path(repomap.__file__).parents[1]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = Path(args.directory).absolute()
+    fnames = [
+        f for f in repomap.find_src_files(str(root)) if "/." not in f[len(str(root)) :]
+    ]
+
+    # Load every language once so the warm runs don't pay for it.
+    extract_all(fnames, root, cold=False)
+
+    for label, cold in (("cold", True), ("warm", False)):
+        best, num_tags = min(
+            extract_all(fnames, root, cold) for _ in range(args.repeat)
+        )
+        print(
+            f"{label}: {len(fnames)} files, {num_tags} tags, "
+            f"{best:.3f}s total, {best / len(fnames) * 1000:.2f} ms/file"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+from arox.codebase import daemon
+
+
+@pytest.fixture(autouse=True)
+def runtime_dir(tmp_path_factory, monkeypatch):
+    # Holds the sockets, outside of the workspace
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path_factory.mktemp("run")))
+
+
+@pytest.fixture
+def server(workspace):
+    server = daemon.DaemonServer(workspace, idle_timeout=None)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),))
+    thread.start()
+    wait_for(workspace)
+    yield server
+    loop.call_soon_threadsafe(server.stop)
+    thread.join()
+    loop.close()
+
+
+def wait_for(workspace):
+    client = daemon.DaemonClient(daemon.socket_path(workspace))
+    for _ in range(100):
+        try:
+            return client.call("ping")
+        except OSError:
+            threading.Event().wait(0.05)
+    raise TimeoutError
+
+
+def test_remote_project_manager(server, workspace):
+    pm = daemon.RemoteProjectManager(workspace, start_daemon=False)
+    assert pm.local is None
+
+    assert pm.get_tracked_files() == ["a.py", "b.py"]
+    assert pm.repo_map_status() == "not built yet (daemon)"
+    repo_map = pm.get_repo_map([])
+    assert "def alpha" in repo_map
+    assert repo_map == server.project_manager.get_repo_map([])
+    assert pm.last_good_map == repo_map
+    assert pm.last_metrics.counts["files"] == 2
+    assert pm.cache_stats()
+
+    assert asyncio.run(pm.get_repo_map_async(["a.py"])) is not None
+    assert not pm.building
+
+    (workspace / "a.py").write_text("def beta():\n    return 2\n")
+    pm.file_edited(
+        "a.py", "def alpha():\n    return 1\n", "def beta():\n    return 2\n", None
+    )
+    assert "def beta" in pm.get_repo_map([])
+
+
+def test_falls_back_without_daemon(workspace):
+    pm = daemon.RemoteProjectManager(workspace, start_daemon=False)
+    assert pm.local is not None
+    assert pm.get_tracked_files() == ["a.py", "b.py"]
+    assert pm.repo_map_status() == "not built yet"
+
+
+def test_one_daemon_per_workspace(server, workspace):
+    assert not asyncio.run(daemon.DaemonServer(workspace).serve())
+    # The running one still answers
+    assert wait_for(workspace)["workspace"] == str(workspace)
+
+
+def test_refuses_shared_socket_dir(workspace):
+    path = daemon.socket_path(workspace)
+    path.parent.mkdir(parents=True)
+    path.parent.chmod(0o755)
+    assert daemon.connect(workspace, start=False) is None
+    with pytest.raises(daemon.DaemonError):
+        asyncio.run(daemon.DaemonServer(workspace).serve())
+
+
+def test_lock_does_not_follow_symlinks(workspace, tmp_path):
+    path = daemon.socket_path(workspace)
+    daemon.check_socket_dir(path)
+    target = tmp_path / "target"
+    path.with_suffix(".lock").symlink_to(target)
+    with pytest.raises(OSError):
+        asyncio.run(daemon.DaemonServer(workspace).serve())
+    assert not target.exists()
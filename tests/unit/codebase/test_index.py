@@ -0,0 +1,104 @@
+import base64
+import gzip
+import json
+import subprocess
+
+import pytest
+
+from arox.codebase import index, project
+
+
+def test_build_index(tmp_path, monkeypatch, make_checkout):
+    root = make_checkout(tmp_path / "repo")
+    monkeypatch.chdir(root)
+    metrics = index.build_index(root)
+    assert metrics.counts["files"] == 2
+    assert metrics.counts["parsed_files"] == 2
+
+    # Already cached
+    metrics = index.build_index(root)
+    assert metrics.counts["parsed_files"] == 0
+
+
+def test_export_import_index(tmp_path, monkeypatch, make_checkout):
+    artifact = tmp_path / "index.jsonl.gz"
+    ci = make_checkout(tmp_path / "ci")
+    monkeypatch.chdir(ci)
+    assert index.export_index(ci, artifact) == 2
+
+    clone = make_checkout(tmp_path / "clone")
+    (clone / "c.py").write_text("def gamma():\n    pass\n")
+    subprocess.run(["git", "add", "c.py"], cwd=clone, check=True)
+    monkeypatch.chdir(clone)
+    assert index.import_index(clone, artifact) == 2
+
+    # Only the file missing from the artifact is parsed
+    metrics = index.build_index(clone)
+    assert metrics.counts["parsed_files"] == 1
+    pm = project.ProjectManager(clone)
+    repo_map = pm.get_repo_map([])
+    assert "def alpha" in repo_map
+    assert "def gamma" in repo_map
+
+
+def test_import_index_matches_language(tmp_path, monkeypatch, make_checkout):
+    artifact = tmp_path / "index.jsonl.gz"
+    source = "function hello() {\n  return 1;\n}\n"
+    ci = make_checkout(tmp_path / "ci")
+    (ci / "util.ts").write_text(source)
+    subprocess.run(["git", "add", "util.ts"], cwd=ci, check=True)
+    monkeypatch.chdir(ci)
+    assert index.export_index(ci, artifact) == 3
+
+    # Same content, but another language
+    clone = make_checkout(tmp_path / "clone")
+    (clone / "util.js").write_text(source)
+    subprocess.run(["git", "add", "util.js"], cwd=clone, check=True)
+    monkeypatch.chdir(clone)
+    assert index.import_index(clone, artifact) == 2
+    assert "hello" in project.ProjectManager(clone).get_repo_map([])
+
+
+def test_import_index_checks_header(tmp_path, monkeypatch, make_checkout):
+    artifact = tmp_path / "index.jsonl.gz"
+    with gzip.open(artifact, "wt") as f:
+        f.write(json.dumps({**index.index_header(), "format": 0}) + "\n")
+    root = make_checkout(tmp_path / "repo")
+    monkeypatch.chdir(root)
+    with pytest.raises(ValueError):
+        index.import_index(root, artifact)
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        # A name id out of range
+        lambda names, name_ids, lines, kinds: ([], name_ids, lines, kinds),
+        # An unknown kind
+        lambda names, name_ids, lines, kinds: (names, name_ids, lines, b"\x02" * 2),
+        # Arrays of different lengths
+        lambda names, name_ids, lines, kinds: (names, name_ids, lines[4:], kinds),
+    ],
+)
+def test_import_index_checks_records(tmp_path, monkeypatch, make_checkout, corrupt):
+    artifact = tmp_path / "index.jsonl.gz"
+    ci = make_checkout(tmp_path / "ci")
+    monkeypatch.chdir(ci)
+    index.export_index(ci, artifact)
+    with gzip.open(artifact, "rt") as f:
+        header, *lines = f.read().splitlines()
+    with gzip.open(artifact, "wt") as f:
+        f.write(header + "\n")
+        for line in lines:
+            blob_id, lang, names, *arrays = json.loads(line)
+            arrays = [base64.b64decode(data) for data in arrays]
+            names, *arrays = corrupt(names, *arrays)
+            arrays = [base64.b64encode(data).decode() for data in arrays]
+            f.write(json.dumps([blob_id, lang, names, *arrays]) + "\n")
+
+    clone = make_checkout(tmp_path / "clone")
+    monkeypatch.chdir(clone)
+    with pytest.raises(ValueError):
+        index.import_index(clone, artifact)
+    # Nothing was imported
+    assert index.build_index(clone).counts["parsed_files"] == 2
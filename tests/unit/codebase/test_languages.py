@@ -0,0 +1,47 @@
+import pytest
+
+from arox.codebase.languages import shebang_lang
+from arox.codebase.repomap import get_language_table
+
+
+@pytest.mark.parametrize(
+    "fname, code, lang",
+    [
+        ("src/app.py", "", "python"),
+        ("lib.hpp", "", "cpp"),
+        ("Program.cs", "", "csharp"),
+        ("types.mli", "", "ocaml_interface"),
+        ("Rakefile", "", "ruby"),
+        ("README.md", "# Title\n", None),
+        ("data.json", "{}", None),
+        ("bin/tool", "#!/usr/bin/env python3\nprint()\n", "python"),
+        ("bin/other", "#!/bin/sh\necho\n", None),
+        # Claimed by several lexers, pygments looks at the content
+        ("util.h", "int add(int a, int b);\n", "c"),
+    ],
+)
+def test_get_lang(fname, code, lang):
+    assert get_language_table().get_lang(fname, code) == lang
+
+
+def test_get_lang_skips_pygments_for_known_names(monkeypatch):
+    import arox.codebase.languages as languages
+
+    def fail(*args):
+        raise AssertionError("pygments should not be used")
+
+    monkeypatch.setattr(languages, "guess_lang", fail)
+    assert get_language_table().get_lang("main.go", "package main\n") == "go"
+
+
+@pytest.mark.parametrize(
+    "code, lang",
+    [
+        ("#!/usr/bin/ruby", "ruby"),
+        ("#!/usr/bin/env -S node --harmony\n", "javascript"),
+        ("#!/usr/bin/env\n", None),
+        ("print()\n", None),
+    ],
+)
+def test_shebang_lang(code, lang):
+    assert shebang_lang(code) == lang
@@ -0,0 +1,162 @@
+import asyncio
+import subprocess
+import threading
+
+import pytest
+
+from arox.codebase import project, repomap
+
+
+@pytest.mark.asyncio
+async def test_get_repo_map_async(workspace):
+    pm = project.ProjectManager(workspace)
+    assert pm.repo_map_status() == "not built yet"
+    future = pm.start_repo_map([])
+    assert pm.start_repo_map([]) is future
+    assert pm.repo_map_status().startswith("building")
+    repo_map = await pm.get_repo_map_async([])
+    assert "def alpha" in repo_map
+    assert pm.last_good_map == repo_map
+    assert not pm.building
+    assert pm.repo_map_status().startswith("ready, built in")
+
+
+@pytest.mark.asyncio
+async def test_get_repo_map_async_timeout(workspace, monkeypatch):
+    pm = project.ProjectManager(workspace)
+    assert await pm.get_repo_map_async([]) is not None
+    good_map = pm.last_good_map
+
+    release = threading.Event()
+
+    def slow_map(*args, **kwargs):
+        release.wait()
+        return "new map"
+
+    monkeypatch.setattr(pm.repo_map, "get_repo_map", slow_map)
+    assert await pm.get_repo_map_async([], timeout=0.01) == good_map
+    assert pm.building
+
+    release.set()
+    assert await pm.start_repo_map([]) == "new map"
+    assert pm.last_good_map == "new map"
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(pm.repo_map, "get_repo_map", fail)
+    pm.update()
+    with pytest.raises(RuntimeError):
+        await pm.get_repo_map_async(["a.py"])
+
+
+@pytest.mark.asyncio
+async def test_cancel_repo_map(workspace, monkeypatch):
+    pm = project.ProjectManager(workspace)
+    rm = pm.repo_map
+    started = threading.Event()
+    get_ranked_tags = rm.get_ranked_tags
+
+    def wait_for_cancel(*args, **kwargs):
+        started.set()
+        rm.cancelled.wait()
+        return get_ranked_tags(*args, **kwargs)
+
+    monkeypatch.setattr(rm, "get_ranked_tags", wait_for_cancel)
+    future = pm.start_repo_map([])
+    await asyncio.to_thread(started.wait)
+    pm.cancel_repo_map()
+    with pytest.raises(repomap.MapBuildCancelled):
+        await future
+    assert pm.last_good_map is None
+    assert pm.repo_map_status() == "cancelled"
+    assert rm.build_progress is None
+
+
+@pytest.mark.asyncio
+async def test_cancel_repo_map_before_it_starts(workspace, monkeypatch):
+    pm = project.ProjectManager(workspace)
+    started = threading.Event()
+    release = threading.Event()
+    calcute_other_files = pm.calcute_other_files
+
+    def wait_for_release(*args):
+        started.set()
+        release.wait()
+        return calcute_other_files(*args)
+
+    # Cancelled while listing the files, before the repo map is built
+    monkeypatch.setattr(pm, "calcute_other_files", wait_for_release)
+    future = pm.start_repo_map([])
+    await asyncio.to_thread(started.wait)
+    pm.cancel_repo_map()
+    release.set()
+    with pytest.raises(repomap.MapBuildCancelled):
+        await future
+    assert pm.repo_map_status() == "cancelled"
+
+    # The next build isn't cancelled
+    assert "def alpha" in await pm.get_repo_map_async([])
+
+
+def test_tags_kept_once_staged(workspace):
+    (workspace / "a.py").write_text("def alpha():\n    return 2\n")
+    pm = project.ProjectManager(workspace)
+    pm.get_repo_map([])
+    rm = pm.repo_map
+    assert "a.py" not in rm.index_blob_ids
+
+    subprocess.run(["git", "add", "a.py"], cwd=workspace, check=True)
+    # Other chat files, so that the map isn't cached
+    pm.get_repo_map(["b.py"])
+    assert rm.index_blob_ids["a.py"]
+    assert rm.last_metrics.counts["changed_files"] == 1
+    assert rm.last_metrics.counts["parsed_files"] == 0
+
+
+def test_repo_map_shared_by_workspace(workspace):
+    pm = project.ProjectManager(workspace)
+    assert pm.cache_stats() == {}
+    repo_map = pm.get_repo_map([])
+    assert pm.cache_stats()["tags"] == {"misses": 2}
+
+    other = project.ProjectManager(workspace)
+    assert other.repo_map is pm.repo_map
+    # Rebuilt from the tag graph of the other manager, nothing is parsed again
+    assert other.get_repo_map([]) == repo_map
+    stats = other.cache_stats()
+    assert stats["tag_graph"] == {"misses": 2, "hits": 2}
+    assert stats["tags"] == {"misses": 2}
+    assert pm.cache_stats() == stats
+
+
+def test_repo_map_skips_submodules_and_symlinks(workspace):
+    (workspace / "sub").mkdir()
+    subprocess.run(
+        ["git", "update-index", "--add", "--cacheinfo", f"160000,{'1' * 40},sub"],
+        cwd=workspace,
+        check=True,
+    )
+    (workspace / "link.py").symlink_to("a.py")
+    subprocess.run(["git", "add", "link.py"], cwd=workspace, check=True)
+    pm = project.ProjectManager(workspace)
+    assert "sub" in pm.get_tracked_files()
+    assert "def alpha" in pm.get_repo_map([])
+
+
+def test_repo_map_not_stale_without_watcher(workspace):
+    pm = project.ProjectManager(workspace, file_watcher="off")
+    assert "def alpha" in pm.get_repo_map([])
+
+    (workspace / "a.py").write_text("def beta():\n    return 2\n")
+    # Slow builds are cached by the RepoMap, which outlives the manager
+    pm.repo_map.map_processing_time = 1.5
+    assert "def beta" in pm.get_repo_map([])
+
+    # Edits drop the cached maps too
+    assert pm.repo_map.map_cache
+    (workspace / "a.py").write_text("def gamma():\n    return 3\n")
+    pm.file_edited(
+        "a.py", "def beta():\n    return 2\n", "def gamma():\n    return 3\n", None
+    )
+    assert not pm.repo_map.map_cache
@@ -0,0 +1,147 @@
+import random
+
+import pytest
+
+from arox.codebase.ranking import (
+    RankedTags,
+    RankGraph,
+    TagGraph,
+    iter_largest,
+    rank_networkx,
+    rank_sparse,
+)
+from arox.codebase.tags import FileTags, Tag
+
+
+def sample_graph():
+    graph = RankGraph()
+    graph.add_edge("a.py", "b.py", 1.0, "foo")
+    graph.add_edge("a.py", "b.py", 2.0, "bar")
+    graph.add_edge("a.py", "c.py", 1.0, "baz")
+    graph.add_edge("b.py", "c.py", 0.5, "baz")
+    graph.add_edge("c.py", "a.py", 1.5, "main")
+    graph.add_edge("d.py", "d.py", 0.1, "unused")
+    # e.py only defines, it is a dangling node
+    graph.add_edge("c.py", "e.py", 3.0, "helper")
+    return graph
+
+
+def assert_same_ranks(expected, actual, tol=1e-6):
+    assert expected.keys() == actual.keys()
+    for key, rank in expected.items():
+        assert actual[key] == pytest.approx(rank, abs=tol)
+
+
+@pytest.mark.parametrize(
+    "personalization", [None, {"a.py": 1.0}, {"c.py": 2.0, "x.py": 5.0}]
+)
+def test_sparse_matches_networkx(personalization):
+    graph = sample_graph()
+
+    ranked, ranked_definitions = rank_sparse(graph, personalization)
+    nx_ranked, nx_ranked_definitions = rank_networkx(graph, personalization)
+
+    assert_same_ranks(nx_ranked, ranked)
+    assert_same_ranks(dict(nx_ranked_definitions), ranked_definitions)
+
+
+def test_sparse_empty_graph():
+    assert rank_sparse(RankGraph()) == ({}, {})
+
+
+def test_sparse_personalization_outside_graph():
+    with pytest.raises(ZeroDivisionError):
+        rank_sparse(sample_graph(), {"x.py": 1.0})
+
+
+def tag(rel_fname, name, kind, line=1):
+    return Tag(rel_fname, "/repo/" + rel_fname, line, name, kind)
+
+
+def file_tags(tags):
+    return FileTags.from_tags(tags[0].fname, tags[0].rel_fname, tags)
+
+
+def sorted_edges(graph):
+    return sorted(graph.edges())
+
+
+def test_tag_graph_updates_match_rebuild():
+    files = {
+        "a.py": [tag("a.py", "foo", "def"), tag("a.py", "bar", "ref")],
+        "b.py": [tag("b.py", "bar", "def"), tag("b.py", "foo", "ref")],
+        "c.py": [tag("c.py", "baz", "def"), tag("c.py", "foo", "ref")],
+    }
+    incremental = TagGraph()
+    for rel_fname, tags in files.items():
+        incremental.update_file(rel_fname, 1, file_tags(tags))
+    incremental.rank_graph()
+
+    files["b.py"] = [tag("b.py", "qux", "def"), tag("b.py", "baz", "ref")]
+    incremental.update_file("b.py", 2, file_tags(files["b.py"]))
+    del files["c.py"]
+    incremental.remove_file("c.py")
+
+    rebuilt = TagGraph()
+    for rel_fname, tags in files.items():
+        rebuilt.update_file(rel_fname, 1, file_tags(tags))
+
+    assert sorted_edges(incremental.rank_graph({"foo"})) == sorted_edges(
+        rebuilt.rank_graph({"foo"})
+    )
+    assert incremental.definitions == rebuilt.definitions
+    assert ("c.py", "baz") not in incremental.definitions
+
+
+def test_sparse_warm_start():
+    graph = sample_graph()
+    ranked, _ = rank_sparse(graph, {"a.py": 1.0})
+    warm_ranked, _ = rank_sparse(graph, {"a.py": 1.0}, nstart=ranked)
+    # Both runs stop once an iteration moves the ranks by less than
+    # len(graph) * 1e-6 in total.
+    assert_same_ranks(ranked, warm_ranked, tol=len(graph) * 1e-6)
+
+
+def test_iter_largest_matches_sort():
+    items = [random.Random(1).randrange(100) for _ in range(1000)]
+    assert list(iter_largest(items, chunk=3)) == sorted(items, reverse=True)
+    assert list(iter_largest([], chunk=3)) == []
+
+
+def test_ranked_tags_order():
+    definitions = {
+        ("a.py", "foo"): {tag("a.py", "foo", "def")},
+        ("b.py", "bar"): {tag("b.py", "bar", "def", 2)},
+        ("b.py", "baz"): {tag("b.py", "baz", "def", 3)},
+        ("chat.py", "qux"): {tag("chat.py", "qux", "def")},
+    }
+    ranked_definitions = {
+        ("a.py", "foo"): 0.1,
+        ("b.py", "bar"): 0.3,
+        ("b.py", "baz"): 0.2,
+        ("chat.py", "qux"): 0.9,
+        ("c.py", "gone"): 0.5,
+    }
+    ranked = {"a.py": 0.2, "b.py": 0.5, "c.py": 0.1, "d.py": 0.3, "chat.py": 0.9}
+    rel_fnames = ["a.py", "b.py", "c.py", "d.py", "e.py"]
+
+    ranked_tags = RankedTags(
+        ranked, ranked_definitions, definitions, {"chat.py"}, rel_fnames
+    )
+
+    expected = [
+        tag("b.py", "bar", "def", 2),
+        tag("b.py", "baz", "def", 3),
+        tag("a.py", "foo", "def"),
+        ("chat.py",),
+        ("d.py",),
+        ("c.py",),
+        ("e.py",),
+    ]
+    assert len(ranked_tags) == len(expected)
+    assert ranked_tags[:2] == expected[:2]
+    assert ranked_tags[4] == expected[4]
+    assert list(ranked_tags) == expected
+    assert ranked_tags[-1] == expected[-1]
+    assert ranked_tags.file_tags("b.py") == expected[:2]
+    assert ranked_tags.file_tags("d.py") == [("d.py",)]
@@ -0,0 +1,321 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from diskcache import Cache
+
+from arox.codebase import repomap
+from arox.codebase.repomap import (
+    BULK_READ_SIZE,
+    RepoMap,
+    cache_get_many,
+    extract_file_tags,
+)
+from arox.utils.git import git_blob_id
+from arox.utils.text_edit import text_edit
+
+SOURCE = """\
+def greet(name):
+    return f"Hello {name}"
+
+
+def main():
+    greet("world")
+"""
+
+
+@pytest.fixture
+def global_cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "global.cache"
+    monkeypatch.setattr(RepoMap, "GLOBAL_TAGS_CACHE_DIR", cache_dir)
+    return cache_dir
+
+
+def make_checkout(path):
+    path.mkdir()
+    (path / "hello.py").write_text(SOURCE)
+    return path / "hello.py"
+
+
+def test_git_blob_id_matches_git(tmp_path):
+    fname = tmp_path / "hello.py"
+    fname.write_text(SOURCE)
+    expected = subprocess.run(
+        ["git", "hash-object", str(fname)], capture_output=True, text=True
+    ).stdout.strip()
+    assert git_blob_id(fname.read_bytes()) == expected
+
+
+def test_global_tags_cache_is_shared_across_checkouts(tmp_path, global_cache_dir):
+    first = make_checkout(tmp_path / "first")
+    second = make_checkout(tmp_path / "second")
+
+    rm = RepoMap(root=str(first.parent), global_tags_cache=True)
+    tags = rm.get_tags_bulk([(str(first), "hello.py")])[str(first)]
+    assert rm.cache_stats["global_tags"] == {"misses": 1}
+
+    rm = RepoMap(root=str(second.parent), global_tags_cache=True)
+    rm.get_tags_raw = None  # a hit must not parse the file again
+    shared = rm.get_tags_bulk([(str(second), "hello.py")])[str(second)]
+    assert rm.cache_stats["global_tags"] == {"hits": 1}
+
+    assert [(t.name, t.kind, t.line) for t in shared] == [
+        (t.name, t.kind, t.line) for t in tags
+    ]
+    assert {t.fname for t in shared} == {str(second)}
+
+
+def test_global_tags_cache_is_keyed_by_language(tmp_path, global_cache_dir):
+    source = "function hello() {\n  return 1;\n}\n"
+    for name in ("util.ts", "util.js"):
+        checkout = tmp_path / name.replace(".", "_")
+        checkout.mkdir()
+        (checkout / name).write_text(source)
+
+    fname = str(tmp_path / "util_ts" / "util.ts")
+    rm = RepoMap(root=str(tmp_path / "util_ts"), global_tags_cache=True)
+    ts_tags = rm.get_tags_bulk([(fname, "util.ts")])[fname]
+
+    # Same content, but another language
+    fname = str(tmp_path / "util_js" / "util.js")
+    rm = RepoMap(root=str(tmp_path / "util_js"), global_tags_cache=True)
+    js_tags = rm.get_tags_bulk([(fname, "util.js")])[fname]
+    assert rm.cache_stats["global_tags"] == {"misses": 1}
+    assert ("hello", "def") in [(t.name, t.kind) for t in js_tags]
+    assert js_tags.to_record() != ts_tags.to_record()
+
+
+def make_project(path, num_files=30):
+    fnames = []
+    for i in range(num_files):
+        fname = path / f"mod{i}.py"
+        fname.write_text(
+            f"def func{i}(x):\n"
+            f"    return func{(i + 1) % num_files}(x)\n"
+            "\n"
+            "\n"
+            f"class Cls{i}:\n"
+            "    def method(self):\n"
+            f"        return func{(i * 7) % num_files}(self)\n"
+        )
+        fnames.append(str(fname))
+    return fnames
+
+
+@pytest.mark.parametrize("max_map_tokens", [64, 256, 1024])
+def test_ranked_tags_map_fits_budget(tmp_path, max_map_tokens):
+    fnames = make_project(tmp_path)
+    rm = RepoMap(root=str(tmp_path), map_workers=1)
+
+    tree = rm.get_ranked_tags_map_uncached([], fnames, max_map_tokens)
+
+    assert tree
+    assert rm.token_count(tree) <= max_map_tokens * 1.15
+
+
+def test_ranked_tags_map_includes_everything_within_budget(tmp_path):
+    fnames = make_project(tmp_path, num_files=5)
+    rm = RepoMap(root=str(tmp_path), map_workers=1)
+
+    tree = rm.get_ranked_tags_map_uncached([], fnames, 100_000)
+
+    ranked_tags = rm.get_ranked_tags([], fnames, set(), set())
+    assert tree == rm.to_tree(ranked_tags, set())
+
+
+def test_parallel_scan_matches_serial(tmp_path, monkeypatch):
+    fnames = make_project(tmp_path, num_files=6)
+    (tmp_path / "app.js").write_text("function start() {\n  run();\n}\n")
+    (tmp_path / "notes.txt").write_text("no tags here\n")
+    fnames += [str(tmp_path / "app.js"), str(tmp_path / "notes.txt")]
+    files = [(fname, os.path.basename(fname)) for fname in fnames]
+    monkeypatch.setattr(repomap, "PARALLEL_SCAN_THRESHOLD", 2)
+
+    serial = list(RepoMap(root=str(tmp_path), map_workers=1).extract_tags(files))
+    rm = RepoMap(root=str(tmp_path), map_workers=2)
+    assert list(rm.extract_tags(files)) == serial
+    assert all(kinds for _names, _name_ids, _lines, kinds in serial[:-1])
+
+    all_tags = rm.get_tags_bulk(files)
+    assert [all_tags[fname].to_record() for fname in fnames] == serial
+
+
+def test_map_metrics(tmp_path):
+    fnames = make_project(tmp_path, num_files=5)
+    rm = RepoMap(root=str(tmp_path), map_workers=1, refresh="files")
+    reported = []
+    rm.add_metrics_listener(reported.append)
+
+    rm.get_repo_map(fnames[:1], fnames[1:], max_map_tokens=1024)
+    rm.get_repo_map(fnames[:1], fnames[1:], max_map_tokens=1024)
+
+    built, cached = reported
+    assert built is not rm.last_metrics and cached is rm.last_metrics
+    assert not built.cached and cached.cached
+    assert built.counts["files"] == 5
+    assert built.counts["parsed_files"] == 5
+    assert built.counts["map_tokens"] == rm.token_count(rm.last_map)
+    assert built.phases["parse"] > 0 and built.phases["render"] > 0
+    assert built.hit_ratios()["tags"] == 0
+    assert cached.hit_ratios() == {"map": 1.0}
+
+
+def test_import_is_lazy():
+    # Loaded on first use, so that importing arox starts fast
+    heavy = ["diskcache", "git", "grep_ast", "prompt_toolkit", "pygments", "tqdm"]
+    code = (
+        "import sys, arox.codebase.project; "
+        f"print([m for m in {heavy!r} if m in sys.modules])"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert out.strip() == "[]"
+
+
+class ChangedCache(Cache):
+    """A Cache whose internals changed, bulk reads can't be used."""
+
+    disk = None
+
+
+class ChangedSchemaCache(Cache):
+    """A Cache whose table changed, bulk reads fail."""
+
+    def _sql(self, query, params=()):
+        if query.startswith("SELECT key, mode"):
+            raise sqlite3.OperationalError("no such column: mode")
+        return super()._sql(query, params)
+
+
+@pytest.mark.parametrize(
+    "make_cache",
+    [
+        dict,
+        lambda path: Cache(path),
+        lambda path: Cache(path, eviction_policy="least-recently-used"),
+        lambda path: ChangedCache(path),
+        lambda path: ChangedSchemaCache(path),
+    ],
+)
+def test_cache_get_many(tmp_path, make_cache):
+    cache = make_cache(tmp_path) if make_cache is not dict else {}
+    keys = [f"file{i}.py" for i in range(BULK_READ_SIZE + 10)]
+    for i, key in enumerate(keys[::2]):
+        cache[key] = {"version": i, "data": "x" * (i * 100)}
+
+    values = cache_get_many(cache, keys + ["missing.py"])
+
+    assert values == {key: cache[key] for key in keys[::2]}
+
+
+EDITED_SOURCE = """\
+import os
+
+LIMIT = 10
+
+
+def load(path):
+    return open(path).read()
+
+
+class Store:
+    def get(self, key):
+        return load(key)
+
+    def put(self, key, value):
+        save(key, value)
+
+
+def main():
+    Store().get("x")
+"""
+
+
+# Error recovery of the edited tree restructures the class below the edit
+BROKEN_SOURCE = """\
+def rank(graph, personalization):
+    if personalization:
+        p = array([personalization.get(n, 0) for n in graph])
+        p /= p.sum()
+    else:
+        p = uniform(graph)
+    return p
+
+
+class Store:
+    def __iter__(self):
+        return iter(load())
+"""
+
+
+@pytest.mark.parametrize(
+    "source, search, replace",
+    [
+        (
+            EDITED_SOURCE,
+            "        return load(key)",
+            "        data = load(key)\n        return parse(data)",
+        ),
+        (EDITED_SOURCE, "LIMIT = 10\n", ""),
+        (
+            EDITED_SOURCE,
+            "def main():",
+            "def run(argv):\n    helper()\n\n\ndef main():",
+        ),
+        (
+            EDITED_SOURCE,
+            "class Store:",
+            "class Store(Base):\n    size = compute()\n",
+        ),
+        (
+            EDITED_SOURCE,
+            '    Store().get("x")',
+            '    Store().get("x")\n    Store().put("y", 1)',
+        ),
+        # Leaves a syntax error
+        (BROKEN_SOURCE, "graph])\n", "graph])\n    else:\n"),
+    ],
+)
+def test_file_edited_matches_full_parse(tmp_path, source, search, replace):
+    fname = tmp_path / "store.py"
+    fname.write_text(source)
+    rm = RepoMap(root=str(tmp_path))
+    rm.file_edited(str(fname), None, source)
+
+    start = source.index(search)
+    edit = text_edit(source, start, start + len(search), replace)
+    new_source = source.replace(search, replace, 1)
+    fname.write_text(new_source)
+    rm.file_edited(str(fname), source, new_source, [edit])
+
+    incremental = rm.parsed_files.get(str(fname)).file_tags
+    full = extract_file_tags(str(fname), "store.py")
+    assert sorted(incremental) == sorted(full)
+    assert sorted(rm.get_tags(str(fname), "store.py")) == sorted(full)
+
+
+@pytest.mark.parametrize(
+    "map_tokens, chat_files, conversation_tokens, window, expected",
+    [
+        # Without a context window, map_tokens or the minimum
+        (None, [], 0, None, 1024),
+        (2000, ["a.py"], 50000, None, 2000),
+        # Derived from the window, times map_mul_no_files without chat files
+        (None, ["a.py"], 0, 16000, 1792),
+        (None, ["a.py"], 0, 200000, 4096),
+        (None, [], 0, 200000, 4096 * 8),
+        # Bounded by what the conversation leaves
+        (None, [], 0, 16000, 11776),
+        (None, ["a.py"], 195000, 200000, 768),
+        (1024, ["a.py"], 200000, 200000, 0),
+        (0, [], 0, 200000, 0),
+    ],
+)
+def test_get_map_tokens(
+    tmp_path, map_tokens, chat_files, conversation_tokens, window, expected
+):
+    rm = RepoMap(root=str(tmp_path), map_tokens=map_tokens, max_context_window=window)
+    assert rm.get_map_tokens(chat_files, conversation_tokens) == expected
@@ -0,0 +1,37 @@
+import pickle
+from collections import Counter
+
+from arox.codebase.tags import FileTags, Tag
+
+TAGS = [
+    Tag("a.py", "/repo/a.py", 0, "main", "def"),
+    Tag("a.py", "/repo/a.py", 1, "helper", "ref"),
+    Tag("a.py", "/repo/a.py", 4, "helper", "def"),
+    Tag("a.py", "/repo/a.py", 5, "helper", "ref"),
+    Tag("a.py", "/repo/a.py", -1, "print", "ref"),
+]
+
+
+def test_file_tags_round_trip():
+    file_tags = FileTags.from_tags("/repo/a.py", "a.py", TAGS)
+    record = pickle.loads(pickle.dumps(file_tags.to_record()))
+
+    loaded = FileTags.from_record("/repo/a.py", "a.py", record)
+
+    assert list(loaded) == TAGS
+    assert loaded.names == ("main", "helper", "print")
+
+
+def test_file_tags_record_has_no_file_names():
+    file_tags = FileTags.from_tags("/repo/a.py", "a.py", TAGS)
+    moved = FileTags.from_record("/other/b.py", "b.py", file_tags.to_record())
+
+    assert {(tag.rel_fname, tag.fname) for tag in moved} == {("b.py", "/other/b.py")}
+
+
+def test_file_tags_definitions_and_references():
+    file_tags = FileTags.from_tags("/repo/a.py", "a.py", TAGS)
+
+    assert list(file_tags.definitions()) == [TAGS[0], TAGS[2]]
+    assert file_tags.reference_counts() == Counter({"helper": 2, "print": 1})
+    assert len(FileTags("/repo/empty.py", "empty.py")) == 0
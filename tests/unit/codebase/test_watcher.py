@@ -0,0 +1,87 @@
+from arox.codebase import project, watcher
+from arox.codebase.watcher import GIT_INDEX, ChangeSet, PollingWatcher
+
+
+def test_change_set_is_unknown_until_first_take():
+    change_set = ChangeSet()
+    change_set.add("a.py")
+    assert change_set.take() is None
+    assert change_set.take() == set()
+
+    change_set.add("a.py")
+    assert change_set.take() == {"a.py"}
+    change_set.add("b.py")
+    change_set.reset()
+    assert change_set.take() is None
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / "a.py").write_text("a = 1\n")
+    (tmp_path / "b.py").write_text("b = 1\n")
+    watcher = PollingWatcher(tmp_path)
+    changes = watcher.subscribe()
+    changes.take()
+
+    watcher.watch_paths(["a.py", "b.py"])
+    watcher.scan()
+    # New paths are reported once
+    assert changes.take() == {"a.py", "b.py", GIT_INDEX}
+    watcher.scan()
+    assert changes.take() == set()
+
+    (tmp_path / "a.py").write_text("a = 22\n")
+    (tmp_path / "b.py").unlink()
+    watcher.scan()
+    assert changes.take() == {"a.py", "b.py"}
+
+
+def test_auto_watcher_does_not_poll(tmp_path, monkeypatch):
+    def no_watchdog(self):
+        raise ImportError("No module named 'watchdog'")
+
+    monkeypatch.setattr(watcher.WatchdogWatcher, "start", no_watchdog)
+    assert watcher.create_watcher(tmp_path, "auto") is None
+    polling = watcher.create_watcher(tmp_path, "watchdog", poll_interval=60)
+    try:
+        assert isinstance(polling, PollingWatcher)
+    finally:
+        polling.stop()
+
+
+def test_path_changed_ignores_caches(tmp_path):
+    watcher = PollingWatcher(tmp_path)
+    changes = watcher.subscribe()
+    changes.take()
+    watcher.path_changed(tmp_path / ".arox" / "tags.cache" / "cache.db")
+    watcher.path_changed(tmp_path / ".git" / "index.lock")
+    watcher.path_changed(tmp_path / ".git" / "index")
+    watcher.path_changed(tmp_path / "src" / "main.py")
+    watcher.path_changed("/elsewhere/main.py")
+    assert changes.take() == {GIT_INDEX, "src/main.py"}
+
+
+def test_project_manager_reuses_map_without_changes(workspace, monkeypatch):
+    watcher = PollingWatcher(workspace)
+    monkeypatch.setattr(
+        project.watcher, "create_watcher", lambda root, backend: watcher
+    )
+    pm = project.ProjectManager(workspace, file_watcher="poll")
+    pm.get_repo_map([])
+    # The first scan reports the newly watched files
+    watcher.scan()
+    first = pm.get_repo_map([])
+    assert "def alpha" in first
+    watcher.scan()
+
+    def fail(*args):
+        raise AssertionError("nothing changed")
+
+    with monkeypatch.context() as m:
+        m.setattr(pm.repo_map, "get_repo_map", fail)
+        m.setattr(project, "get_index_blob_ids", fail)
+        assert pm.get_repo_map([]) == first
+        assert pm.get_tracked_files() == ["a.py", "b.py"]
+
+    (workspace / "a.py").write_text("def beta():\n    return 1\n")
+    watcher.scan()
+    assert "def beta" in pm.get_repo_map([])
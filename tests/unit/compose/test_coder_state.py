@@ -0,0 +1,95 @@
+import subprocess
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from arox.compose.coder.state import CoderState
+from arox.compose.git_commit import GitCommitAgent
+
+
+def coder_state(workspace, **agent_config):
+    agent = SimpleNamespace(
+        system_prompt="",
+        workspace=workspace,
+        provider_model=None,
+        agent_config={"repo_map": True, "file_watcher": "off", **agent_config},
+    )
+    return CoderState(agent)
+
+
+@pytest.mark.asyncio
+async def test_prewarm_repo_map(workspace):
+    state = coder_state(workspace)
+    pm = state.project_manager
+    assert pm.repo_map_status() == "not built yet"
+    state.prewarm_repo_map(None)
+    assert pm.building
+    assert "def alpha" in await pm.get_repo_map_async([])
+    assert pm.repo_map_status().startswith("ready, built in")
+
+    # The map was sent, it won't be again
+    state.message_meta["repo_map"] = True
+    build = pm._build
+    state.prewarm_repo_map(None)
+    assert pm._build is build
+
+    state = coder_state(workspace, repo_map_prewarm=False)
+    state.prewarm_repo_map(None)
+    assert state.project_manager.repo_map_status() == "not built yet"
+
+
+@pytest.mark.asyncio
+async def test_repo_map_without_prepare_prompt(workspace, monkeypatch):
+    state = coder_state(workspace)
+    pm = state.project_manager
+    get_repo_map = pm.get_repo_map
+
+    def off_the_loop(*args, **kwargs):
+        assert threading.current_thread() is not threading.main_thread()
+        return get_repo_map(*args, **kwargs)
+
+    monkeypatch.setattr(pm, "get_repo_map", off_the_loop)
+
+    # No map yet, one is built for the next message
+    items = state._get_message_items("")
+    assert "repo_map" not in dict(items)
+    assert pm.building
+    await pm._build[1]
+
+    items = state._get_message_items("")
+    assert "def alpha" in dict(items)["repo_map"]
+    assert state.message_meta["repo_map"]
+
+
+def test_repo_map_tokens(workspace):
+    state = coder_state(workspace)
+    # Unknown context window, fixed budget
+    assert state.repo_map_tokens() == 1024
+
+    # Derived from the window of the model, bigger with no file in the chat
+    state.agent.provider_model = "openai/gpt-4o"
+    assert state.repo_map_tokens() == 4096 * 8
+
+    state.agent.agent_config["max_context_window"] = {"openai/gpt-4o": 16384}
+    assert state.repo_map_tokens() == 2048 * 8 - 4096
+
+
+@pytest.mark.asyncio
+async def test_commit_listener(workspace):
+    subprocess.run(["git", "config", "user.name", "test"], check=True)
+    subprocess.run(["git", "config", "user.email", "test@example.com"], check=True)
+    # Without an LLM, the commit message is given
+    agent = GitCommitAgent.__new__(GitCommitAgent)
+    agent.commit_listeners = []
+    commits = []
+
+    def fail(commit):
+        raise RuntimeError("listener failed")
+
+    agent.add_commit_listener(fail)
+    agent.add_commit_listener(commits.append)
+    result = await agent.commit_changes("Add alpha")
+    [commit] = commits
+    assert result == f"Committed {commit.hexsha}"
+    assert commit.message == "Add alpha"
@@ -0,0 +1,40 @@
+import subprocess
+
+import pytest
+
+from arox.codebase import project
+
+SOURCES = {
+    "a.py": "def alpha():\n    return 1\n",
+    "b.py": "from a import alpha\n\nalpha()\n",
+}
+
+
+@pytest.fixture
+def shared_state(monkeypatch):
+    """Forget the repo maps and watchers shared per workspace."""
+    monkeypatch.setattr(project, "_repo_maps", {})
+    monkeypatch.setattr(project, "_watchers", {})
+
+
+@pytest.fixture
+def make_checkout(shared_state):
+    """Return a function writing SOURCES to a new git repository at a path,
+    with the files staged."""
+
+    def make_checkout(root):
+        root.mkdir(exist_ok=True)
+        for name, source in SOURCES.items():
+            (root / name).write_text(source)
+        subprocess.run(["git", "init", "-q"], cwd=root, check=True)
+        subprocess.run(["git", "add", "."], cwd=root, check=True)
+        return root
+
+    return make_checkout
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, make_checkout):
+    """A checkout of SOURCES, as the working directory."""
+    monkeypatch.chdir(tmp_path)
+    return make_checkout(tmp_path)
@@ -1,6 +1,6 @@
 import pytest
 
-from arox.config import ArgumentGroup, Config, TomlConfigParser
+from arox.config import ArgumentGroup, Config, TomlConfigParser, get_context_window
 
 
 def test_config_basic_parsing(tmp_path):
@@ -131,3 +131,17 @@ def test_parse_dot_config():
     args = ["valid.key=value", "invalid_entry", "another.valid=123"]
     result = parse_dot_config(args)
     assert result == {"valid": {"key": "value"}, "another": {"valid": 123}}
+
+
+def test_get_context_window():
+    assert get_context_window("openai/gpt-4o-mini") == 128000
+    assert get_context_window("gpt-4") == 8192
+    assert get_context_window("anthropic/Claude-Sonnet-4") == 200000
+    assert get_context_window("unknown-model") is None
+    assert get_context_window(None) is None
+
+    # The max_context_window option takes precedence
+    assert get_context_window("gpt-4", 32768) == 32768
+    assert get_context_window("openai/gpt-4o", {"openai/gpt-4o": 64000}) == 64000
+    assert get_context_window("deepseek/deepseek-chat", {"deepseek": 65536}) == 65536
+    assert get_context_window("openai/gpt-4o", {"deepseek": 65536}) == 128000
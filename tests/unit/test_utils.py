@@ -1,10 +1,17 @@
+import os
+import threading
 from unittest.mock import patch
 
 import pytest
 from prompt_toolkit.input import create_pipe_input
 from prompt_toolkit.output import DummyOutput
 
-from arox.utils import deep_merge, run_command, user_input_generator
+from arox.utils import deep_merge, run_command, tokens, user_input_generator
+from arox.utils.cache import LRUCache
+from arox.utils.git import get_index_blob_ids, git_blob_id
+from arox.utils.importtime import format_import_time, measure_import_time
+from arox.utils.io import ContentStore, read_text
+from arox.utils.tokens import SAMPLE_THRESHOLD, TokenCounter
 
 
 def test_deep_merge_basic():
@@ -77,3 +84,174 @@ async def test_run_command_failure():
         assert stdout == ""
         assert stderr == "error"
         assert returncode == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(10, sizeof=len)
+    cache["a"] = "xxxx"
+    cache["b"] = "xxxx"
+    assert cache.get("a") == "xxxx"
+
+    cache["c"] = "xxxx"
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.size == 8
+    assert cache.stats == {"hits": 1, "evictions": 1}
+
+
+def test_lru_cache_replaces_and_skips_oversized_values():
+    cache = LRUCache(10, sizeof=len)
+    cache["a"] = "xxxx"
+    cache["a"] = "xxxxxx"
+    assert cache.size == 6
+
+    cache["b"] = "x" * 11
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.size == 6
+    assert cache.stats["misses"] == 1
+
+
+def test_content_store_reads_each_version_once(tmp_path, monkeypatch):
+    store = ContentStore()
+    fname = tmp_path / "a.py"
+    fname.write_text("x = 1\n")
+    assert store.read_text(fname) == "x = 1\n"
+
+    def fail(*args):
+        raise AssertionError("file read again")
+
+    monkeypatch.setattr(store, "_read", fail)
+    assert store.read_text(str(fname)) == "x = 1\n"
+
+    monkeypatch.undo()
+    fname.write_text("x = 22\n")
+    assert store.read_text(fname) == "x = 22\n"
+
+
+def test_content_store_is_thread_safe(tmp_path):
+    fnames = []
+    for i in range(50):
+        fname = tmp_path / f"f{i}.py"
+        fname.write_text(f"x = {i}\n" * 100)
+        fnames.append(fname)
+    # Evicts on most reads
+    store = ContentStore(max_size=5000)
+
+    def read_all():
+        for _ in range(20):
+            for fname in fnames:
+                store.read_text(fname)
+
+    threads = [threading.Thread(target=read_all) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    entries = store.cache._entries.values()
+    assert store.cache.size == sum(size for _content, size in entries)
+    assert store.cache.size <= 5000
+
+
+@pytest.mark.parametrize("mmap_threshold", [0, 2**20])
+def test_content_store_decodes_like_read_text(tmp_path, mmap_threshold):
+    store = ContentStore(mmap_threshold=mmap_threshold)
+    fname = tmp_path / "a.txt"
+    fname.write_bytes("café\r\nline\rend".encode())
+    assert store.read_text(fname) == read_text(fname)
+
+    fname.write_bytes(b"\xff\xfe")
+    assert store.read_text(fname) is None
+
+
+class WordEncoding:
+    """Stands for a tokenizer, one token per word."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, disallowed_special=()):
+        self.calls += 1
+        return text.split()
+
+
+def test_token_counter_estimates_without_tokenizer():
+    counter = TokenCounter()
+    assert not counter.exact
+    assert counter.count("") == 0
+    assert counter.count("x" * 400) == 100
+    # CJK chars are about a token each
+    assert counter.count("# 中文注释" + "x" * 40) == 4 + 10
+
+
+def test_token_counter_caches():
+    counter = TokenCounter()
+    counter.encoding = encoding = WordEncoding()
+    text = "alpha beta gamma delta\n" * 10
+    assert counter.count(text) == 40
+    assert counter.count(text) == 40
+    assert encoding.calls == 1
+    assert counter.count(text + "epsilon") == 41
+
+    # Long texts are extrapolated from a sample of their lines
+    long_text = "one two three four five six seven eight\n" * SAMPLE_THRESHOLD
+    assert counter.count(long_text) == 8 * SAMPLE_THRESHOLD
+
+
+def test_token_counter_calibrates_estimates(monkeypatch):
+    monkeypatch.setattr(tokens, "CALIBRATION_CHARS", 1000)
+    counter = TokenCounter()
+    counter.encoding = encoding = WordEncoding()
+    assert not counter.calibrated(".py")
+    line = "alpha beta gamma delta\n"
+    assert counter.count(line * 50, ".py") == 200
+    assert counter.calibrated(".py")
+    assert counter.chars_per_token(".py") == len(line) / 4
+    assert counter.chars_per_token(".md") == tokens.CHARS_PER_TOKEN
+
+    # Long texts of a calibrated kind are estimated without the tokenizer
+    calls = encoding.calls
+    assert counter.count(line * SAMPLE_THRESHOLD, ".py") == 4 * SAMPLE_THRESHOLD
+    assert encoding.calls == calls
+    counter.count(line * SAMPLE_THRESHOLD, ".md")
+    assert encoding.calls == calls + 1
+
+
+def test_import_time():
+    rows = measure_import_time("json")
+    names = [name for name, _self_us, _cumulative_us in rows]
+    assert names[-1] == "json"
+    assert "json.decoder" in names
+    assert format_import_time("json").startswith("Importing json took")
+
+
+def test_get_index_blob_ids(tmp_path):
+    git = pytest.importorskip("git")
+    for name in ("clean", "modified", "staged", "restaged", "touched"):
+        (tmp_path / f"{name}.py").write_text(f"{name} = 1\n")
+    repo = git.Repo.init(tmp_path)
+    repo.git.add(".")
+    # Git only trusts the stat cache of files older than the index
+    index_mtime = (tmp_path / ".git" / "index").stat().st_mtime
+    for path in tmp_path.glob("*.py"):
+        os.utime(path, (index_mtime - 10, index_mtime - 10))
+    repo.git.update_index("--refresh")
+
+    (tmp_path / "modified.py").write_text("modified = 2\n")
+    (tmp_path / "staged.py").write_text("staged = 2\n")
+    repo.git.add("staged.py")
+    (tmp_path / "restaged.py").write_text("restaged = 2\n")
+    repo.git.add("restaged.py")
+    (tmp_path / "restaged.py").write_text("restaged = 3\n")
+    os.utime(tmp_path / "touched.py")
+    # Neither a symlink nor a submodule is a file version
+    (tmp_path / "link.py").symlink_to("clean.py")
+    repo.git.add("link.py")
+    repo.git.update_index("--add", "--cacheinfo", f"160000,{'1' * 40},sub")
+
+    blob_ids = get_index_blob_ids(repo)
+    assert blob_ids == {
+        "clean.py": git_blob_id(b"clean = 1\n"),
+        "staged.py": git_blob_id(b"staged = 2\n"),
+    }
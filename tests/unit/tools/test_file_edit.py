@@ -37,6 +37,23 @@ class TestFileEdit:
             assert "Successfully wrote to" in result
             assert file_path.read_text() == new_content
 
+    @pytest.mark.asyncio
+    async def test_write_to_file_overwrite_binary(self):
+        """Test overwriting a file that isn't UTF-8, with a listener"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / "test.txt"
+            file_path.write_bytes(b"\xff\xfe\x00binary")
+
+            tool = FileEdit(None)
+            calls = []
+            tool.add_edit_listener(lambda *args: calls.append(args))
+            result = await tool.write_to_file(str(file_path), "New content")
+
+            assert "Successfully wrote to" in result
+            assert file_path.read_text() == "New content"
+            [(_path, old_content, _new_content, _edits)] = calls
+            assert old_content is None
+
     @pytest.mark.asyncio
     async def test_write_to_file_create_directories(self):
         """Test creating directories when they don't exist"""
@@ -126,3 +143,29 @@ from pathlib import Path
         """Test replacement on non-existent file"""
         result = await self.tool.replace_in_file("/nonexistent/file.py", "some diff")
         assert "File not found" in result
+
+    @pytest.mark.asyncio
+    async def test_replace_in_file_notifies_edits(self):
+        """Test listeners get edits turning the old content into the new one"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / "test.py"
+            original_content = "x = 1\ny = 2\n"
+            file_path.write_text(original_content)
+            diff = """<<<<<<< SEARCH
+y = 2
+=======
+y = 3
+z = 4
+>>>>>>> REPLACE"""
+
+            tool = FileEdit(None)
+            calls = []
+            tool.add_edit_listener(lambda *args: calls.append(args))
+            await tool.replace_in_file(str(file_path), diff)
+
+            [(path, old_content, new_content, edits)] = calls
+            assert old_content == original_content
+            assert new_content == "x = 1\ny = 3\nz = 4\n"
+            assert [
+                (e.start_point, e.old_end_point, e.new_end_point) for e in edits
+            ] == [((1, 0), (1, 5), (2, 5))]